@@ -0,0 +1,73 @@
+"""Time to read raw Bayer cine frames with each demosaic mode.
+
+Raw color cine files (compression 2) store one color per pixel. This script
+times get_frames(out=...) per frame for demosaic='raw', 'bilinear' and
+'superpixel', for a few frame sizes.
+
+    python benchmarks/demosaic.py [--sizes 512 1024 2048] [--frames 8]
+
+The file is written to a temporary directory and read from the page cache,
+so this measures the reader rather than the disk.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import pims
+from pims.cine import CFA_BAYER
+from pims.utils.synthetic import write_cine
+
+MODES = ['raw', 'bilinear', 'superpixel']
+
+
+def time_per_frame(reader, repeat):
+    """Shortest time of get_frames(out=...) over `repeat` calls, in ms per
+    frame."""
+    out = np.empty((len(reader), ) + reader[0].shape, reader.pixel_type)
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        reader.get_frames(out=out)
+        times.append(time.time() - start)
+    return 1000 * min(times) / len(reader)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[512, 1024, 2048])
+    parser.add_argument('--frames', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('{0} frames of 16 bit per size, on one core'.format(
+            args.frames))
+        print('size       ' + ''.join('{0:>12s} (ms)'.format(mode)
+                                      for mode in MODES))
+        for size in args.sizes:
+            filename = os.path.join(tempdir, 'bayer{0}.cine'.format(size))
+            mosaics = np.random.RandomState(0).randint(
+                0, 2**12, (args.frames, size, size)).astype(np.uint16)
+            write_cine(filename, mosaics, compression=2, cfa=CFA_BAYER)
+            del mosaics
+            results = []
+            for mode in MODES:
+                reader = pims.Cine(filename, demosaic=mode)
+                results.append(time_per_frame(reader, args.repeat))
+                reader.close()
+            print('{0:4d}x{0:<4d} '.format(size) +
+                  ''.join('{0:17.2f}'.format(t) for t in results))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
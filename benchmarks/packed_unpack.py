@@ -0,0 +1,109 @@
+"""Time to unpack 10 and 12 bit packed cine frames.
+
+Packed cine files store 4 pixels in 5 bytes (10 bit) or 2 pixels in 3 bytes
+(12 bit). This script times the unpack kernels on one frame, against the
+chunked loop that pims used before they were vectorized, and the reader on
+single frames and on get_frames(out=...).
+
+    python benchmarks/packed_unpack.py [--size 1024] [--frames 16]
+
+The file is written to a temporary directory and read from the page cache,
+so this measures the reader rather than the disk.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import pims
+from pims.cine import (_ten2sixteen, _twelve2sixteen, _sixteen2ten,
+                       _sixteen2twelve)
+from pims.utils.synthetic import write_cine
+
+CHUNK_SIZE = 6 * 10 ** 5
+
+
+def chunked_ten2sixteen(a):
+    """The 10 bit unpack of pims before it was vectorized."""
+    b = np.zeros(a.size//5*4, dtype='u2')
+    for j in range(0, len(a), CHUNK_SIZE):
+        (a0, a1, a2, a3, a4) = [a[j+i:j+CHUNK_SIZE:5].astype('u2')
+                                for i in range(5)]
+        k = j//5 * 4
+        k2 = k + CHUNK_SIZE//5 * 4
+        b[k+0:k2:4] = ((a0 & 0b11111111) << 2) + ((a1 & 0b11000000) >> 6)
+        b[k+1:k2:4] = ((a1 & 0b00111111) << 4) + ((a2 & 0b11110000) >> 4)
+        b[k+2:k2:4] = ((a2 & 0b00001111) << 6) + ((a3 & 0b11111100) >> 2)
+        b[k+3:k2:4] = ((a3 & 0b00000011) << 8) + ((a4 & 0b11111111) >> 0)
+    return b
+
+
+def chunked_twelve2sixteen(a):
+    """The 12 bit unpack of pims before it was vectorized."""
+    b = np.zeros(a.size//3*2, dtype='u2')
+    for j in range(0, len(a), CHUNK_SIZE):
+        (a0, a1, a2) = [a[j+i:j+CHUNK_SIZE:3].astype('u2') for i in range(3)]
+        k = j//3 * 2
+        k2 = k + CHUNK_SIZE//3 * 2
+        b[k+0:k2:2] = ((a0 & 0xFF) << 4) + ((a1 & 0xF0) >> 4)
+        b[k+1:k2:2] = ((a1 & 0x0F) << 8) + ((a2 & 0xFF) >> 0)
+    return b
+
+
+def best_time(func, repeat):
+    """Shortest of `repeat` calls of func, in ms."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return 1000 * min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--frames', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        print('{0} frames of {1}x{1} pixels'.format(args.frames, args.size))
+        print('bits  kernel: chunked (ms)  vectorized (ms)  '
+              'get_frame (ms)  get_frames(out) (ms)')
+        for bits, pack, unpack, chunked in [
+                (10, _sixteen2ten, _ten2sixteen, chunked_ten2sixteen),
+                (12, _sixteen2twelve, _twelve2sixteen,
+                 chunked_twelve2sixteen)]:
+            frames = np.random.RandomState(0).randint(
+                0, 2**bits, (args.frames, args.size, args.size)
+            ).astype(np.uint16)
+            image_data = [pack(f).tobytes() for f in frames]
+            packed = np.frombuffer(image_data[0], np.uint8)
+            assert np.array_equal(unpack(packed), chunked(packed))
+
+            filename = os.path.join(tempdir, 'packed{0}.cine'.format(bits))
+            write_cine(filename, frames, image_data=image_data)
+            reader = pims.Cine(filename)
+            out = np.empty(frames.shape, np.uint16)
+            reader.get_frames(out=out)
+            assert np.array_equal(out, frames)
+
+            print('{0:4d}  {1:20.2f}  {2:15.2f}  {3:14.2f}  {4:20.2f}'.format(
+                bits, best_time(lambda: chunked(packed), args.repeat),
+                best_time(lambda: unpack(packed), args.repeat),
+                best_time(lambda: reader.get_frame(0), args.repeat),
+                best_time(lambda: reader.get_frames(out=out), args.repeat)))
+            reader.close()
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Throughput of get_frame called from several threads at once.
+
+Cine, NorpixSeq and SpeStack read frames at absolute offsets (os.preadv or
+os.pread), without a lock around a shared file position. This script
+measures frames per second for a growing number of threads, and compares
+with reads that are serialized by a lock, as they used to be.
+
+    python benchmarks/threaded_reads.py [--frames 200] [--size 1024]
+
+The file is written to a temporary directory and read from the page cache,
+so this measures the reader rather than the disk. Threads only scale on a
+machine with more than one core; the number of CPUs is printed with the
+results.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+import pims
+from pims.utils.misc import FileLocker, PositionalFile
+from pims.utils.synthetic import write_cine
+
+
+class LockedFile(PositionalFile):
+    """Serialize all reads, like a shared file object behind a lock."""
+    def readinto(self, arr, offset):
+        with FileLocker(self._lock):
+            return super(LockedFile, self).readinto(arr, offset)
+
+
+def throughput(reader, threads, repeat):
+    n = len(reader)
+    indices = np.random.RandomState(0).permutation(n * repeat) % n
+    out = [np.empty(reader[0].shape, reader.pixel_type)
+           for _ in range(threads)]
+
+    def read(chunk):
+        buf = out[chunk[0] % threads]
+        for i in chunk:
+            reader.get_frame(i, out=buf)
+
+    chunks = np.array_split(indices, threads * 4)
+    start = time.time()
+    pool = ThreadPool(threads)
+    try:
+        pool.map(read, chunks)
+    finally:
+        pool.close()
+    return len(indices) / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'benchmark.cine')
+        frames = np.random.RandomState(0).randint(
+            0, 2**16, (args.frames, args.size, args.size)).astype(np.uint16)
+        write_cine(filename, frames)
+        del frames
+        print('{0} frames of {1}x{1} uint16, {2} CPUs'.format(
+            args.frames, args.size, cpu_count()))
+        print('threads  positional (frames/s)  locked (frames/s)')
+        for threads in args.threads:
+            reader = pims.Cine(filename)
+            positional = throughput(reader, threads, args.repeat)
+            reader._reader = LockedFile(reader.f, reader.file_lock)
+            locked = throughput(reader, threads, args.repeat)
+            reader.close()
+            print('{0:7d}  {1:22.0f}  {2:17.0f}'.format(threads, positional,
+                                                        locked))
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
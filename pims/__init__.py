@@ -1,4 +1,23 @@
 from pims.api import *
+import importlib as _importlib
+
+
+def __getattr__(name):
+    # Some readers are loaded on first use; see pims.api. Submodules that
+    # `import pims` used to import are imported on first access as well.
+    from pims import api
+    if name in api._lazy_readers:
+        return getattr(api, name)
+    if not name.startswith('_'):
+        try:
+            return _importlib.import_module('pims.' + name)
+        except ImportError:
+            # only hide the error if there is no such submodule, not if
+            # importing the submodule failed
+            from importlib.util import find_spec
+            if find_spec('pims.' + name) is not None:
+                raise
+    raise AttributeError("module 'pims' has no attribute {0!r}".format(name))
 
 from ._version import get_versions
 __version__ = get_versions()['version']
@@ -2,22 +2,30 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 from slicerator import pipeline
-from pims.base_frames import FramesSequence, FramesSequenceND
+from pims.base_frames import (FramesSequence, FramesSequenceND, _FramesMeta,
+                              ProbeInfo)
 from pims.frame import Frame
 from pims.display import (export, play, scrollable_stack, to_rgb, normalize,
                           plot_to_frame, plots_to_frame)
 
 import six
 import glob
+import io
 import os
+import struct
+import sys
+import importlib
+from multiprocessing.pool import ThreadPool
 from warnings import warn
 
 # has to be here for API stuff
 from pims.image_sequence import ImageSequence, ImageSequenceND  # noqa
 from .cine import Cine  # noqa
 from .norpix_reader import NorpixSeq  # noqa
-from pims.tiff_stack import TiffStack_tifffile  # noqa
 from .spe_stack import SpeStack
+from pims.cache import CachedFrames
+from pims.prefetch import prefetch
+from pims.parallel import map_frames
 
 
 def not_available(requirement):
@@ -26,56 +34,115 @@ def not_available(requirement):
             "This reader requires {0}.".format(requirement))
     return raiser
 
-try:
-    import pims.pyav_reader
-    if pims.pyav_reader.available():
-        Video = pims.pyav_reader.PyAVVideoReader
-    else:
-        raise ImportError()
-except (ImportError, IOError):
-    Video = not_available("PyAV and/or PIL/Pillow")
-
-import pims.tiff_stack
-from pims.tiff_stack import (TiffStack_pil, TiffStack_libtiff,
-                                TiffStack_tifffile)
-# First, check if each individual class is available
-# and drop in placeholders as needed.
-if not pims.tiff_stack.tifffile_available():
-    TiffStack_tiffile = not_available("tifffile")
-if not pims.tiff_stack.libtiff_available():
-    TiffStack_libtiff = not_available("libtiff")
-if not pims.tiff_stack.PIL_available():
-    TiffStack_pil = not_available("PIL or Pillow")
-# Second, decide which class to assign to the
-# TiffStack alias.
-if pims.tiff_stack.tifffile_available():
-    TiffStack = TiffStack_tifffile
-elif pims.tiff_stack.libtiff_available():
-    TiffStack = TiffStack_libtiff
-elif pims.tiff_stack.PIL_available():
-    TiffStack = TiffStack_pil
-else:
-    TiffStack = not_available("tifffile, libtiff, or PIL/Pillow")
-
-
-try:
-    import pims.bioformats
-    if pims.bioformats.available():
-        Bioformats = pims.bioformats.BioformatsReader
-    else:
-        raise ImportError()
-except (ImportError, IOError):
-    BioformatsRaw = not_available("JPype")
-    Bioformats = not_available("JPype")
-
-
-try:
-    from pims_nd2 import ND2_Reader
-except ImportError:
-    ND2_Reader = not_available("pims_nd2")
-
-
-def open(sequence, process_func=None, dtype=None, as_grey=False, plugin=None):
+
+# Readers that depend on packages that are slow to import (PyAV, tifffile,
+# JPype, ...) are loaded on first access, e.g. of pims.Video, rather than by
+# `import pims`. Each loader returns the reader class, or a placeholder that
+# raises ImportError if its requirements are missing.
+
+def _load_video():
+    try:
+        import pims.pyav_reader
+        if pims.pyav_reader.available():
+            return pims.pyav_reader.PyAVVideoReader
+    except (ImportError, IOError):
+        pass
+    return not_available("PyAV")
+
+
+def _load_tiff_reader(name):
+    import pims.tiff_stack
+    available, requirement = {
+        'TiffStack_tifffile': (pims.tiff_stack.tifffile_available,
+                               "tifffile"),
+        'TiffStack_libtiff': (pims.tiff_stack.libtiff_available, "libtiff"),
+        'TiffStack_pil': (pims.tiff_stack.PIL_available, "PIL or Pillow"),
+    }[name]
+    if available():
+        return getattr(pims.tiff_stack, name)
+    return not_available(requirement)
+
+
+def _load_tiff_stack():
+    # Use the first available of tifffile, libtiff and PIL/Pillow.
+    for name in ('TiffStack_tifffile', 'TiffStack_libtiff', 'TiffStack_pil'):
+        reader = _load_tiff_reader(name)
+        if isinstance(reader, type):
+            return reader
+    return not_available("tifffile, libtiff, or PIL/Pillow")
+
+
+def _load_bioformats():
+    try:
+        import pims.bioformats
+        if pims.bioformats.available():
+            return pims.bioformats.BioformatsReader
+    except (ImportError, IOError):
+        pass
+    return not_available("JPype")
+
+
+def _load_nd2():
+    try:
+        from pims_nd2 import ND2_Reader
+    except ImportError:
+        return not_available("pims_nd2")
+    return ND2_Reader
+
+
+_lazy_readers = {
+    'Video': _load_video,
+    'TiffStack': _load_tiff_stack,
+    'TiffStack_tifffile': lambda: _load_tiff_reader('TiffStack_tifffile'),
+    'TiffStack_libtiff': lambda: _load_tiff_reader('TiffStack_libtiff'),
+    'TiffStack_pil': lambda: _load_tiff_reader('TiffStack_pil'),
+    'Bioformats': _load_bioformats,
+    'ND2_Reader': _load_nd2,
+}
+
+
+def __getattr__(name):
+    try:
+        loader = _lazy_readers[name]
+    except KeyError:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(
+            __name__, name))
+    reader = loader()
+    globals()[name] = reader
+    return reader
+
+
+if sys.version_info < (3, 7):
+    # no module-level __getattr__; load everything right away
+    for _name in _lazy_readers:
+        globals()[_name] = _lazy_readers[_name]()
+
+
+# Modules defining readers that pims.open may need, by the file extensions
+# they handle. Only the modules for the extension being opened are imported;
+# their readers are then found as subclasses of FramesSequence.
+_reader_modules = {
+    'pims.tiff_stack': {'tif', 'tiff', 'lsm', 'stk'},
+    'pims.pyav_reader': {'mov', 'avi', 'mp4'},
+    'pims.bioformats': {'lsm', 'ipl', 'dm3', 'seq', 'nd2', 'ics', 'ids',
+                        'mov', 'ipw', 'tif', 'tiff', 'jpg', 'bmp', 'lif'},
+    'pims_nd2': {'nd2'},
+}
+
+
+def _import_reader_modules(ext):
+    # import_module returns right away if the module has been imported, and
+    # waits if another thread (e.g. of probe_many) is still importing it.
+    for module, exts in _reader_modules.items():
+        if ext in exts:
+            try:
+                importlib.import_module(module)
+            except (ImportError, IOError):
+                pass
+
+
+def open(sequence, process_func=None, dtype=None, as_grey=False, plugin=None,
+         cache=None, **kwargs):
     """Read a filename, list of filenames, or directory of image files into an
     iterable that returns images as numpy arrays.
 
@@ -97,6 +164,12 @@ def open(sequence, process_func=None, dtype=None, as_grey=False, plugin=None):
         Passed on to skimage.io.imread if scikit-image is available.
         If scikit-image is not available, this will be ignored and a warning
         will be issued.
+    cache : int, optional
+        If given, keep recently used frames in memory, up to this many bytes.
+        See CachedFrames.
+    **kwargs
+        Further keyword arguments are passed on to the reader of a single
+        file, e.g. `mmap=True` for Cine files.
 
     Examples
     --------
@@ -117,50 +190,223 @@ def open(sequence, process_func=None, dtype=None, as_grey=False, plugin=None):
     >>> frame_count = len(video) # Number of frames in video
     >>> frame_shape = video.frame_shape # Pixel dimensions of video
     """
-    files = glob.glob(sequence)
-    if len(files) > 1:
-        # todo: test if ImageSequence can read the image type,
-        #       delegate to subclasses as needed
-        return ImageSequence(sequence, process_func, dtype, as_grey, plugin)
+    if glob.has_magic(sequence):
+        files = glob.glob(sequence)
+        if len(files) > 1:
+            # todo: test if ImageSequence can read the image type,
+            #       delegate to subclasses as needed
+            reader = ImageSequence(sequence, process_func, dtype, as_grey,
+                                   plugin)
+            return _wrap_cache(reader, cache)
 
     # We are now not in an image sequence, so warn if plugin is specified,
     # since we will not be able to use it
     if plugin is not None:
         warn("scikit-image plugin specification ignored because such plugins "
              "only apply when loading a sequence of image files. ")
-    _, ext = os.path.splitext(sequence)
-    if ext is None or len(ext) < 2:
+    handlers = _file_handlers(sequence)
+
+    # If a reader fails, try the next one. If they all fail, report why the
+    # first one failed.
+    error = None
+    for handler in handlers:
+        try:
+            reader = handler(sequence, process_func=process_func,
+                             dtype=dtype, as_grey=as_grey, **kwargs)
+        except Exception:
+            if error is None:
+                error = sys.exc_info()
+        else:
+            return _wrap_cache(reader, cache)
+    six.reraise(*error)
+
+
+def _file_handlers(filename):
+    """Return the readers that may read a file, the most suitable first."""
+    _, ext = os.path.splitext(filename)
+    ext = ext.lower()[1:]
+    # The content of the file takes precedence over its extension.
+    sniffed = _sniff_format(filename)
+    if not ext and sniffed is None:
         raise UnknownFormatError(
             "Could not detect your file type because it did not have an "
             "extension. Try specifying a loader class, e.g. "
-            "Video({0})".format(sequence))
-    ext = ext.lower()[1:]
+            "Video({0})".format(filename))
 
-    all_handlers = _recursive_subclasses(FramesSequence)
-    eligible_handlers = [h for h in all_handlers
-                         if ext and ext in h.class_exts()]
-    if len(eligible_handlers) < 1:
+    handlers = []
+    for key in (sniffed, ext):
+        if key:
+            handlers += [h for h in _handlers_for(key) if h not in handlers]
+    if len(handlers) < 1:
         raise UnknownFormatError(
             "Could not autodetect how to load a file of type {0}. "
             "Try manually "
-            "specifying a loader class, e.g. Video({1})".format(ext, sequence))
+            "specifying a loader class, e.g. Video({1})".format(ext, filename))
+    return handlers
 
-    def sort_on_priority(handlers):
-        # This uses optional priority information from subclasses
-        # > 10 means that it will be used instead of than built-in subclasses
-        def priority(cls):
-            try:
-                return cls.class_priority
-            except AttributeError:
-                return 10
-        return sorted(handlers, key=priority, reverse=True)
 
-    handler = sort_on_priority(eligible_handlers)[0]
+def probe(sequence):
+    """Find the length, frame shape, dtype, frame rate and size on disk of
+    a file, reading only its header where the reader supports that.
+
+    Parameters
+    ----------
+    sequence : string
+        A file, or a glob ('/path/foo*.png') pattern of images, as for
+        `pims.open`.
+
+    Returns
+    -------
+    ProbeInfo, a namedtuple with fields filename, reader, length, shape,
+    dtype, frame_rate and file_size.
+
+    Examples
+    --------
+    >>> info = probe('video.cine')
+    >>> info.length, info.shape, info.dtype
+    """
+    if glob.has_magic(sequence) and len(glob.glob(sequence)) > 1:
+        return ImageSequence.probe(sequence)
+
+    # As in open: if a reader fails, try the next one.
+    error = None
+    for handler in _file_handlers(sequence):
+        try:
+            return handler.probe(sequence)
+        except Exception:
+            if error is None:
+                error = sys.exc_info()
+    six.reraise(*error)
+
+
+def probe_many(sequences, workers=8, skip_errors=False):
+    """Probe many files at once, on a pool of threads. See `probe`.
+
+    Parameters
+    ----------
+    sequences : iterable of strings
+    workers : int, optional
+        Number of threads. Default 8.
+    skip_errors : boolean, optional
+        Give None for files that cannot be probed, instead of raising the
+        error. False by default.
+
+    Returns
+    -------
+    list of ProbeInfo, in the order of `sequences`
+    """
+    def probe_one(sequence):
+        try:
+            return probe(sequence)
+        except Exception:
+            if skip_errors:
+                return None
+            raise
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(probe_one, list(sequences))
+    finally:
+        pool.close()
+
+
+# File signatures, as (offset, bytes, extension). Cine files have a short
+# signature and SPE files none; they are recognized by their header, see
+# _is_cine and _is_spe.
+_magic_bytes = [
+    (0, b'II*\x00', 'tif'),
+    (0, b'MM\x00*', 'tif'),
+    (0, b'II+\x00', 'tif'),  # BigTIFF
+    (0, b'MM\x00+', 'tif'),
+    (0, b'\xed\xfe\x00\x00', 'seq'),  # Norpix, 0xFEED
+]
+
+
+def _sniff_format(filename):
+    """Guess the file extension that matches the content of a file.
+
+    Returns None if the format is not recognized."""
+    try:
+        with io.open(filename, 'rb') as f:
+            header = f.read(4100)
+    except (IOError, OSError, TypeError, ValueError):
+        return None
+    for offset, magic, ext in _magic_bytes:
+        if header[offset:offset + len(magic)] == magic:
+            return ext
+    if _is_cine(header):
+        return 'cine'
+    if _is_spe(filename, header):
+        return 'spe'
+    return None
+
+
+def _is_cine(header):
+    """Check the signature, header size and version of a cine header."""
+    from pims.cine import HEADER_FIELDS
+    fmt = '<' + ''.join(f for _, f in HEADER_FIELDS)
+    size = struct.calcsize(fmt)
+    if header[:2] != b'CI' or len(header) < size:
+        return False
+    fields = dict(zip([name for name, _ in HEADER_FIELDS],
+                      struct.unpack_from(fmt, header)))
+    return (fields['header_size'] == size and fields['version'] == 1 and
+            fields['off_image_header'] >= size)
+
+
+def _is_spe(filename, header):
+    """Check whether the SPE header matches the size of the file."""
+    from pims.spe_stack import Spec
+    if len(header) < Spec.data_start:
+        return False
+    values = Spec.read_essential(header)
+    datatype, count = values['datatype'], values['NumFrames']
+    if not 0 <= datatype < len(Spec.dtypes) or count < 1:
+        return False
+    data_size = (count * values['xdim'] * values['ydim'] *
+                 Spec.dtypes[datatype].itemsize)
+    # SPE 3 files have an XML footer after the image data
+    return 0 < data_size <= os.path.getsize(filename) - Spec.data_start
+
+
+def _priority(cls):
+    # This uses optional priority information from subclasses
+    # > 10 means that it will be used instead of than built-in subclasses
+    try:
+        return cls.class_priority
+    except AttributeError:
+        return 10
+
+
+_handler_cache = {}
+_handler_cache_generation = [None]
+
+
+def _handlers_for(ext):
+    """Return the readers for a file extension, highest priority first.
+
+    The result is cached until a new reader class is defined."""
+    _import_reader_modules(ext)
+    if _handler_cache_generation[0] != _FramesMeta.generation:
+        _handler_cache.clear()
+        _handler_cache_generation[0] = _FramesMeta.generation
+    try:
+        return _handler_cache[ext]
+    except KeyError:
+        pass
+    handlers = []
+    for h in _recursive_subclasses(FramesSequence):
+        if ext in h.class_exts() and h not in handlers:
+            handlers.append(h)
+    handlers = sorted(handlers, key=_priority, reverse=True)
+    _handler_cache[ext] = handlers
+    return handlers
+
 
-    # TODO maybe we should wrap this in a try and loop to try all the
-    # handlers if early ones throw exceptions
-    return handler(sequence, process_func=process_func,
-                   dtype=dtype, as_grey=as_grey)
+def _wrap_cache(reader, cache):
+    if cache is None:
+        return reader
+    return CachedFrames(reader, max_bytes=cache)
 
 
 class UnknownFormatError(Exception):
@@ -7,13 +7,145 @@ from six.moves import range
 import os
 import numpy as np
 import itertools
+from collections import namedtuple
 from slicerator import Slicerator, propagate_attr, index_attr
 from .frame import Frame
+from .prefetch import prefetch
 from abc import ABCMeta, abstractmethod, abstractproperty
 from warnings import warn
 
 
-class FramesStream(with_metaclass(ABCMeta, object)):
+def _identity(x):
+    return x
+
+
+def _normalize_indices(indices, length):
+    """Convert frame numbers to an array of non-negative ints.
+
+    `indices` may be None (all frames), a slice, or an iterable of ints.
+    Negative numbers count from the end.
+    """
+    if indices is None:
+        return np.arange(length, dtype=np.intp)
+    if isinstance(indices, slice):
+        return np.arange(*indices.indices(length), dtype=np.intp)
+    indices = np.array(list(indices), dtype=np.intp)
+    if np.any((indices < -length) | (indices >= length)):
+        raise IndexError('index out of range')
+    indices[indices < 0] += length
+    return indices
+
+
+def _index_runs(indices):
+    """Split an array of frame numbers into runs of consecutive frames.
+
+    Yields (start, stop) positions such that indices[start:stop] is
+    indices[start], indices[start] + 1, ...
+    """
+    if len(indices) == 0:
+        return
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    stops = np.concatenate((breaks, [len(indices)]))
+    for start, stop in zip(starts, stops):
+        yield int(start), int(stop)
+
+
+def _frames_array(frames, dtype=None, copy=None):
+    """Implement __array__ on the result of get_frames.
+
+    Frames that were read from the file are a new array. They are a view
+    only if the reader maps the file and no conversion was needed. As in
+    numpy, copy=False raises ValueError if the frames are not a view, and
+    copy=True never returns a view.
+    """
+    result = frames if dtype is None else frames.astype(dtype, copy=False)
+    is_view = result is frames and not frames.flags.owndata
+    if copy is False and not is_view:
+        raise ValueError("Unable to avoid a copy: the frames are read from "
+                         "the file. Memory-map the file (mmap=True), if the "
+                         "reader supports it.")
+    if copy and is_view:
+        result = result.copy()
+    return result
+
+
+class ProbeInfo(namedtuple('ProbeInfo', ['filename', 'reader', 'length',
+                                           'shape', 'dtype', 'frame_rate',
+                                           'file_size'])):
+    """What FramesSequence.probe and pims.probe tell about a file.
+
+    Attributes
+    ----------
+    filename : string
+    reader : string
+        Name of the reader class that would read the file.
+    length : int
+        Number of frames. For some video files this is an estimate, based
+        on the duration and the frame rate.
+    shape : tuple
+        Shape of the array of one frame as read by default, e.g.
+        (height, width) or (height, width, 3).
+    dtype : numpy.dtype
+        Data type of the frames as read by default.
+    frame_rate : float or None
+        Frames per second, if the file stores it.
+    file_size : int
+        Size on disk in bytes; for a sequence of images, of all images.
+    """
+    __slots__ = ()
+
+
+def _file_size(filename):
+    return os.path.getsize(filename)
+
+
+class FramesSlicerator(Slicerator):
+    """Slicerator that keeps FramesSequence methods working on sliced views.
+
+    `get_frames` maps the indices of the view back to the parent reader.
+    """
+    def __getitem__(self, key):
+        result = super(FramesSlicerator, self).__getitem__(key)
+        if type(result) is Slicerator:
+            result = FramesSlicerator(result._ancestor, result._indices,
+                                      len(result), result._propagate_attrs)
+        return result
+
+    def get_frames(self, indices=None, out=None):
+        """Read several frames of this view into a single array.
+
+        See FramesSequence.get_frames.
+        """
+        parent_indices = np.fromiter(self.indices, dtype=np.intp,
+                                     count=len(self))
+        if indices is not None:
+            parent_indices = parent_indices[
+                _normalize_indices(indices, len(self))]
+        return self._ancestor.get_frames(parent_indices, out=out)
+
+    def __array__(self, dtype=None, copy=None):
+        return _frames_array(self.get_frames(), dtype, copy)
+
+    def iter_prefetch(self, depth=8, workers=2):
+        """Iterate over this view, reading frames ahead in the background.
+
+        See pims.prefetch.
+        """
+        return prefetch(self, depth, workers)
+
+
+class _FramesMeta(ABCMeta):
+    """Metaclass of all readers. It counts the reader classes that are
+    defined, so that lookups of readers (see pims.open) can be cached."""
+    generation = 0
+
+    def __init__(cls, name, bases, namespace):
+        super(_FramesMeta, cls).__init__(name, bases, namespace)
+        _FramesMeta.generation += 1
+
+
+class FramesStream(with_metaclass(_FramesMeta, object)):
     """
     A base class for wrapping input data which knows how to
     advance to the next frame, but does not have random access.
@@ -22,7 +154,7 @@ class FramesStream(with_metaclass(ABCMeta, object)):
 
     Does not support slicing.
     """
-    __metaclass__ = ABCMeta
+    __metaclass__ = _FramesMeta
 
     @abstractmethod
     def __iter__(self):
@@ -71,7 +203,7 @@ class FramesStream(with_metaclass(ABCMeta, object)):
 
     def _validate_process_func(self, process_func):
         if process_func is None:
-            process_func = lambda x: x
+            process_func = _identity
         if not callable(process_func):
             raise ValueError("process_func must be a function, or None")
         self.process_func = process_func
@@ -132,7 +264,7 @@ Frame Shape: {frame_shape!r}
 Pixel Datatype: {dtype}""".format(frame_shape=self.frame_shape,
                                   dtype=self.pixel_type)
 
-@Slicerator.from_class
+@FramesSlicerator.from_class
 class FramesSequence(FramesStream):
     """Baseclass for wrapping data buckets that have random access.
 
@@ -146,6 +278,17 @@ class FramesSequence(FramesStream):
     """
     propagate_attrs = ['frame_shape', 'pixel_type']
 
+    # Readers whose get_frame may be called from several threads at once
+    # set this to True. See pims.prefetch.
+    thread_safe = False
+
+    def __new__(cls, *args, **kwargs):
+        # Remember the constructor arguments, so that an identical reader
+        # can be opened in another process (see pims.map_frames).
+        obj = object.__new__(cls)
+        obj._init_args = (args, kwargs)
+        return obj
+
     def __getitem__(self, key):
         """__getitem__ is handled by Slicerator. In all pims readers, the data
         returning function is get_frame."""
@@ -154,6 +297,18 @@ class FramesSequence(FramesStream):
     def __iter__(self):
         return iter(self[:])
 
+    def __array__(self, dtype=None, copy=None):
+        # np.asarray(frames) reads all frames at once with get_frames
+        return _frames_array(self.get_frames(), dtype, copy)
+
+    def iter_prefetch(self, depth=8, workers=2):
+        """Iterate over all frames, reading ahead in the background.
+
+        Up to `depth` frames are read ahead by `workers` threads and yielded
+        in order. See pims.prefetch.
+        """
+        return prefetch(self, depth, workers)
+
     @abstractmethod
     def __len__(self):
         """
@@ -161,15 +316,125 @@ class FramesSequence(FramesStream):
         """
         pass
 
+    @classmethod
+    def probe(cls, filename):
+        """Return a ProbeInfo with the length, frame shape, dtype and frame
+        rate of a file, without reading its frames.
+
+        Sub-classes should over-ride this to read only the header of the
+        file. By default, the file is opened by the reader and its first
+        frame is read.
+        """
+        with cls(filename) as reader:
+            length = len(reader)
+            if length > 0:
+                frame = reader[0]
+                shape, dtype = frame.shape, frame.dtype
+            else:
+                shape, dtype = tuple(reader.frame_shape), reader.pixel_type
+            try:
+                frame_rate = reader.frame_rate
+            except Exception:
+                frame_rate = None
+        return ProbeInfo(filename, cls.__name__, length, tuple(shape),
+                         np.dtype(dtype), frame_rate, _file_size(filename))
+
     @abstractmethod
     def get_frame(self, ind):
         """
         Sub classes must over-ride this function for how to get a given
         frame out of the file.  Any data-type specific internal-state
         nonsense should be dealt with in this function.
+
+        Readers may accept an optional `out` argument: an array of the
+        shape of one frame that the frame is decoded into, so that a loop
+        over many frames can reuse a single buffer.
         """
         pass
 
+    def get_frames(self, indices=None, out=None):
+        """Read several frames into a single array.
+
+        Parameters
+        ----------
+        indices : iterable of int or slice, optional
+            Frame numbers to read. Negative numbers count from the end.
+            By default, all frames are read.
+        out : ndarray, optional
+            Array of shape ``(len(indices),) + shape of one frame`` to write
+            the frames into.
+
+        Returns
+        -------
+        ndarray of shape ``(len(indices),) + shape of one frame``
+
+        Notes
+        -----
+        The default implementation calls `get_frame` for every index.
+        Readers that can read consecutive frames in one go override this.
+        """
+        indices = _normalize_indices(indices, len(self))
+        for n, j in enumerate(indices):
+            frame = self.get_frame(j)
+            if out is None:
+                out = np.empty((len(indices),) + frame.shape, frame.dtype)
+            out[n] = frame
+        if out is None:
+            out = np.empty((0,) + tuple(self.frame_shape), self.pixel_type)
+        return out
+
+    def _raw_buffer(self, shape, dtype, out=None):
+        """Return an array to read frame data of the given shape and file
+        dtype into. If `out` can hold the final result as it is, `out`
+        itself is returned, so that no further copy is needed."""
+        if (out is not None and self.process_func is _identity and
+                out.dtype == dtype and out.shape == tuple(shape) and
+                out.flags.c_contiguous):
+            return out
+        return np.empty(shape, dtype)
+
+    def _process_frame(self, frame, out=None):
+        """Convert a frame as read from the file to pixel_type, apply
+        process_func and write the result into `out`, if given."""
+        if frame is out:
+            return out
+        result = self.process_func(frame.astype(self.pixel_type, copy=False))
+        if out is None:
+            return result
+        out[...] = result
+        return out
+
+    def _get_mapped_frames(self, data, indices, out=None):
+        """Get frames from `data`, a memory map of all frames as stored in
+        the file, as a view if possible."""
+        if len(indices) > 0 and np.all(np.diff(indices) == 1):
+            # consecutive frames are a slice of the map
+            block = np.asarray(data[indices[0]:indices[-1] + 1])
+        else:
+            block = np.asarray(data[indices])
+        if out is None and self.process_func is _identity:
+            # no copy, or a single bulk conversion
+            return block.astype(self.pixel_type, copy=False)
+        return self._process_block(block, out)
+
+    def _process_block(self, block, out=None):
+        """Convert an array of frames as read from the file to pixel_type,
+        apply process_func and write the result into `out`, if given."""
+        if block is out:
+            return out
+        if self.process_func is _identity:
+            if out is None:
+                return np.require(block, self.pixel_type,
+                                  ['C_CONTIGUOUS', 'WRITEABLE'])
+            out[...] = block
+            return out
+        for n, frame in enumerate(block):
+            result = self.process_func(frame.astype(self.pixel_type))
+            if out is None:
+                out = np.empty((len(block),) + result.shape, result.dtype)
+            out[n] = result
+        return out
+
     def __repr__(self):
         # May be overwritten by subclasses
         return """<Frames>
@@ -462,11 +727,12 @@ class FramesSequenceND(FramesSequence):
         """
         pass
 
-    def get_frame(self, i):
+    def get_frame(self, i, out=None):
         """ Returns a Frame of shape determined by bundle_axes. The index value
         is interpreted according to the iter_axes property. Coordinates not
         present in both iter_axes and bundle_axes will be set to their default
-        value (see default_coords). """
+        value (see default_coords). If given, the frame is written into the
+        array `out`, which must have shape `frame_shape`. """
         if i > len(self):
             raise IndexError('index out of range')
 
@@ -488,10 +754,18 @@ class FramesSequenceND(FramesSequence):
                 metadata = result.metadata
             else:
                 metadata = None
+            if out is not None:
+                out[...] = result
+                result = out
         else:  # general case of N dimensional frame
             Nframes = int(np.prod(shape[:-2]))
-            result = np.empty([Nframes] + list(shape[-2:]),
-                              dtype=self.pixel_type)
+            if out is None:
+                result = np.empty([Nframes] + list(shape[-2:]),
+                                  dtype=self.pixel_type)
+            else:
+                # a view, so that reshaping never silently copies
+                result = out.view()
+                result.shape = [Nframes] + list(shape[-2:])
 
             # zero out all coords that will be bundled
             coords.update(**{k: 0 for k in self._bundle_axes[:-2]})
@@ -509,7 +783,10 @@ class FramesSequenceND(FramesSequence):
                     else:
                         break
             # reshape the array into the desired shape
-            result.shape = shape
+            if out is None:
+                result.shape = shape
+            else:
+                result = out
 
             # propagate metadata
             metadata = {}
@@ -531,6 +808,13 @@ class FramesSequenceND(FramesSequence):
 
         return Frame(result, frame_no=i, metadata=metadata)
 
+    def get_frames(self, indices=None, out=None):
+        """Read several frames, shaped according to bundle_axes, into a single
+        array. See FramesSequence.get_frames."""
+        # Skip overrides of file-based readers (e.g. ImageSequence), which
+        # do not know about bundled axes.
+        return FramesSequence.get_frames(self, indices, out)
+
     def __repr__(self):
         s = "<FramesSequenceND>\nAxes: {0}\n".format(self.ndim)
         for dim in self._sizes:
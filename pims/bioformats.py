@@ -4,9 +4,11 @@ from __future__ import (absolute_import, division, print_function,
 import numpy as np
 
 from pims.base_frames import FramesSequence, FramesSequenceND
-from pims.frame import Frame
+from pims.frame import Frame, LazyMetadata
 from warnings import warn
 import os
+import functools
+from xml.etree import ElementTree
 
 try:
     import jpype
@@ -82,6 +84,11 @@ def _maybe_tostring(field):
         return field
 
 
+def _local_name(tag):
+    """Strip the namespace from an XML tag."""
+    return tag.rsplit('}', 1)[-1]
+
+
 def _jbytearr_stringbuffer(arr, dtype):
     # see https://github.com/originell/jpype/issues/71 and
     # https://github.com/originell/jpype/pull/73
@@ -235,7 +242,7 @@ class BioformatsReader(FramesSequenceND):
         This dictionary sets which metadata fields are read and passed into the
         Frame.metadata field obtained by get_frame. This will only work if
         meta=True. Only MetadataRetrieve methods with signature (series, plane)
-        will be accepted.
+        will be accepted. The fields are only read when they are used.
     series : int
         active series that is read by get_frame. Writeable.
     pixel_type : numpy.dtype
@@ -522,10 +529,49 @@ class BioformatsReader(FramesSequenceND):
         if self.calibrationZ is not None:
             metadata['mppZ'] = self.calibrationZ
         metadata.update(coords)
+        # Every plane metadata field is a call into java: only make it when
+        # the field is used.
+        fields = dict()
         for key, method in self.frame_metadata.items():
-            metadata[key] = getattr(self.metadata, method)(self._series, j)
+            fields[key] = functools.partial(getattr(self.metadata, method),
+                                            self._series, j)
+
+        return Frame(im, metadata=LazyMetadata(metadata, fields))
 
-        return Frame(im, metadata=metadata)
+    def frame_metadata_table(self):
+        """Return the metadata of all planes of the active series at once,
+        as a dict of arrays.
+
+        Every 2D plane is one row. The keys are 'frame' (the plane index, as
+        in the frame metadata), 'z', 'c', 't' and the keys of
+        `frame_metadata`. The plane metadata is parsed from the OME-XML in
+        one go, instead of calling java for every field of every plane.
+        Requires meta=True.
+        """
+        if not hasattr(self, '_metadata'):
+            raise ValueError("The metadata table requires meta=True.")
+        root = ElementTree.fromstring(
+            str(_maybe_tostring(self._metadata.dumpXML())))
+        images = [el for el in root if _local_name(el.tag) == 'Image']
+        planes = [el for el in images[self._series].iter()
+                  if _local_name(el.tag) == 'Plane']
+        # MetadataRetrieve.PlaneDeltaT corresponds to Plane/@DeltaT, etc.
+        attributes = dict((key, method[len('Plane'):])
+                          for key, method in self.frame_metadata.items()
+                          if method.startswith('Plane'))
+        table = dict((key, []) for key in ['frame', 'z', 'c', 't'] +
+                     list(attributes))
+        for plane in planes:
+            z, c, t = [int(plane.get('The' + axis, 0)) for axis in 'ZCT']
+            table['frame'].append(self.rdr.getIndex(z, c, t))
+            table['z'].append(z)
+            table['c'].append(c)
+            table['t'].append(t)
+            for key, attribute in attributes.items():
+                table[key].append(float(plane.get(attribute, 'nan')))
+        return dict((key, np.array(values, dtype=np.float64
+                                   if key in attributes else np.intp))
+                    for key, values in table.items())
 
     def get_metadata_raw(self, form='dict'):
         hashtable = self.rdr.getGlobalMetadata()
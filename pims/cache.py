@@ -0,0 +1,131 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict
+from threading import Lock
+
+from pims.base_frames import FramesSequence
+from pims.frame import Frame
+from pims.utils.misc import FileLocker
+
+
+class CachedFrames(FramesSequence):
+    """Wrap a reader, keeping recently used frames in memory.
+
+    Frames are kept in a least-recently-used cache that is limited by the
+    total number of bytes of the cached frames. This speeds up code that
+    visits the same frames several times, for instance sliding windows or
+    scrolling back and forth through a video.
+
+    Parameters
+    ----------
+    reader : FramesSequence
+        The reader to wrap.
+    max_bytes : int, optional
+        Maximum total size of the cached frames, in bytes. Defaults to
+        256 MiB. Frames that are larger than this are never cached.
+
+    Attributes
+    ----------
+    hits : int
+        Number of frames that were served from the cache.
+    misses : int
+        Number of frames that were read from the underlying reader.
+    nbytes : int
+        Total size of the currently cached frames, in bytes.
+
+    Notes
+    -----
+    The same Frame object is returned every time a cached frame is
+    requested. To protect the cache, frames are returned read-only; make a
+    copy before modifying one.
+
+    Examples
+    --------
+    >>> video = CachedFrames(Video('video.avi'), max_bytes=2**30)
+    >>> video[10]  # read from the file
+    >>> video[10]  # served from memory
+    >>> video.hits, video.misses
+    (1, 1)
+    """
+    def __init__(self, reader, max_bytes=2**28):
+        self._reader = reader
+        self.max_bytes = max_bytes
+        self.propagate_attrs = list(getattr(reader, 'propagate_attrs',
+                                            ['frame_shape', 'pixel_type']))
+        self._cache = OrderedDict()
+        self._cache_lock = Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_frame(self, i):
+        with FileLocker(self._cache_lock):
+            try:
+                frame = self._cache.pop(i)
+            except KeyError:
+                pass
+            else:
+                # re-insert to mark it as most recently used
+                self._cache[i] = frame
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+        frame = Frame(self._reader.get_frame(i))
+        frame.flags.writeable = False
+        if frame.nbytes > self.max_bytes:
+            return frame
+
+        with FileLocker(self._cache_lock):
+            if i not in self._cache:
+                self._cache[i] = frame
+                self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return frame
+
+    def clear_cache(self):
+        """Remove all frames from the cache and reset the counters."""
+        with FileLocker(self._cache_lock):
+            self._cache.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._reader)
+
+    @property
+    def frame_shape(self):
+        return self._reader.frame_shape
+
+    @property
+    def pixel_type(self):
+        return self._reader.pixel_type
+
+    @property
+    def thread_safe(self):
+        return getattr(self._reader, 'thread_safe', False)
+
+    def __getattr__(self, name):
+        # Expose the attributes of the wrapped reader. Attributes starting
+        # with an underscore are never forwarded, which also prevents
+        # recursion before __init__ has run.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._reader, name)
+
+    def close(self):
+        self.clear_cache()
+        self._reader.close()
+
+    def __repr__(self):
+        return """<CachedFrames>
+Cached: {count} frames, {nbytes} of {max_bytes} bytes
+Hits: {hits}, Misses: {misses}
+Wrapped reader:
+{reader!r}""".format(count=len(self._cache), nbytes=self.nbytes,
+                     max_bytes=self.max_bytes, hits=self.hits,
+                     misses=self.misses, reader=self._reader)
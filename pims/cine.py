@@ -12,14 +12,17 @@ from __future__ import (absolute_import, division, print_function,
 
 import six
 
-from pims.frame import Frame
-from pims.base_frames import FramesSequence, index_attr
-from pims.utils.misc import FileLocker
+from pims.frame import Frame, LazyMetadata
+from pims.base_frames import (FramesSequence, ProbeInfo, index_attr,
+                              _identity, _normalize_indices, _index_runs)
+from pims.utils.misc import (FileLocker, PositionalFile, read_fields,
+                             RUN_READ_SIZE)
+import os
 import time
 import struct
 import numpy as np
-from numpy import array, frombuffer
-from threading import Lock
+from numpy import array
+from threading import Lock, local
 import datetime
 import hashlib
 
@@ -51,6 +54,14 @@ CFA_VRIV6 = 2
 CFA_BAYER = 3
 CFA_BAYERFLIP = 4
 
+# Colors of the top-left 2x2 pixels of raw (un-interpolated) images, for the
+# values of the cfa setup field. For the VRI types, the Phantom
+# documentation lists two patterns; the first one is used.
+CFA_PATTERNS = {CFA_VRI: 'gbrg',
+                CFA_VRIV6: 'bggr',
+                CFA_BAYER: 'gbrg',
+                CFA_BAYERFLIP: 'rggb'}
+
 TAGGED_FIELDS = {
     1000: ('ang_dig_sigs', ''),
     1001: ('image_time_total', TIME64),
@@ -212,7 +223,8 @@ class Cine(FramesSequence):
     """Read cine files
 
     Read cine files, the out put from Vision Research high-speed phantom
-    cameras.  Support uncompressed monochrome and color files.
+    cameras.  Support uncompressed monochrome and color files, and raw
+    (un-interpolated) color files.
 
     Nominally thread-safe, but this assertion is not tested.
 
@@ -229,6 +241,26 @@ class Cine(FramesSequence):
     as_grey : boolean, optional
         Convert color images to greyscale. False by default.
         May not be used in conjunction with process_func.
+    mmap : boolean, optional
+        Memory-map the file instead of reading it. Frames are then returned
+        as read-only views into the file, without copying and without
+        locking, which makes concurrent access from several threads fast.
+        Only supported for uncompressed 8 or 16 bit monochrome files.
+        False by default.
+    metadata : boolean, optional
+        Attach the exposure and time of every frame as metadata. True by
+        default.
+    demosaic : {'bilinear', 'superpixel', 'raw'}, optional
+        How to read raw color files, which store one color per pixel in a
+        Bayer pattern. 'bilinear' interpolates the missing colors of every
+        pixel. 'superpixel' combines every 2x2 block of pixels into one RGB
+        pixel, which halves the width and height of the frames. 'raw'
+        returns the mosaic itself, as a monochrome frame. Default
+        'bilinear'.
+    cfa_pattern : string, optional
+        Colors of the top-left 2x2 pixels of raw color files, such as
+        'rggb'. By default, this follows from the cfa setup field. See
+        `CFA_PATTERNS`.
     """
     # TODO: Unit tests using a small sample cine file.
     @classmethod
@@ -238,9 +270,35 @@ class Cine(FramesSequence):
     propagate_attrs = ['frame_shape', 'pixel_type', 'filename', 'frame_rate',
                        'get_fps', 'compression', 'cfa', 'off_set']
 
+    thread_safe = True
+
+    @classmethod
+    def probe(cls, filename):
+        """Read the length, frame shape, dtype and frame rate from the
+        headers of the file only. See FramesSequence.probe."""
+        with open(filename, 'rb') as f:
+            header = read_fields(f, HEADER_FIELDS)
+            if header['type'] != b'CI':
+                raise IOError("{} is not a cine file".format(filename))
+            bitmap = read_fields(f, BITMAP_INFO_FIELDS,
+                                  header['off_image_header'])
+            setup = read_fields(f, SETUP_FIELDS, header['off_setup'])
+        shape = (bitmap['bi_height'], bitmap['bi_width'])
+        if setup['cfa'] != CFA_NONE:
+            shape += (3, )  # interpolated, or demosaiced by default
+        if bitmap['bi_bit_count'] in (8, 24):
+            dtype = np.dtype('u1')
+        else:
+            dtype = np.dtype('u2')
+        return ProbeInfo(filename, cls.__name__, header['image_count'],
+                         shape, dtype, float(setup['frame_rate']),
+                         os.path.getsize(filename))
+
     def __init__(self, filename, process_func=None,
-                 dtype=None, as_grey=False):
+                 dtype=None, as_grey=False, mmap=False, metadata=True,
+                 demosaic='bilinear', cfa_pattern=None):
         super(Cine, self).__init__()
+        self._with_metadata = metadata
         self.f = open(filename, 'rb')
         self._filename = filename
 
@@ -248,17 +306,21 @@ class Cine(FramesSequence):
         self.bitmapinfo_dict = self.read_header(BITMAP_INFO_FIELDS,
                                                 self.off_image_header)
         self.setup_fields_dict = self.read_header(SETUP_FIELDS, self.off_setup)
-        self.image_locations = self.unpack('%dQ' % self.image_count,
-                                           self.off_image_offsets)
-        if type(self.image_locations) not in (list, tuple):
-            self.image_locations = [self.image_locations]
-
         self._width = self.bitmapinfo_dict['bi_width']
         self._height = self.bitmapinfo_dict['bi_height']
         self._pixel_count = self._width * self._height
 
-        # Allows Cine object to be accessed from multiple threads!
+        # Allows Cine object to be accessed from multiple threads! Frames
+        # are read at absolute offsets, so that threads do not wait for each
+        # other, with a read buffer per thread.
         self.file_lock = Lock()
+        self._reader = PositionalFile(self.f, self.file_lock)
+        self._local = local()
+
+        # offsets of the images in the file, as uint64
+        self.image_locations = np.frombuffer(
+            self._reader.read(8 * self.image_count, self.off_image_offsets),
+            '<u8').astype(np.uint64)
 
         self._hash = None
 
@@ -267,6 +329,15 @@ class Cine(FramesSequence):
         self._as_grey(as_grey, process_func)
 
         self._im_sz = (self._width, self._height)
+        if self.cfa == CFA_NONE:
+            self._shape = (self._height, self._width)
+        else:
+            self._shape = (self._height, self._width, 3)
+
+        self._demosaic = None
+        self._cfa_pattern = None
+        if self.compression == 2 and self.cfa != CFA_NONE:
+            self._init_raw_color(demosaic, cfa_pattern)
 
         # sort out the data type by reading the meta-data
         if self.bitmapinfo_dict['bi_bit_count'] in (8, 24):
@@ -279,9 +350,10 @@ class Cine(FramesSequence):
             self._dtype = np.dtype(self._data_type)
         else:
             self._dtype = dtype
-        self.tagged_blocks = self.read_tagged_blocks()
-        self.frame_time_stamps = self.tagged_blocks['image_time_only']
-        self.all_exposures = self.tagged_blocks['exposure_only']
+        # The tagged blocks (time stamps and exposures of all frames) are
+        # read when they are first used, and converted to lists once.
+        self._tags = None
+        self._tag_lists = {}
         self.stack_meta_data = dict()
         self.stack_meta_data.update(self.bitmapinfo_dict)
         self.stack_meta_data.update({k: self.setup_fields_dict[k]
@@ -302,6 +374,69 @@ class Cine(FramesSequence):
                                                    })
         self.stack_meta_data['trigger_time'] = self.trigger_time
 
+        self._mmap = None
+        if mmap:
+            self._open_mmap()
+
+    def _init_raw_color(self, demosaic, cfa_pattern):
+        """Set up the demosaicing of raw color files."""
+        if demosaic not in ('bilinear', 'superpixel', 'raw'):
+            raise ValueError("demosaic should be 'bilinear', 'superpixel' "
+                             "or 'raw', not {!r}".format(demosaic))
+        if cfa_pattern is None:
+            # the upper bits flag gray heads of multi-head cameras
+            cfa_pattern = CFA_PATTERNS.get(self.cfa & 0xFF)
+            if cfa_pattern is None:
+                raise ValueError("Unknown color filter array: "
+                                 "{}".format(self.cfa))
+        cfa_pattern = cfa_pattern.lower()
+        if sorted(cfa_pattern) != ['b', 'g', 'g', 'r'] or not (
+                cfa_pattern[0] == cfa_pattern[3] == 'g' or
+                cfa_pattern[1] == cfa_pattern[2] == 'g'):
+            raise ValueError("Not a Bayer pattern: {!r}".format(cfa_pattern))
+        self._demosaic = demosaic
+        self._cfa_pattern = cfa_pattern
+        if demosaic == 'raw':
+            self._shape = (self._height, self._width)
+        elif demosaic == 'superpixel':
+            self._shape = (self._height // 2, self._width // 2, 3)
+            self._im_sz = (self._width // 2, self._height // 2)
+
+    def _open_mmap(self):
+        """Map the file and find where the image data of every frame
+        starts."""
+        if self.compression != 0 and self._demosaic != 'raw' or \
+                self.compression == 0 and self.cfa != CFA_NONE:
+            raise ValueError("mmap is only supported for uncompressed "
+                             "monochrome cine files and for raw color "
+                             "files with demosaic='raw'")
+        itemsize = np.dtype(self._data_type).itemsize
+        self._mmap = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        # The annotation size is stored in the first DWORD of the annotation
+        # and the image size in the last one. Read them for all frames at
+        # once.
+        locations = np.asarray(self.image_locations, dtype=np.intp)
+        dword = np.arange(4)
+        annotation_sizes = self._mmap[locations[:, np.newaxis] + dword]
+        annotation_sizes = annotation_sizes.view('<u4')[:, 0]
+        image_sizes = self._mmap[(locations + annotation_sizes -
+                                  4)[:, np.newaxis] + dword]
+        image_sizes = image_sizes.view('<u4')[:, 0]
+        if np.any(image_sizes != self._pixel_count * itemsize):
+            self._mmap = None
+            raise ValueError("mmap is only supported for 8 or 16 bit "
+                             "cine files that are not packed")
+        self._image_starts = locations + annotation_sizes
+
+    def _frame_view(self, number):
+        """Return a read-only view of the image data of a frame."""
+        start = self._image_starts[number]
+        nbytes = self._pixel_count * np.dtype(self._data_type).itemsize
+        data = self._mmap[start:start + nbytes]
+        frame = np.asarray(data).view('<' + self._data_type)
+        # cine files store images bottom-up
+        return frame.reshape(self._height, self._width)[::-1]
+
     @property
     def filename(self):
         return self._filename
@@ -315,6 +450,12 @@ class Cine(FramesSequence):
     def cfa(self):
         return self.setup_fields_dict['cfa']
 
+    @property
+    def cfa_pattern(self):
+        """Colors of the top-left 2x2 pixels of raw color files, or None
+        for other files."""
+        return self._cfa_pattern
+
     @property
     def compression(self):
         return self.header_dict['compression']
@@ -351,14 +492,29 @@ class Cine(FramesSequence):
     def frame_shape(self):
         return self._im_sz
 
-    def get_frame(self, j):
-        md = dict()
-        md['exposure'] = self.all_exposures[j]
-        ts, sec_frac = self.frame_time_stamps[j]
-        md['frame_time'] = {'datetime': ts,
-                            'second_fraction': sec_frac}
-        return Frame(self.process_func(self._get_frame(j)),
-                     frame_no=j, metadata=md)
+    def get_frame(self, j, out=None):
+        # decode straight into out, unless process_func comes in between
+        direct_out = out if self.process_func is _identity else None
+        frame = self._get_frame(j, direct_out)
+        return Frame(self._process_frame(frame, out), frame_no=j,
+                     metadata=self._frame_metadata(j))
+
+    def _frame_metadata(self, j):
+        """Return the metadata of frame j, computed when it is used."""
+        if not self._with_metadata:
+            return None
+        def tags():
+            # only the tags that the file stores become metadata
+            arrays = self._tag_arrays or {}
+            md = {}
+            if 'exposure_only' in arrays:
+                md['exposure'] = arrays['exposure_only'][j] / MAX_INT
+            if 'image_time_only' in arrays:
+                ts, sec_frac = _time_tuple(int(arrays['image_time_only'][j]))
+                md['frame_time'] = {'datetime': ts,
+                                    'second_fraction': sec_frac}
+            return md
+        return LazyMetadata(loader=tags)
 
     def unpack(self, fs, offset=None):
         if offset is not None:
@@ -374,149 +530,322 @@ class Cine(FramesSequence):
         '''
         Reads the tagged block meta-data from the header
         '''
-        tmp_dict = dict()
+        return self._convert_tagged_blocks(self._read_tag_arrays())
+
+    @property
+    def _tag_arrays(self):
+        """The raw tagged blocks, as uint64 arrays, or None."""
+        if self._tags is None:
+            self._tags = [self._read_tag_arrays()]
+        return self._tags[0]
+
+    @property
+    def tagged_blocks(self):
+        """The tagged blocks, with times as (datetime, fraction) tuples and
+        exposures in seconds. Consider `frame_times` and `all_exposures`,
+        which are arrays."""
+        if 'tagged_blocks' not in self._tag_lists:
+            self._tag_lists['tagged_blocks'] = self._convert_tagged_blocks(
+                self._tag_arrays)
+        return self._tag_lists['tagged_blocks']
+
+    @property
+    def frame_time_stamps(self):
+        """The time stamp of every frame, as a list of (datetime, fraction
+        of a second) tuples, in local time. See also `frame_times`."""
+        if 'frame_time_stamps' not in self._tag_lists:
+            times = (self._tag_arrays or {}).get('image_time_only')
+            if times is not None:
+                times = [_time_tuple(t) for t in times.tolist()]
+            self._tag_lists['frame_time_stamps'] = times
+        return self._tag_lists['frame_time_stamps']
+
+    @property
+    def frame_times(self):
+        """The time stamp of every frame, as a datetime64[ns] array in
+        UTC, or None if the file does not store them."""
+        times = (self._tag_arrays or {}).get('image_time_only')
+        if times is None:
+            return None
+        seconds = (times >> np.uint64(32)).astype(np.int64)
+        nanoseconds = ((times & np.uint64(FRACTION_MASK)) * np.uint64(10**9)
+                       >> np.uint64(32)).astype(np.int64)
+        return (seconds * 10**9 + nanoseconds).astype('datetime64[ns]')
+
+    @property
+    def all_exposures(self):
+        """The exposure time of every frame in seconds, as a float64
+        array, or None if the file does not store them."""
+        exposures = (self._tag_arrays or {}).get('exposure_only')
+        if exposures is None:
+            return None
+        return exposures / MAX_INT
+
+    def _read_tag_arrays(self):
+        '''
+        Read the data of the tagged blocks as arrays of raw integers.
+        '''
+        arrays = dict()
         if not self.off_setup + self.setup_length < self.off_image_offsets:
             return
         next_tag_exists = True
         next_tag_offset = 0
         while next_tag_exists:
             block_size, next_tag_exists = self._read_tag_block(next_tag_offset,
-                                                               tmp_dict)
+                                                               arrays)
             next_tag_offset += block_size
-        return tmp_dict
+        return arrays
 
-    def _read_tag_block(self, off_set, accum_dict):
+    @staticmethod
+    def _convert_tagged_blocks(arrays):
         '''
-        Internal helper-function for reading the tagged blocks.
+        Convert raw tagged block data to times and exposures in seconds.
         '''
-        with FileLocker(self.file_lock):
-            self.f.seek(self.off_setup + self.setup_length + off_set)
-            block_size = self.unpack(DWORD)
-            b_type = self.unpack(WORD)
-            more_tags = self.unpack(WORD)
+        if arrays is None:
+            return
+        tmp_dict = dict()
+        for name, data in arrays.items():
+            data = data.tolist()
+            # parse time
+            if name in ('image_time_total', 'image_time_only'):
+                data = [_time_tuple(d) for d in data]
+            # convert exposure to seconds
+            if name == 'exposure_only':
+                data = [d/(MAX_INT) for d in data]
+            tmp_dict[name] = data
+        return tmp_dict
 
-            if b_type == 1004:
-                # docs say to ignore range data it seems to be a poison flag,
-                # if see this, give up tag parsing
-                return block_size, 0
+    def frame_metadata_table(self):
+        """Return the metadata of all frames at once, as a dict of arrays.
 
-            try:
-                d_name, d_type = TAGGED_FIELDS[b_type]
+        The keys are 'frame_no', and 'time_float' (seconds since the epoch)
+        and 'exposure' (seconds) if the file stores them.
+        """
+        table = {'frame_no': np.arange(len(self))}
+        arrays = self._tag_arrays or {}
+        if 'image_time_only' in arrays:
+            times = arrays['image_time_only']
+            table['time_float'] = ((times >> np.uint64(32)) +
+                                   (times & np.uint64(FRACTION_MASK)) /
+                                   MAX_INT)
+        if 'exposure_only' in arrays:
+            table['exposure'] = arrays['exposure_only'] / MAX_INT
+        return table
 
-            except KeyError:
-                return block_size, more_tags
+    def _read_tag_block(self, off_set, accum_dict):
+        '''
+        Internal helper-function for reading the tagged blocks.
+        '''
+        offset = self.off_setup + self.setup_length + off_set
+        block_size, b_type, more_tags = struct.unpack(
+            '<' + DWORD + WORD + WORD, self._reader.read(8, offset))
 
-            if d_type == '':
-                # print "can't deal with  <" + d_name + "> tagged data"
-                return block_size, more_tags
+        if b_type == 1004:
+            # docs say to ignore range data it seems to be a poison flag,
+            # if see this, give up tag parsing
+            return block_size, 0
 
-            s_tmp = struct.Struct('<' + d_type)
-            if (block_size-8) % s_tmp.size != 0:
-                #            print 'something is wrong with your data types'
-                return block_size, more_tags
+        try:
+            d_name, d_type = TAGGED_FIELDS[b_type]
 
-            d_count = (block_size-8)//(s_tmp.size)
+        except KeyError:
+            return block_size, more_tags
 
-            data = self.unpack('%d' % d_count + d_type)
-            if not isinstance(data, tuple):
-                # fix up data due to design choice in self.unpack
-                data = (data, )
+        if d_type == '':
+            # print "can't deal with  <" + d_name + "> tagged data"
+            return block_size, more_tags
 
-            # parse time
-            if b_type == 1002 or b_type == 1001:
-                data = [(datetime.datetime.fromtimestamp(d >> 32),
-                         (FRACTION_MASK & d)/MAX_INT) for d in data]
-            # convert exposure to seconds
-            if b_type == 1003:
-                data = [d/(MAX_INT) for d in data]
+        s_tmp = struct.Struct('<' + d_type)
+        if (block_size-8) % s_tmp.size != 0:
+            #            print 'something is wrong with your data types'
+            return block_size, more_tags
 
-            accum_dict[d_name] = data
+        data = self._reader.read(block_size - 8, offset + 8)
+        accum_dict[d_name] = np.frombuffer(
+            data, '<u%d' % s_tmp.size).astype(np.uint64)
 
         return block_size, more_tags
 
     def read_header(self, fields, offset=0):
-        self.f.seek(offset)
-        tmp = dict()
-        for name, format in fields:
-            val = self.unpack(format)
-            tmp[name] = val
-
-        return tmp
-
-    def _get_frame(self, number):
-        with FileLocker(self.file_lock):
-            # get basic information about the frame we want
-            image_start = self.image_locations[number]
-            annotation_size = self.unpack(DWORD, image_start)
-            # this is not used, but is needed to advance the point in the file
-            annotation = self.unpack('%db' % (annotation_size - 8))
-            image_size = self.unpack(DWORD)
-
-            cfa = self.cfa
-            compression = self.compression
-
-            # sort out data type looking at the cached version
-            data_type = self._data_type
-
-            # actual bit per pixel
-            actual_bits = image_size * 8 // (self._pixel_count)
-
-            # so this seem wrong as 10 or 12 bits won't fit in 'u1'
-            # but I (TAC) may not understand and don't have a packed file
-            # (which the docs seem to imply don't exist) to test on so
-            # I am leaving it.  good luck.
+        return read_fields(self.f, fields, offset)
+
+    def get_frames(self, indices=None, out=None):
+        """Read several frames into a single array, reading each run of
+        consecutive frames with one read. See FramesSequence.get_frames."""
+        indices = _normalize_indices(indices, len(self))
+        shape = self._shape
+        block = self._raw_buffer((len(indices), ) + shape, self._dtype, out)
+        # bound the size of a single read (and of the read buffer)
+        channels = 3 if self.cfa != CFA_NONE and self.compression == 0 else 1
+        frame_bytes = (self._pixel_count * channels *
+                       np.dtype(self._data_type).itemsize)
+        per_read = max(1, int(RUN_READ_SIZE // frame_bytes))
+        for start, stop in _index_runs(indices):
+            for n in range(start, stop, per_read):
+                self._get_frame_run(indices[n],
+                                    block[n:min(n + per_read, stop)])
+        return self._process_block(block, out)
+
+    def _get_frame(self, number, out=None):
+        if self._mmap is not None:
+            frame = self._frame_view(number)
+            if out is None:
+                return frame
+            np.copyto(out, frame, casting='unsafe')
+            return out
+        # get basic information about the frame we want
+        image_start = int(self.image_locations[number])
+        annotation_size = self._read_dword(image_start)
+        # skip the annotation, the image size is its last DWORD
+        image_size = self._read_dword(image_start + annotation_size - 4)
+
+        # suck the data out of the file and into a reused buffer
+        data = self._read_buffer(image_size)
+        self._reader.readinto(data, image_start + annotation_size)
+
+        return self._decode_frame(data, out)
+
+    def _read_dword(self, offset):
+        return struct.unpack('<' + DWORD, self._reader.read(4, offset))[0]
+
+    def _read_buffer(self, size):
+        """Return a uint8 scratch array of the given size, which belongs to
+        the current thread."""
+        buf = getattr(self._local, 'buffer', None)
+        if buf is None or buf.size < size:
+            buf = self._local.buffer = np.empty(size, np.uint8)
+        return buf[:size]
+
+    def _get_frame_run(self, first, out):
+        """Read len(out) consecutive frames, starting at `first`, with a
+        single read and decode them into `out`."""
+        count = len(out)
+        locations = self.image_locations[first:first + count].astype(np.int64)
+        if self._mmap is not None or np.any(np.diff(locations) <= 0):
+            # Images are mapped or not stored in order; read them one by
+            # one.
+            for n in range(count):
+                self._get_frame(first + n, out[n])
+            return out
+        # The image size is stored in the last DWORD of the annotation.
+        annotation_size = self._read_dword(locations[-1])
+        image_size = self._read_dword(locations[-1] + annotation_size - 4)
+        buf = self._read_buffer(locations[-1] + annotation_size +
+                                image_size - locations[0])
+        self._reader.readinto(buf, locations[0])
+        images = []
+        for loc in locations:
+            pos = loc - locations[0]
+            annotation_size, = struct.unpack_from('<' + DWORD, buf, pos)
+            image_size, = struct.unpack_from('<' + DWORD, buf,
+                                             pos + annotation_size - 4)
+            images.append((pos + annotation_size, image_size))
+        starts, sizes = np.array(images, dtype=np.intp).T
+        steps = np.diff(starts)
+        if np.all(sizes == sizes[0]) and np.all(steps == steps[:1]):
+            # Images are evenly spaced: decode them all in one pass, from a
+            # strided view of the buffer.
+            step = steps[0] if count > 1 else sizes[0]
+            data = np.lib.stride_tricks.as_strided(
+                buf[starts[0]:], (count, sizes[0]), (step, 1))
+            self._decode_frames(data, out)
+        else:
+            for n, (start, size) in enumerate(images):
+                self._decode_frame(buf[start:start + size], out[n])
+        return out
+
+    def _decode_frame(self, data, out=None):
+        """Convert the raw image bytes of one frame to an array of the
+        requested dtype, written into `out` if given."""
+        frames = self._decode_frames(data[np.newaxis],
+                                     None if out is None else out[np.newaxis])
+        return frames[0]
+
+    def _decode_frames(self, data, out=None):
+        """Convert the raw image bytes of several frames, a uint8 array with
+        one row per frame, to an array of the requested dtype, written into
+        `out` if given."""
+        cfa = self.cfa
+        compression = self.compression
+        shape = (len(data), self._height, self._width)
+
+        # actual bit per pixel
+        actual_bits = data.shape[1] * 8 // (self._pixel_count)
+
+        # if mono-camera, or raw color: one value per pixel
+        if cfa == CFA_NONE or self._demosaic is not None:
+            if cfa == CFA_NONE and compression != 0:
+                raise ValueError("Can not deal with compressed files\n" +
+                                 "compression level: " +
+                                 "{}".format(compression))
+            # un-pack packed data
             if actual_bits in (10, 12):
-                data_type = 'u1'
-
-            # move the file to the right point in the file
-            self.f.seek(image_start + annotation_size)
-
-            # suck the data out of the file and shove into linear
-            # numpy array
-            frame = frombuffer(self.f.read(image_size), data_type)
-
-            # if mono-camera
-            if cfa == CFA_NONE:
-                if compression != 0:
-                    raise ValueError("Can not deal with compressed files\n" +
-                                     "compression level: " +
-                                     "{}".format(compression))
-                # we are working with a monochrome camera
-                # un-pack packed data
-                if (actual_bits == 10):
-                    frame = _ten2sixteen(frame)
-                elif (actual_bits == 12):
-                    frame = _twelve2sixteen(frame)
-                elif (actual_bits % 8):
-                    raise ValueError('Data should be byte aligned, ' +
-                         'or 10 or 12 bit packed (appears to be' +
-                        ' %dbits/pixel?!)' % actual_bits)
-
+                if self._demosaic in (None, 'raw'):
+                    return self._unpack_frames(data, actual_bits, out)
+                frames = self._unpack_frames(data, actual_bits,
+                                             np.empty(shape, np.uint16))
+            elif (actual_bits % 8):
+                raise ValueError('Data should be byte aligned, ' +
+                     'or 10 or 12 bit packed (appears to be' +
+                    ' %dbits/pixel?!)' % actual_bits)
+            else:
                 # re-shape to an array
                 # flip the rows
-                # and the cast to proper type
-                frame = frame.reshape(self._height,
-                                      self._width)[::-1].astype(self._dtype)
-
-                if actual_bits in (10, 12):
-                    frame = frame[::-1, :]
-                    # Don't know why it works this way, but it does...
-            # else, some sort of color layout
+                nbytes = (self._pixel_count *
+                          np.dtype(self._data_type).itemsize)
+                frames = _view(data[:, :nbytes], '<' + self._data_type)
+                frames = frames.reshape(shape)[:, ::-1]
+
+            if self._demosaic in ('bilinear', 'superpixel'):
+                if out is None:
+                    out = np.empty((len(data), ) + self._shape, self._dtype)
+                if self._demosaic == 'bilinear':
+                    return _bilinear_demosaic(frames, self._cfa_pattern, out)
+                return _superpixel_demosaic(frames, self._cfa_pattern, out)
+        # else, some sort of color layout
+        else:
+            if compression == 0:
+                # and re-order so color is RGB (naively saves as BGR)
+                nbytes = (self._pixel_count * 3 *
+                          np.dtype(self._data_type).itemsize)
+                frames = _view(data[:, :nbytes], '<' + self._data_type)
+                frames = frames.reshape(shape + (3, ))[:, ::-1, :, ::-1]
             else:
-                if compression == 0:
-                    # and re-order so color is RGB (naively saves as BGR)
-                    frame = frame.reshape(self._height,
-                                          self._width,
-                                          3)[::-1, :, ::-1].astype(self._dtype)
-                elif compression == 2:
-                    raise ValueError("Can not process un-interpolated movies")
-                else:
-                    raise ValueError("Should never hit this, " +
-                                     "you have an un-documented file\n" +
-                                     "compression level: " +
-                                     "{}".format(compression))
-
-        return frame
+                raise ValueError("Should never hit this, " +
+                                 "you have an un-documented file\n" +
+                                 "compression level: " +
+                                 "{}".format(compression))
+
+        # cast to proper type
+        if out is None:
+            return frames.astype(self._dtype)
+        np.copyto(out, frames, casting='unsafe')
+        return out
+
+    def _unpack_frames(self, data, bits, out=None):
+        """Unpack frames of 10 or 12 bit packed pixels, straight into `out`
+        if it is a uint16 array. Packed images are stored top-down, unlike
+        the other formats."""
+        count = len(data)
+        shape = (count, self._height, self._width)
+        if out is not None and out.dtype == np.uint16:
+            frames = out
+        elif out is None and np.dtype(self._dtype) == np.uint16:
+            frames = out = np.empty(shape, np.uint16)
+        else:
+            frames = np.empty(shape, np.uint16)
+        data = data[:, :self._pixel_count * bits // 8]
+        if self._width % _PACKED[bits][0] == 0:
+            # rows start at whole groups of pixels: unpack row by row
+            _unpack(data.reshape(count, self._height, -1), bits, frames)
+        else:
+            flat = _unpack(data, bits)
+            np.copyto(frames, flat.reshape(shape))
+        if out is None:
+            return frames.astype(self._dtype)
+        if frames is not out:
+            np.copyto(out, frames, casting='unsafe')
+        return out
 
     def __len__(self):
         return self.image_count
@@ -538,6 +867,7 @@ class Cine(FramesSequence):
 
     def close(self):
         self.f.close()
+        self._mmap = None
 
     def __unicode__(self):
         return self.filename
@@ -587,7 +917,7 @@ Pixel Datatype: {dtype}""".format(frame_shape=self.frame_shape,
         with FileLocker(self.file_lock):
 
             self.f.seek(0)
-            max_loc = self.image_locations[0]
+            max_loc = int(self.image_locations[0])
             md5 = hashlib.md5()
 
             chunk_size = 128*md5.block_size
@@ -605,84 +935,180 @@ Pixel Datatype: {dtype}""".format(frame_shape=self.frame_shape,
         return not self == other
 
 
-# Should be divisible by 3, 4 and 5!  This seems to be near-optimal.
-CHUNK_SIZE = 6 * 10 ** 5
+# Packed pixels are stored big-endian, in groups of bytes. For 10 and 12 bits
+# per pixel: the number of pixels in a group, and for every pixel the right
+# shift of the big-endian 16-bit word that starts at byte i of the group.
+_PACKED = {10: (4, (6, 4, 2, 0)),
+           12: (2, (4, 0))}
 
 
-def _ten2sixteen(a):
-    """
-    Convert array of 10bit uints to array of 16bit uints
-    """
-    b = np.zeros(a.size//5*4, dtype='u2')
+def _view(a, dtype):
+    """View the last axis of a uint8 array as another dtype, copying only if
+    the array is not contiguous enough for that."""
+    try:
+        return a.view(dtype)
+    except ValueError:  # older numpy needs a C-contiguous array
+        return np.ascontiguousarray(a).view(dtype)
 
-    for j in range(0, len(a), CHUNK_SIZE):
-        (a0, a1, a2, a3, a4) = [a[j+i:j+CHUNK_SIZE:5].astype('u2')
-                                for i in range(5)]
 
-        k = j//5 * 4
-        k2 = k + CHUNK_SIZE//5 * 4
+def _unpack(a, bits, out=None):
+    """Unpack 10 or 12 bit packed pixels to 16 bit.
 
-        b[k+0:k2:4] = ((a0 & 0b11111111) << 2) + ((a1 & 0b11000000) >> 6)
-        b[k+1:k2:4] = ((a1 & 0b00111111) << 4) + ((a2 & 0b11110000) >> 4)
-        b[k+2:k2:4] = ((a2 & 0b00001111) << 6) + ((a3 & 0b11111100) >> 2)
-        b[k+3:k2:4] = ((a3 & 0b00000011) << 8) + ((a4 & 0b11111111) >> 0)
+    `a` is a uint8 array with the packed pixels along its last axis; other
+    axes may be strided, e.g. to hold several frames. The result, of shape
+    a.shape[:-1] + (pixel count, ), is written into `out` if given. The
+    pixels are computed by a couple of ufuncs per position in the group, on
+    overlapping big-endian views of the packed bytes, without temporary
+    arrays.
+    """
+    pixels, shifts = _PACKED[bits]
+    group = pixels * bits // 8
+    n = a.shape[-1] // group
+    words = np.dtype({'names': ['w%d' % i for i in range(pixels)],
+                      'formats': ['>u2'] * pixels,
+                      'offsets': list(range(pixels)),
+                      'itemsize': group})
+    words = _view(a[..., :n * group], words)
+    if out is None:
+        out = np.empty(a.shape[:-1] + (n * pixels, ), np.uint16)
+    result = out.reshape(out.shape[:-1] + (n, pixels))
+    mask = 2 ** bits - 1
+    for i, shift in enumerate(shifts):
+        target = result[..., i]
+        np.right_shift(words['w%d' % i], shift, out=target)
+        if shift + bits < 16:
+            np.bitwise_and(target, mask, out=target)
+    return out
+
+
+_CHANNELS = {'r': 0, 'g': 1, 'b': 2}
+
+
+def _mean(*arrays):
+    """Rounded mean of 2 or 4 integer arrays."""
+    result = np.add(arrays[0], arrays[1], dtype=np.uint32)
+    for a in arrays[2:]:
+        result += a
+    result += len(arrays) // 2
+    result >>= len(arrays) // 2
+    return result
+
+
+def _bilinear_demosaic(mosaic, pattern, out):
+    """Interpolate the missing colors of a Bayer mosaic bilinearly.
+
+    `mosaic` is an integer array of shape (..., height, width), `pattern`
+    gives the colors of its top-left 2x2 pixels, e.g. 'rggb'. The RGB result
+    is written into `out`, of shape (..., height, width, 3).
+
+    Every color is computed for each of the four positions in the pattern at
+    once, from strided views of the mosaic.
+    """
+    height, width = mosaic.shape[-2:]
+    # Mirror the mosaic at its borders, which keeps the pattern.
+    padded = np.empty(mosaic.shape[:-2] + (height + 2, width + 2), np.uint32)
+    padded[..., 1:-1, 1:-1] = mosaic
+    padded[..., 0, 1:-1] = mosaic[..., 1, :]
+    padded[..., -1, 1:-1] = mosaic[..., -2, :]
+    padded[..., 0] = padded[..., 2]
+    padded[..., -1] = padded[..., -3]
+
+    for i, color in enumerate(pattern):
+        y, x = divmod(i, 2)
+        ny, nx = (height - y + 1) // 2, (width - x + 1) // 2
+
+        def near(dy, dx):
+            # the neighbours at (dy, dx) of the pixels with this color
+            top, left = 1 + y + dy, 1 + x + dx
+            return padded[..., top:top + 2 * ny - 1:2,
+                          left:left + 2 * nx - 1:2]
+
+        target = out[..., y::2, x::2, :]
+        target[..., _CHANNELS[color]] = near(0, 0)
+        if color == 'g':
+            horizontal = pattern[2 * y + 1 - x]
+            vertical = pattern[2 * (1 - y) + x]
+            target[..., _CHANNELS[horizontal]] = _mean(near(0, -1),
+                                                       near(0, 1))
+            target[..., _CHANNELS[vertical]] = _mean(near(-1, 0), near(1, 0))
+        else:
+            other = 'b' if color == 'r' else 'r'
+            target[..., 1] = _mean(near(-1, 0), near(1, 0),
+                                   near(0, -1), near(0, 1))
+            target[..., _CHANNELS[other]] = _mean(near(-1, -1), near(-1, 1),
+                                                  near(1, -1), near(1, 1))
+    return out
 
-    return b
 
+def _superpixel_demosaic(mosaic, pattern, out):
+    """Combine every 2x2 block of a Bayer mosaic into one RGB pixel, with
+    the mean of its two green pixels.
 
-def _sixteen2ten(b):
+    `mosaic` is an integer array of shape (..., height, width), `pattern`
+    gives the colors of its top-left 2x2 pixels, e.g. 'rggb'. The result is
+    written into `out`, of shape (..., height // 2, width // 2, 3).
     """
-    Convert array of 16bit uints to array of 10bit uints
-    """
-    a = np.zeros(b.size//4*5, dtype='u1')
+    height, width = mosaic.shape[-2:]
+    greens = []
+    for i, color in enumerate(pattern):
+        y, x = divmod(i, 2)
+        pixels = mosaic[..., y:height - height % 2:2, x:width - width % 2:2]
+        if color == 'g':
+            greens.append(pixels)
+        else:
+            out[..., _CHANNELS[color]] = pixels
+    out[..., 1] = _mean(*greens)
+    return out
 
-    for j in range(0, len(a), CHUNK_SIZE):
-        (b0, b1, b2, b3) = [b[j+i:j+CHUNK_SIZE:4] for i in range(4)]
 
-        k = j//4 * 5
-        k2 = k + CHUNK_SIZE//4 * 5
+def _time_tuple(t):
+    """Convert a 64-bit cine time stamp to a (datetime in local time,
+    fraction of a second) tuple."""
+    return (datetime.datetime.fromtimestamp(t >> 32),
+            (FRACTION_MASK & t) / MAX_INT)
 
-        a[k+0:k2:5] =                              ((b0 & 0b1111111100) >> 2)
-        a[k+1:k2:5] = ((b0 & 0b0000000011) << 6) + ((b1 & 0b1111110000) >> 4)
-        a[k+2:k2:5] = ((b1 & 0b0000001111) << 4) + ((b2 & 0b1111000000) >> 6)
-        a[k+3:k2:5] = ((b2 & 0b0000111111) << 2) + ((b3 & 0b1100000000) >> 8)
-        a[k+4:k2:5] = ((b3 & 0b0011111111) << 0)
 
-    return a
+def _ten2sixteen(a, out=None):
+    """
+    Convert array of 10bit uints to array of 16bit uints
+    """
+    return _unpack(a, 10, out)
 
 
-def _twelve2sixteen(a):
+def _sixteen2ten(b):
     """
-    Convert array of 12bit uints to array of 16bit uints
+    Convert array of 16bit uints to array of 10bit uints
     """
-    b = np.zeros(a.size//3*2, dtype='u2')
+    b = np.asarray(b, dtype='u2').reshape(-1, 4)
+    a = np.empty((len(b), 5), dtype='u1')
 
-    for j in range(0, len(a), CHUNK_SIZE):
-        (a0, a1, a2) = [a[j+i:j+CHUNK_SIZE:3].astype('u2') for i in range(3)]
+    b0, b1, b2, b3 = b.T
+    a[:, 0] =                              ((b0 & 0b1111111100) >> 2)
+    a[:, 1] = ((b0 & 0b0000000011) << 6) + ((b1 & 0b1111110000) >> 4)
+    a[:, 2] = ((b1 & 0b0000001111) << 4) + ((b2 & 0b1111000000) >> 6)
+    a[:, 3] = ((b2 & 0b0000111111) << 2) + ((b3 & 0b1100000000) >> 8)
+    a[:, 4] = ((b3 & 0b0011111111) << 0)
 
-        k = j//3 * 2
-        k2 = k + CHUNK_SIZE//3 * 2
+    return a.ravel()
 
-        b[k+0:k2:2] = ((a0 & 0xFF) << 4) + ((a1 & 0xF0) >> 4)
-        b[k+1:k2:2] = ((a1 & 0x0F) << 8) + ((a2 & 0xFF) >> 0)
 
-    return b
+def _twelve2sixteen(a, out=None):
+    """
+    Convert array of 12bit uints to array of 16bit uints
+    """
+    return _unpack(a, 12, out)
 
 
 def _sixteen2twelve(b):
     """
     Convert array of 16bit uints to array of 12bit uints
     """
-    a = np.zeros(b.size//2*3, dtype='u1')
-
-    for j in range(0, len(a), CHUNK_SIZE):
-        (b0, b1) = [b[j+i:j+CHUNK_SIZE:2] for i in range(2)]
-
-        k = j//2 * 3
-        k2 = k + CHUNK_SIZE//2 * 3
+    b = np.asarray(b, dtype='u2').reshape(-1, 2)
+    a = np.empty((len(b), 3), dtype='u1')
 
-        a[k+0:k2:3] =                       ((b0 & 0xFF0) >> 4)
-        a[k+1:k2:3] = ((b0 & 0x00F) << 4) + ((b1 & 0xF00) >> 8)
-        a[k+2:k2:3] = ((b1 & 0x0FF) << 0)
+    b0, b1 = b.T
+    a[:, 0] =                       ((b0 & 0xFF0) >> 4)
+    a[:, 1] = ((b0 & 0x00F) << 4) + ((b1 & 0xF00) >> 8)
+    a[:, 2] = ((b1 & 0x0FF) << 0)
 
-    return a
+    return a.ravel()
@@ -9,14 +9,17 @@ from io import BytesIO
 from base64 import b64encode
 from contextlib import contextmanager
 
-try:
-    from matplotlib.colors import ColorConverter
-    import matplotlib as mpl
-    import matplotlib.pyplot as plt
-except ImportError:
-    ColorConverter = None
-    mpl = None
-    plt = None
+
+def _import_matplotlib():
+    """Import matplotlib on first use, because it is slow to import.
+
+    Returns the matplotlib and pyplot modules, or raises ImportError."""
+    try:
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise ImportError("This feature requires matplotlib.")
+    return mpl, plt
 
 
 def export(sequence, filename, rate=30, bitrate=None,
@@ -356,7 +359,9 @@ def to_rgb(image, colors=None, normed=True):
             raise IndexError('Not enough color values to build rgb image')
     else:
         # identify rgb values of channels using matplotlib ColorConverter
-        if ColorConverter is None:
+        try:
+            from matplotlib.colors import ColorConverter
+        except ImportError:
             raise ImportError('Matplotlib required for conversion to rgb')
         if channels > len(colors):
             raise IndexError('Not enough color values to build rgb image')
@@ -415,8 +420,7 @@ def plot_to_frame(fig, width=512, close_fig=False, bbox_inches=None):
     -------
     pims.Frame object containing RGBA values (dtype uint8)
     """
-    if mpl is None:
-        raise ImportError("This feature requires matplotlib.")
+    mpl, plt = _import_matplotlib()
     from pims import Frame
     if isinstance(fig, mpl.axes.Axes):
         fig = fig.figure
@@ -455,8 +459,7 @@ def plots_to_frame(figures, width=512, close_fig=False, bbox_inches=None):
     -------
     pims.Frame object containing a stack of RGBA values (dtype uint8)
     """
-    if mpl is None:
-        raise ImportError("This feature requires matplotlib.")
+    mpl, plt = _import_matplotlib()
     from pims import Frame
     if isinstance(figures, mpl.axes.Axes) or \
        isinstance(figures, mpl.figure.Figure):
@@ -48,11 +48,18 @@ import re
 import subprocess as sp
 import sys
 import os
+import threading
 
 import numpy as np
 
-from pims.base_frames import FramesSequence
+from pims.base_frames import (FramesSequence, ProbeInfo, _normalize_indices,
+                              _index_runs)
 from pims.frame import Frame
+from pims.utils.index_cache import load_index, save_index
+from pims.utils.misc import reduced_size
+
+# Increment when the format of the index (see _probe) changes.
+_INDEX_VERSION = 1
 
 
 try:
@@ -76,17 +83,85 @@ def try_ffmpeg(FFMPEG_BINARY):
 FFMPEG_BINARY_SUGGESTIONS = ['ffmpeg', 'ffmpeg.exe']
 
 FFMPEG_BINARY = None
-for name in FFMPEG_BINARY_SUGGESTIONS:
-    if try_ffmpeg(name):
-        FFMPEG_BINARY = name
-        break
+_ffmpeg_searched = False
+
+
+def find_ffmpeg():
+    """Return the name of the ffmpeg binary, or None if it is not found.
+
+    The search spawns processes, so it is done on first use only."""
+    global FFMPEG_BINARY, _ffmpeg_searched
+    if FFMPEG_BINARY is None and not _ffmpeg_searched:
+        _ffmpeg_searched = True
+        for name in FFMPEG_BINARY_SUGGESTIONS:
+            if try_ffmpeg(name):
+                FFMPEG_BINARY = name
+                break
+    return FFMPEG_BINARY
 
 
 def available():
-    return FFMPEG_BINARY is not None
+    return find_ffmpeg() is not None
+
+
+# number of channels and data type of the pixel formats
+_pix_fmt_dict = {'rgb24': (3, np.uint8),
+                 'rgba': (4, np.uint8),
+                 'gray': (1, np.uint8),
+                 'gray16le': (1, np.dtype('<u2'))}
+
+
+def _read_frame(pipe, frame):
+    """Fill a frame with bytes from a pipe, without allocating.
+
+    Returns False if the pipe was at its end."""
+    flat = frame.reshape(-1).view(np.uint8)
+    pos = 0
+    while pos < flat.size:
+        count = pipe.readinto(flat[pos:])
+        if not count:
+            if pos:
+                raise IOError("ffmpeg stopped in the middle of a frame")
+            return False
+        pos += count
+    return True
 
-_pix_fmt_dict = {'rgb24': 3,
-                 'rgba': 4}
+
+def _parse_ffmpeg_stderr(stderr, filename):
+    """Find the size, frame rate and length of a video in the stderr of
+    ffmpeg."""
+    lines = stderr.splitlines()
+    if any("No such file or directory" in l for l in lines):
+        raise IOError("%s not found ! Wrong path ?" % filename)
+
+    # get the output lines that describe the video
+    try:
+        line = [l for l in lines if ' Video: ' in l][0]
+    except IndexError:
+        raise IOError("ffmpeg found no video stream in %s" % filename)
+
+    # get the size, of the form 460x320 (w x h)
+    match = re.search(r" ([0-9]+)x([0-9]+)(,| )", line)
+    size = [int(match.group(1)), int(match.group(2))]
+
+    match = re.search(r"([0-9.]+)k? (fps|tbr)", line)
+    frame_rate = float(match.group(1)) if match else np.nan
+
+    # the progress report ends with the number of frames copied
+    counts = re.findall(r"frame=\s*([0-9]+)", stderr)
+    if counts:
+        length = int(counts[-1])
+    else:
+        match = re.search(r"Duration: ([0-9]+):([0-9]+):([0-9.]+)",
+                          stderr)
+        if match is None or not frame_rate > 0:
+            raise IOError("ffmpeg did not report the length of %s" %
+                          filename)
+        h, m, s = match.groups()
+        duration = int(h) * 3600 + int(m) * 60 + float(s)
+        length = int(round(duration * frame_rate))
+    return dict(size=np.array(size), length=np.array(length),
+                frame_rate=np.array(frame_rate))
 
 
 class FFmpegVideoReader(FramesSequence):
@@ -102,11 +177,29 @@ class FFmpegVideoReader(FramesSequence):
     process_func : function, optional
         callable with signalture `proc_img = process_func(img)`,
         which will be applied to the data from each frame
-    dtype : numpy datatype, optional
-        Image arrays will be converted to this datatype.
+    pix_fmt : {'rgb24', 'rgba', 'gray', 'gray16le'}, optional
+        Pixel format of the decoded frames. Default 'rgb24'.
+    use_cache : boolean, optional
+        In 'buffer' mode, reuse the buffer file of a previous opening of
+        the video if it is complete. True by default.
     as_grey : boolean, optional
         Convert color images to greyscale. False by default.
-        May not be used in conjection with process_func.
+        May not be used in conjection with process_func. The conversion is
+        done by ffmpeg, by decoding to the 'gray' pixel format unless
+        pix_fmt is a greyscale format already.
+    crop : tuple of int, optional
+        (x, y, width, height) of a rectangle, in pixels, to which ffmpeg
+        crops the frames.
+    downscale : int, optional
+        Let ffmpeg reduce the (cropped) frames by this factor, averaging
+        over blocks of pixels. Default 1.
+    mode : {'buffer', 'seek'}, optional
+        In 'buffer' mode (default), the whole video is decoded by ffmpeg in
+        a background thread into a buffer file next to the video, named
+        `<filename>.pims_buffer`. Frames are available as soon as they have
+        been decoded. In 'seek' mode, no buffer is used: the frames that
+        are requested are decoded on demand, after seeking to them with
+        ffmpeg's -ss option. This assumes a constant frame rate.
 
     Examples
     --------
@@ -129,91 +222,208 @@ class FFmpegVideoReader(FramesSequence):
 
     """
     def __init__(self, filename, process_func=None, pix_fmt="rgb24",
-                 use_cache=True, as_grey=False):
+                 use_cache=True, as_grey=False, mode='buffer', crop=None,
+                 downscale=1):
 
         self.filename = filename
+        if as_grey and pix_fmt not in ('gray', 'gray16le'):
+            pix_fmt = 'gray'
         self.pix_fmt = pix_fmt
-        self._initialize(use_cache)
         try:
-            self.depth = _pix_fmt_dict[pix_fmt]
+            self.depth, self._dtype = _pix_fmt_dict[pix_fmt]
         except KeyError:
             raise ValueError("invalid pixel format")
+        if mode not in ('buffer', 'seek'):
+            raise ValueError("mode must be 'buffer' or 'seek'")
+        self._mode = mode
+        self._decode_thread = None
+        self._buffer = None
+
+        self._probe()
+        crop, self._size = reduced_size(self._source_size[0],
+                                        self._source_size[1], crop, downscale)
+        self._filters = self._filter_graph(crop)
         w, h = self._size
-        self._stride = self.depth*w*h
+        if self.depth == 1:
+            self._shape = (h, w)
+        else:
+            self._shape = (h, w, self.depth)
+        self._stride = self.depth*w*h*np.dtype(self._dtype).itemsize
+        if mode == 'buffer':
+            self._initialize(use_cache)
 
         self._validate_process_func(process_func)
         self._as_grey(as_grey, process_func)
 
-    def _initialize(self, use_cache):
-        """ Opens the file, creates the pipe. """
+    def _filter_graph(self, crop):
+        """Return the ffmpeg filters that crop and downscale the frames."""
+        filters = []
+        if crop != (0, 0) + self._source_size:
+            filters.append('crop=w={2}:h={3}:x={0}:y={1}:exact=1'.format(*crop))
+        if self._size != tuple(crop[2:]):
+            filters.append('scale={0}:{1}:flags=area'.format(*self._size))
+        return ','.join(filters)
+
+    def _ffmpeg_cmd(self, input_args=(), output_args=()):
+        output_args = list(output_args)
+        if self._filters:
+            output_args += ['-vf', self._filters]
+        return ([find_ffmpeg(), '-nostdin', '-loglevel', 'error'] +
+                list(input_args) + ['-i', self.filename, '-map', '0:v:0'] +
+                output_args + ['-f', 'rawvideo',
+                               '-pix_fmt', self.pix_fmt, '-'])
 
+    @classmethod
+    def probe(cls, filename):
+        """Read the length, frame shape and frame rate from the header that
+        ffmpeg reports, without reading the packets. The length is exact if
+        the index is cached, and otherwise an estimate from the duration.
+        See FramesSequence.probe."""
+        index = load_index(filename, 'FFmpegVideoReader', _INDEX_VERSION)
+        if index is None:
+            # Without an output, ffmpeg only reads the header.
+            proc = sp.Popen([find_ffmpeg(), '-nostdin', '-i', filename],
+                            stdin=DEVNULL, stdout=DEVNULL, stderr=sp.PIPE)
+            stderr = proc.communicate()[1]
+            index = _parse_ffmpeg_stderr(stderr.decode('utf-8', 'replace'),
+                                         filename)
+        w, h = (int(x) for x in index['size'])
+        frame_rate = float(index['frame_rate'])
+        return ProbeInfo(filename, cls.__name__, int(index['length']),
+                         (h, w, 3), np.dtype(np.uint8),
+                         frame_rate if frame_rate > 0 else None,
+                         os.path.getsize(filename))
+
+    def _probe(self):
+        """Find the size, length and frame rate of the video."""
+        index = load_index(self.filename, 'FFmpegVideoReader',
+                           _INDEX_VERSION)
+        if index is None:
+            # Copying the video stream to nowhere reads every packet, which
+            # gives the number of frames, but does not decode them.
+            cmd = [find_ffmpeg(), '-nostdin', '-i', self.filename,
+                   '-map', '0:v:0', '-c', 'copy', '-f', 'null', '-']
+            proc = sp.Popen(cmd, stdin=DEVNULL, stdout=DEVNULL,
+                            stderr=sp.PIPE)
+            stderr = proc.communicate()[1]
+            index = _parse_ffmpeg_stderr(stderr.decode('utf-8', 'replace'),
+                                         self.filename)
+            save_index(self.filename, 'FFmpegVideoReader', _INDEX_VERSION,
+                       index)
+        self._source_size = tuple(int(x) for x in index['size'])
+        self._len = int(index['length'])
+        self._frame_rate = float(index['frame_rate'])
+
+    def _initialize(self, use_cache):
+        """Map the buffer file, and start decoding into it unless it is
+        complete from a previous opening of this video."""
         buffer_filename = '{0}.pims_buffer'.format(self.filename)
         meta_filename = '{0}.pims_meta'.format(self.filename)
-
-        cmd = [FFMPEG_BINARY, '-i', self.filename,
-                '-f', 'image2pipe',
-                "-pix_fmt", self.pix_fmt,
-                '-vcodec', 'rawvideo', '-']
-        proc = sp.Popen(cmd, stdin=sp.PIPE,
-                             stdout=sp.PIPE,
-                             stderr=sp.PIPE)
-
-        print("Decoding video file...")
-
-        if (os.path.isfile(buffer_filename) and os.path.isfile(meta_filename)
-            and use_cache):
-            print("Reusing buffer from previous opening of this video.")
-            self.data_buffer = open(buffer_filename, 'rb')
-            self.metafile = open(meta_filename, 'r')
-            self._len = int(self.metafile.readline())
-            w = int(self.metafile.readline())
-            h = int(self.metafile.readline())
-            self._size = [w, h]
+        shape = (self._len, ) + self._shape
+        self._meta = [str(self._len), str(self._size[0]), str(self._size[1]),
+                      self.pix_fmt, self._filters or 'none']
+
+        self._decode_cond = threading.Condition()
+        self._decode_error = None
+        self._closing = False
+        if use_cache and self._buffer_complete(buffer_filename,
+                                               meta_filename):
+            self._buffer = np.memmap(buffer_filename, self._dtype, 'r',
+                                     shape=shape)
+            self._decoded = self._len
+            self._decode_done = True
             return
 
-        self.data_buffer = open(buffer_filename, 'wb')
-        self.metafile = open(meta_filename, 'w')
-        print ("Decoding video file. This is slow, but only the first time.")
-        sys.stdout.flush()
-        CHUNKSIZE = 2**14  # utterly arbitrary
-        while True:
-            try:
-                chunk = proc.stdout.read(CHUNKSIZE)
-                if len(chunk) == 0:
-                    break
-                self.data_buffer.write(chunk)
-            except EOFError:
-                break
-        self.data_buffer.close()
-        self.data_buffer = open(buffer_filename, 'rb')
-
-        self._process_ffmpeg_stderr(proc.stderr.read())
-
-        proc.terminate()
-        for std in proc.stdin, proc.stdout, proc.stderr:
-            std.close()
-
-    def _process_ffmpeg_stderr(self, stderr, verbose=False):
-        if verbose:
-            print(stderr)
-
-        lines = stderr.splitlines()
-        if "No such file or directory" in lines[-1]:
-            raise IOError("%s not found ! Wrong path ?" % self.filename)
-
-        # get the output lines that describe the video
-        line = [l for l in lines if ' Video: ' in l][0]
-        # logic to parse all of the MD goes here
-
-        # get the size, of the form 460x320 (w x h)
-        match = re.search(" [0-9]*x[0-9]*(,| )", line)
-        self._size = map(int, line[match.start():match.end()-1].split('x'))
-        # this needs to be more robust
-        self._len = int(lines[-2].split()[1])
-        self.metafile.write('{0}\n'.format(self._len))
-        self.metafile.write('{0}\n'.format(self._size[0]))
-        self.metafile.write('{0}\n'.format(self._size[1]))
-        self.metafile.close()
+        if os.path.isfile(meta_filename):
+            os.remove(meta_filename)
+        self._buffer = np.memmap(buffer_filename, self._dtype, 'w+',
+                                 shape=shape)
+        self._decoded = 0
+        self._decode_done = False
+        self._proc = sp.Popen(self._ffmpeg_cmd(), stdin=DEVNULL,
+                              stdout=sp.PIPE, stderr=DEVNULL)
+        self._decode_thread = threading.Thread(target=self._decode,
+                                               args=(meta_filename, ))
+        self._decode_thread.daemon = True
+        self._decode_thread.start()
+
+    def _buffer_complete(self, buffer_filename, meta_filename):
+        """Check that the buffer holds every frame of the current video."""
+        try:
+            with open(meta_filename, 'r') as metafile:
+                meta = metafile.read().split()
+            if meta != self._meta:
+                return False
+            return (os.path.getsize(buffer_filename) ==
+                    self._len * self._stride and
+                    os.path.getmtime(buffer_filename) >=
+                    os.path.getmtime(self.filename))
+        except (IOError, OSError):
+            return False
+
+    def _decode(self, meta_filename):
+        """Copy the frames from the ffmpeg pipe into the buffer. This runs
+        in a background thread."""
+        try:
+            for i in range(self._len):
+                if self._closing:
+                    return
+                if not _read_frame(self._proc.stdout, self._buffer[i]):
+                    raise IOError("ffmpeg decoded {0} of {1} frames".format(
+                        i, self._len))
+                with self._decode_cond:
+                    self._decoded = i + 1
+                    self._decode_cond.notify_all()
+            self._buffer.flush()
+            # The metadata file marks the buffer as complete.
+            with open(meta_filename, 'w') as metafile:
+                metafile.write('\n'.join(self._meta) + '\n')
+        except Exception:
+            self._decode_error = sys.exc_info()
+        finally:
+            with self._decode_cond:
+                self._decode_done = True
+                self._decode_cond.notify_all()
+            self._proc.stdout.close()
+            if self._proc.poll() is None:
+                self._proc.terminate()
+            self._proc.wait()
+
+    def _wait_for(self, j):
+        """Block until frame j has been decoded into the buffer."""
+        with self._decode_cond:
+            while self._decoded <= j and not self._decode_done:
+                self._decode_cond.wait()
+            if self._decoded <= j:
+                if self._decode_error is not None:
+                    six.reraise(*self._decode_error)
+                raise IOError("The video has been closed.")
+
+    def _decode_range(self, start, count):
+        """Decode `count` consecutive frames with a new ffmpeg process,
+        seeking to frame `start` first."""
+        if not self._frame_rate > 0:
+            raise IOError("ffmpeg did not report the frame rate of %s, so "
+                          "it can only be read in 'buffer' mode." %
+                          self.filename)
+        # Seek to half a frame before the frame, so that the rounding of
+        # the timestamps cannot make ffmpeg skip it.
+        t = max(start - 0.5, 0) / self._frame_rate
+        cmd = self._ffmpeg_cmd(['-ss', '%.6f' % t],
+                               ['-frames:v', str(count)])
+        proc = sp.Popen(cmd, stdin=DEVNULL, stdout=sp.PIPE, stderr=DEVNULL)
+        block = np.empty((count, ) + self._shape, dtype=self._dtype)
+        try:
+            for n, frame in enumerate(block):
+                if not _read_frame(proc.stdout, frame):
+                    raise IOError("ffmpeg could not decode frame {0}".format(
+                        start + n))
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+        return block
 
     def __len__(self):
         return self._len
@@ -222,17 +432,48 @@ class FFmpegVideoReader(FramesSequence):
     def frame_shape(self):
         return self._size
 
+    @property
+    def frame_rate(self):
+        return self._frame_rate
+
     def get_frame(self, j):
-        self.data_buffer.seek(self._stride*j)
-        s = self.data_buffer.read(self._stride)
-        w, h = self._size
-        result = np.fromstring(s,
-            dtype='uint8').reshape((h, w, self.depth))
+        if self._mode == 'seek':
+            result = self._decode_range(j, 1)[0]
+        else:
+            self._wait_for(j)
+            result = np.array(self._buffer[j])
         return Frame(self.process_func(result), frame_no=j)
 
+    def get_frames(self, indices=None, out=None):
+        """Read several frames into a single array. In 'seek' mode, every
+        run of consecutive frames is decoded by a single ffmpeg process.
+        See FramesSequence.get_frames."""
+        indices = _normalize_indices(indices, len(self))
+        if self._mode == 'seek':
+            block = np.empty((len(indices), ) + self._shape, self._dtype)
+            for start, stop in _index_runs(indices):
+                block[start:stop] = self._decode_range(indices[start],
+                                                       stop - start)
+        else:
+            if len(indices):
+                self._wait_for(max(indices))
+            block = np.asarray(self._buffer[indices])
+        return self._process_block(block, out)
+
+    def close(self):
+        if self._decode_thread is not None:
+            self._closing = True
+            try:
+                self._proc.kill()
+            except OSError:
+                pass  # ffmpeg has exited already
+            self._decode_thread.join()
+            self._decode_thread = None
+        self._buffer = None
+
     @property
     def pixel_type(self):
-        raise NotImplemented()
+        return self._dtype
 
     @classmethod
     def class_exts(cls):
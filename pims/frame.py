@@ -13,6 +13,134 @@ MAX_HEIGHT = 512  # maximum height of rich display, in pixels
 MAX_STACK_DEPTH = 128  # max stack count of scrollable stack (for 3D images)
 
 
+class LazyMetadata(dict):
+    """Frame metadata whose values are computed when they are first used.
+
+    Readers use this to avoid the cost of metadata that is never looked at.
+    Looking up a key computes only that value; operations on the whole
+    dict, such as iterating over it, compute all values.
+
+    Parameters
+    ----------
+    values : dict, optional
+        Values that are known already.
+    fields : dict, optional
+        Maps keys to functions without arguments that compute their values.
+    loader : callable, optional
+        Function without arguments that returns a dict of further values, for
+        metadata of which the keys are not known in advance. It is called
+        when a key is used that is not in `values` or `fields`.
+    """
+    def __init__(self, values=None, fields=None, loader=None):
+        super(LazyMetadata, self).__init__(values or {})
+        self._fields = dict(fields or {})
+        self._loaders = [loader] if loader is not None else []
+
+    def _load(self):
+        """Compute all values."""
+        for key in list(self._fields):
+            dict.__setitem__(self, key, self._fields.pop(key)())
+        while self._loaders:
+            for key, value in self._loaders.pop(0)().items():
+                if not dict.__contains__(self, key):
+                    dict.__setitem__(self, key, value)
+
+    def __getitem__(self, key):
+        if not dict.__contains__(self, key):
+            if key in self._fields:
+                dict.__setitem__(self, key, self._fields.pop(key)())
+            else:
+                self._load()
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key) or key in self._fields:
+            return True
+        self._load()
+        return dict.__contains__(self, key)
+
+    def __setitem__(self, key, value):
+        self._fields.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, LazyMetadata):
+            # keep the fields of the other metadata lazy
+            if other._loaders:
+                other._load()
+            for key, value in dict.items(other):
+                self[key] = value
+            for key, field in other._fields.items():
+                dict.pop(self, key, None)
+                self._fields[key] = field
+            other = ()
+        elif hasattr(other, 'keys'):
+            other = [(key, other[key]) for key in other.keys()]
+        for key, value in other:
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def copy(self):
+        result = LazyMetadata(dict(dict.items(self)), self._fields)
+        result._loaders = list(self._loaders)
+        return result
+
+    def __eq__(self, other):
+        self._load()
+        if isinstance(other, LazyMetadata):
+            other._load()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __iter__(self):
+        self._load()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load()
+        return dict.__len__(self)
+
+    def __repr__(self):
+        self._load()
+        return dict.__repr__(self)
+
+    def __reduce__(self):
+        # pickle as a plain dict, as the fields usually refer to a reader
+        self._load()
+        return dict, (dict(dict.items(self)), )
+
+
+def _lazy_method(name):
+    method = getattr(dict, name)
+    def wrapper(self, *args, **kwargs):
+        self._load()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = str(name)
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _name in ['keys', 'values', 'items', 'pop', 'popitem', 'setdefault',
+              '__delitem__']:
+    setattr(LazyMetadata, _name, _lazy_method(_name))
+
+
+def _copy_metadata(metadata):
+    if isinstance(metadata, LazyMetadata):
+        return metadata.copy()
+    return dict(metadata)
+
+
 class Frame(ndarray):
     "Extends a numpy array with meta information"
     # See http://docs.scipy.org/doc/numpy/user/basics.subclassing.html
@@ -26,20 +154,23 @@ class Frame(ndarray):
             frame_no = getattr(input_array, 'frame_no')
 
         obj.frame_no = frame_no
-        # check if the input object _has_ a metadata attribute
-        if hasattr(input_array, 'metadata'):
-            # and get a local (shallow) copy
-            arr_metadata = dict(getattr(input_array, 'metadata'))
-        else:
-            # else, empty dict
-            arr_metadata = dict()
 
         # validation on input
         if metadata is None:
             metadata = {}
 
-        # override meta-data on input object with explicitly passed in metadata
-        arr_metadata.update(metadata)
+        # check if the input object _has_ metadata
+        input_metadata = getattr(input_array, 'metadata', None)
+        if input_metadata is None or input_metadata is metadata or (
+                not isinstance(input_metadata, LazyMetadata) and
+                not input_metadata):
+            # get a local (shallow) copy of the metadata, keeping it lazy
+            arr_metadata = _copy_metadata(metadata)
+        else:
+            # override meta-data on input object with explicitly passed in
+            # metadata
+            arr_metadata = _copy_metadata(input_metadata)
+            arr_metadata.update(metadata)
 
         # assign to the output
         obj.metadata = arr_metadata
@@ -4,6 +4,7 @@ from __future__ import (absolute_import, division, print_function,
 import six
 from six.moves import map
 import os
+import sys
 import glob
 import fnmatch
 from warnings import warn
@@ -13,22 +14,65 @@ from io import BytesIO
 
 import numpy as np
 
-from pims.base_frames import FramesSequence, FramesSequenceND
+from pims.base_frames import (FramesSequence, FramesSequenceND, ProbeInfo,
+                              _normalize_indices, _identity)
 from pims.frame import Frame
 from pims.utils.sort import natural_keys
+from pims.utils.index_cache import load_index, save_index
 
-# skimage.io.plugin_order() gives a nice hierarchy of implementations of imread.
-# If skimage is not available, go down our own hard-coded hierarchy.
-try:
-    from skimage.io import imread
-except ImportError:
+# Increment when the format of the indices stored by the readers in this
+# module changes.
+_INDEX_VERSION = 1
+
+_imread_cache = []
+
+
+# number of channels and data type of the images that scikit-image reads,
+# per PIL mode
+_pil_modes = {'L': (1, np.uint8),
+              'RGB': (3, np.uint8),
+              'RGBA': (4, np.uint8),
+              'I;16': (1, np.uint16),
+              'I': (1, np.int32),
+              'F': (1, np.float32)}
+
+
+def _find_imread():
+    """Return the imread implementation to use, or None.
+
+    This is looked up on first use, because importing scikit-image or
+    matplotlib is slow."""
+    if _imread_cache:
+        return _imread_cache[0]
+    # skimage.io.plugin_order() gives a nice hierarchy of implementations of
+    # imread. If skimage is not available, go down our own hard-coded
+    # hierarchy.
     try:
-        from matplotlib.pyplot import imread
+        from skimage.io import imread
     except ImportError:
         try:
-            from scipy.ndimage import imread
-        except:
-            imread = None
+            from matplotlib.pyplot import imread
+        except ImportError:
+            try:
+                from scipy.ndimage import imread
+            except:
+                imread = None
+    _imread_cache.append(imread)
+    return imread
+
+
+def __getattr__(name):
+    # Keep `pims.image_sequence.imread` available without importing the
+    # backend when this module is imported.
+    if name == 'imread':
+        return _find_imread()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(
+        __name__, name))
+
+
+if sys.version_info < (3, 7):
+    # no module-level __getattr__; look imread up right away
+    imread = _find_imread()
 
 
 class ImageSequence(FramesSequence):
@@ -74,6 +118,52 @@ class ImageSequence(FramesSequence):
     >>> frame_count = len(video) # Number of frames in video
     >>> frame_shape = video.frame_shape # Pixel dimensions of video
     """
+    @classmethod
+    def probe(cls, path_spec):
+        """Find the images, and read the shape and dtype from the header of
+        the first one only. See FramesSequence.probe."""
+        self = cls.__new__(cls, path_spec)
+        self.kwargs = dict()
+        self._is_zipfile = False
+        self._zipfile = None
+        self._get_files(path_spec)
+        try:
+            first = self._filepaths[0]
+            try:
+                shape, dtype = self._image_header(first)
+            except (ImportError, IOError, KeyError, ValueError):
+                tmp = self.imread(first, **self.kwargs)
+                shape, dtype = tmp.shape, tmp.dtype
+            if self._is_zipfile:
+                file_size = os.path.getsize(self.pathname)
+            else:
+                file_size = sum(os.path.getsize(fn) for fn in self._filepaths)
+        finally:
+            self.close()
+        return ProbeInfo(path_spec, cls.__name__, self._count, shape,
+                         np.dtype(dtype), None, file_size)
+
+    def _image_header(self, filename):
+        """Read the shape and dtype of an image from its header, with PIL.
+
+        This gives what imread would give only if that is scikit-image's."""
+        imread = _find_imread()
+        if (type(self).imread is not ImageSequence.imread or imread is None
+                or not imread.__module__.startswith('skimage')):
+            raise ValueError("images are not read by scikit-image")
+        from PIL import Image
+        if self._is_zipfile:
+            filename = BytesIO(self._zipfile.read(filename))
+        image = Image.open(filename)
+        try:
+            channels, dtype = _pil_modes[image.mode]
+            width, height = image.size
+        finally:
+            image.close()
+        if channels == 1:
+            return (height, width), dtype
+        return (height, width, channels), dtype
+
     def __init__(self, path_spec, process_func=None, dtype=None,
                  as_grey=False, plugin=None):
         try:
@@ -112,6 +202,7 @@ class ImageSequence(FramesSequence):
         self.close()
 
     def imread(self, filename, **kwargs):
+        imread = _find_imread()
         if imread is None:
             raise ImportError("One of the following packages are required for "
                               "using the ImageSequence reader: "
@@ -149,19 +240,40 @@ class ImageSequence(FramesSequence):
                  "files, use a pattern like 'path/to/images/*.png'",
                  UserWarning)
             directory = path_spec
-            filenames = os.listdir(directory)
-            make_full_path = lambda filename: (
-                os.path.abspath(os.path.join(directory, filename)))
-            filepaths = list(map(make_full_path, filenames))
         else:
-            filepaths = glob.glob(path_spec)
-        self._filepaths = sorted(filepaths, key=natural_keys)
+            directory = os.path.dirname(self.pathname)
+
+        # The list of files only changes when the directory does.
+        index = None
+        if not glob.has_magic(directory):
+            index = load_index(directory, 'ImageSequence', _INDEX_VERSION,
+                               extra=self.pathname)
+        if index is not None:
+            self._filepaths = index['filepaths'].tolist()
+        else:
+            if os.path.isdir(path_spec):
+                filenames = os.listdir(directory)
+                make_full_path = lambda filename: (
+                    os.path.abspath(os.path.join(directory, filename)))
+                filepaths = list(map(make_full_path, filenames))
+            else:
+                filepaths = glob.glob(path_spec)
+            self._filepaths = sorted(filepaths, key=natural_keys)
+            if self._filepaths and not glob.has_magic(directory):
+                save_index(directory, 'ImageSequence', _INDEX_VERSION,
+                           dict(filepaths=np.array(self._filepaths)),
+                           extra=self.pathname)
         self._count = len(self._filepaths)
 
         # If there were no matches, this was probably a user typo.
         if self._count == 0:
             raise IOError("No files were found matching that path.")
 
+    @property
+    def thread_safe(self):
+        # reads from a single zipfile handle are not thread safe
+        return not self._is_zipfile
+
     def get_frame(self, j):
         if j > self._count:
             raise ValueError("File does not contain this many frames")
@@ -171,6 +283,23 @@ class ImageSequence(FramesSequence):
         res = Frame(self.process_func(res), frame_no=j)
         return res
 
+    def get_frames(self, indices=None, out=None):
+        """Read several images into a single array, decoding each file
+        straight into its place in the output. See
+        FramesSequence.get_frames."""
+        indices = _normalize_indices(indices, len(self))
+        for n, j in enumerate(indices):
+            res = self.imread(self._filepaths[j], **self.kwargs)
+            if res.dtype != self._dtype:
+                res = res.astype(self._dtype)
+            res = self.process_func(res)
+            if out is None:
+                out = np.empty((len(indices),) + res.shape, res.dtype)
+            out[n] = res
+        if out is None:
+            out = np.empty((0,) + self.frame_shape, self._dtype)
+        return out
+
     def __len__(self):
         return self._count
 
@@ -243,7 +372,9 @@ class ImageSequenceND(FramesSequenceND, ImageSequence):
         in the order they should be loaded. When a path to a zipfile is
         specified, all files in the zipfile will be loaded. The filenames
         should contain the indices of T, Z and C, preceded by a axis
-        identifier such as: 'file_t001c05z32'.
+        identifier such as: 'file_t001c05z32'. Planes for which there is
+        no file are reported with a warning when opening; reading them
+        raises an IndexError.
     process_func : function, optional
         callable with signature `proc_img = process_func(img)`,
         which will be applied to the data from each frame.
@@ -286,6 +417,12 @@ class ImageSequenceND(FramesSequenceND, ImageSequence):
         Applicable to RGB images. Signifies the position of the rgb axis in
         the input image. True when color data is stored in the last dimension.
     """
+    @classmethod
+    def probe(cls, path_spec):
+        """Open the sequence to find the shape of its frames, which depends
+        on the axes. See FramesSequence.probe."""
+        return super(ImageSequence, cls).probe(path_spec)
+
     def __init__(self, path_spec, process_func=None, dtype=None,
                  as_grey=False, plugin=None, axes_identifiers='tzc'):
         if as_grey:
@@ -328,35 +465,124 @@ class ImageSequenceND(FramesSequenceND, ImageSequence):
 
     def _get_files(self, path_spec):
         super(ImageSequenceND, self)._get_files(path_spec)
-        self._toc = np.array([filename_to_indices(f, self.axes_identifiers)
-                              for f in self._filepaths])
-        for n, name in enumerate(self.axes_identifiers):
-            if np.all(self._toc[:, n] == 0):
-                self._toc = np.delete(self._toc, n, axis=1)
-            else:
-                self._toc[:, n] = self._toc[:, n] - min(self._toc[:, n])
-                self._init_axis(name, max(self._toc[:, n]) + 1)
+        toc = self._read_indices()
+        # Axes of which all indices are 0 do not occur in the filenames.
+        present = [n for n in range(len(self.axes_identifiers))
+                   if np.any(toc[:, n] != 0)]
+        self._toc_axes = [self.axes_identifiers[n] for n in present]
+        self._toc = toc[:, present]
+        if len(self._toc):
+            self._toc = self._toc - self._toc.min(0)
+        sizes = [int(size) + 1 for size in self._toc.max(0)]
+        for name, size in zip(self._toc_axes, sizes):
+            self._init_axis(name, size)
         self._filepaths = np.array(self._filepaths)
+        self._build_lookup(sizes)
+
+    def _build_lookup(self, sizes):
+        """Map the coordinates of every plane to the index of its file, so
+        that get_frame_2D finds a file in constant time. Missing planes are
+        reported here, once."""
+        count = int(np.prod(sizes))
+        if count <= max(4 * len(self._toc), 2**20):
+            # a dense array of file indices, -1 where there is no file
+            linear = np.ravel_multi_index(tuple(self._toc.T), sizes)
+            unique, first = np.unique(linear, return_index=True)
+            self._lookup = np.full(sizes, -1, dtype=np.intp)
+            self._lookup.flat[unique] = first
+            self._lookup_dict = None
+            planes = len(unique)
+            missing = np.argwhere(self._lookup == -1)[:3]
+        else:
+            # sparse layouts: a dict of file indices by coordinates
+            self._lookup = None
+            self._lookup_dict = {}
+            for i, row in enumerate(self._toc.tolist()):
+                self._lookup_dict.setdefault(tuple(row), i)
+            planes = len(self._lookup_dict)
+            missing = []
+            if planes < count:
+                for coords in np.ndindex(*sizes):
+                    if coords not in self._lookup_dict:
+                        missing.append(coords)
+                        if len(missing) == 3:
+                            break
+
+        if planes < len(self._toc):
+            warn("{0} files have the same axes indices as another file; "
+                 "only the first of these is read.".format(
+                     len(self._toc) - planes), UserWarning)
+        if planes < count:
+            examples = ['({0})'.format(', '.join(
+                '{0}={1}'.format(name, int(c))
+                for name, c in zip(self._toc_axes, coords)))
+                for coords in missing]
+            warn("{0} of {1} planes have no file, e.g. {2}. Reading these "
+                 "raises an IndexError.".format(count - planes, count,
+                                                ', '.join(examples)),
+                 UserWarning)
 
-    def get_frame(self, i):
-        frame = super(ImageSequenceND, self).get_frame(i)
-        return Frame(self.process_func(frame), frame_no=i)
+    def _lookup_file(self, ind):
+        """Return the index of the file with the plane at coordinates
+        `ind`."""
+        coords = tuple(int(ind[name]) for name in self._toc_axes)
+        if self._lookup is not None:
+            try:
+                i = self._lookup[coords]
+            except IndexError:
+                i = -1
+        else:
+            i = self._lookup_dict.get(coords, -1)
+        if i < 0:
+            raise IndexError("There is no file for the plane at {0}".format(
+                ', '.join('{0}={1}'.format(name, c)
+                          for name, c in zip(self._toc_axes, coords))))
+        return i
+
+    def _read_indices(self):
+        """Parse the axes indices from the filenames, or load them from
+        the index cache."""
+        cacheable = (isinstance(self.pathname, six.string_types) and
+                     not self._is_zipfile)
+        if cacheable:
+            if os.path.isdir(self.pathname):
+                directory = self.pathname
+            else:
+                directory = os.path.dirname(self.pathname)
+            cacheable = not glob.has_magic(directory)
+        extra = '\n'.join([self.pathname] + list(self.axes_identifiers))
+        if cacheable:
+            index = load_index(directory, 'ImageSequenceND', _INDEX_VERSION,
+                               extra=extra)
+            if (index is not None and
+                    len(index['toc']) == len(self._filepaths)):
+                return index['toc']
+        toc = np.array([filename_to_indices(f, self.axes_identifiers)
+                        for f in self._filepaths])
+        if cacheable:
+            save_index(directory, 'ImageSequenceND', _INDEX_VERSION,
+                       dict(toc=toc), extra=extra)
+        return toc
+
+    def get_frame(self, i, out=None):
+        frame = super(ImageSequenceND, self).get_frame(i, out)
+        if self.process_func is not _identity:
+            frame = self.process_func(frame)
+            if out is not None:
+                out[...] = frame
+                frame = out
+        return Frame(frame, frame_no=i)
 
     def get_frame_2D(self, **ind):
-        if self.is_rgb:
-            c = ind['c']
-            row = [ind[name] for name in self.axes_identifiers if name != 'c']
-        else:
-            row = [ind[name] for name in self.axes_identifiers]
-        i = np.argwhere(np.all(self._toc == row, 1))[0, 0]
+        i = self._lookup_file(ind)
         res = self.imread(self._filepaths[i], **self.kwargs)
         if res.dtype != self._dtype:
             res = res.astype(self._dtype)
         if self.is_rgb:
             if self.is_interleaved:
-                return res[:, :, c]
+                return res[:, :, ind['c']]
             else:
-                return res[c]
+                return res[ind['c']]
         else:
             return res
 
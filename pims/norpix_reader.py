@@ -7,11 +7,11 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import six
-from six.moves import range
 
-from pims.frame import Frame
-from pims.base_frames import FramesSequence, index_attr
-from pims.utils.misc import FileLocker
+from pims.frame import Frame, LazyMetadata
+from pims.base_frames import (FramesSequence, ProbeInfo, index_attr,
+                              _normalize_indices, _index_runs)
+from pims.utils.misc import PositionalFile, read_fields, RUN_READ_SIZE
 import os, struct, itertools
 from warnings import warn
 import datetime
@@ -65,26 +65,49 @@ class NorpixSeq(FramesSequence):
         Image arrays will be converted to this datatype.
     as_grey : boolean, optional
         Ignored.
+    mmap : boolean, optional
+        Memory-map the file instead of reading it. Frames are then returned
+        as read-only views into the file, without copying and without
+        locking. False by default.
+    metadata : boolean, optional
+        Attach the time of every frame as metadata. The time is converted
+        to a datetime only when it is used. True by default.
     """
     @classmethod
     def class_exts(cls):
         return {'seq'} | super(NorpixSeq, cls).class_exts()
 
+    @classmethod
+    def probe(cls, filename):
+        """Read the length, frame shape, dtype and frame rate from the
+        header of the file only. See FramesSequence.probe."""
+        with open(filename, 'rb') as f:
+            header = read_fields(f, HEADER_FIELDS)
+        cls._check_header(header)
+        image_offset = 8192 if header['version'] >= 5 else 1024
+        file_size = os.path.getsize(filename)
+        length = (file_size - image_offset) // header['true_image_size']
+        return ProbeInfo(filename, cls.__name__, length,
+                         (header['height'], header['width']),
+                         np.dtype('uint%i' % header['bit_depth']),
+                         header['suggested_frame_rate'], file_size)
+
     propagate_attrs = ['frame_shape', 'pixel_type', 'get_time',
                        'get_time_float', 'filename', 'width', 'height',
                        'frame_rate']
 
-    def __init__(self, filename, process_func=None, dtype=None, as_grey=False):
+    thread_safe = True
+
+    def __init__(self, filename, process_func=None, dtype=None, as_grey=False,
+                 mmap=False, metadata=True):
         super(NorpixSeq, self).__init__()
+        self._with_metadata = metadata
         self._file = open(filename, 'rb')
         self._filename = filename
 
-        self.header_dict = self._read_header(HEADER_FIELDS)
+        self.header_dict = read_fields(self._file, HEADER_FIELDS)
 
-        if self.header_dict['magic'] != 0xFEED:
-            raise IOError('The format of this .seq file is unrecognized')
-        if self.header_dict['image_format'] != 100:
-            raise IOError('Only uncompressed mono images are supported in .seq files')
+        self._check_header(self.header_dict)
 
         # File-level metadata
         if self.header_dict['version'] >= 5:  # StreamPix version 6
@@ -119,30 +142,43 @@ class NorpixSeq(FramesSequence):
         if dtype is None:
             self._dtype = self._dtype_native
         else:
-            self._dtype = dtype
+            self._dtype = np.dtype(dtype)
 
         self._validate_process_func(process_func)
 
+        # Frames are read at absolute offsets, so that several threads can
+        # read at once.
         self._file_lock = Lock()
+        self._reader = PositionalFile(self._file, self._file_lock)
+        self._records = None
+        if mmap:
+            self._records = self._map_records()
+
+    @staticmethod
+    def _check_header(header):
+        """Raise IOError if the file cannot be read by this reader."""
+        if header['magic'] != 0xFEED:
+            raise IOError('The format of this .seq file is unrecognized')
+        if header['image_format'] != 100:
+            raise IOError('Only uncompressed mono images are supported in .seq files')
 
-    def _read_header(self, fields, offset=0):
-        self._file.seek(offset)
-        tmp = dict()
-        for name, format in fields:
-            val = self._unpack(format)
-            tmp[name] = val
-
-        return tmp
-
-    def _unpack(self, fs, offset=None):
-        if offset is not None:
-            self._file.seek(offset)
-        s = struct.Struct('<' + fs)
-        vals = s.unpack(self._file.read(s.size))
-        if len(vals) == 1:
-            return vals[0]
-        else:
-            return vals
+    def _map_records(self):
+        """Map the image records as a structured array, with fields
+        'image', 'sec', 'ms' and (for StreamPix 6) 'us'."""
+        image_dtype = self._dtype_native.newbyteorder('<')
+        names = ['image', 'sec', 'ms']
+        formats = [(image_dtype, (self._height, self._width)), '<u4', '<u2']
+        offsets = [0, self._image_bytes, self._image_bytes + 4]
+        if self._timestamp_micro:
+            names.append('us')
+            formats.append('<u2')
+            offsets.append(self._image_bytes + 6)
+        record_dtype = np.dtype(dict(names=names, formats=formats,
+                                     offsets=offsets,
+                                     itemsize=self._image_block_size))
+        return np.memmap(self._filename, dtype=record_dtype, mode='r',
+                         offset=self._image_offset,
+                         shape=(self._image_count, ))
 
     def _verify_frame_no(self, i):
         if int(i) != i:
@@ -150,39 +186,83 @@ class NorpixSeq(FramesSequence):
         if i >= self._image_count or i < 0:
             raise ValueError("Frame number is out of range: " + str(i))
 
-    def get_frame(self, i):
+    def get_frame(self, i, out=None):
         self._verify_frame_no(i)
-        with FileLocker(self._file_lock):
-            self._file.seek(self._image_offset + self._image_block_size * i)
-            imdata = np.fromfile(self._file, self._dtype_native, self._pixel_count
-                                 ).reshape((self.height, self.width))
-            # Timestamp immediately follows
-            tfloat, ts = self._read_timestamp()
-            md = {'time': ts, 'time_float': tfloat,
-                  'gamut': self.metadata['gamut']}
-            return Frame(self.process_func(imdata.astype(self._dtype)),
-                         frame_no=i, metadata=md)
-
-    def _read_timestamp(self):
-        """Read a timestamp at the current position in the file.
+        if self._records is not None:
+            imdata = np.asarray(self._records['image'][i])
+        else:
+            imdata = self._raw_buffer((self.height, self.width),
+                                      self._dtype_native, out)
+            offset = self._image_offset + self._image_block_size * i
+            self._reader.readinto(imdata, offset)
+        return Frame(self._process_frame(imdata, out),
+                     frame_no=i, metadata=self._frame_metadata(i))
+
+    def _frame_metadata(self, i):
+        """Return the metadata of frame i, read when it is used."""
+        if not self._with_metadata:
+            return None
+        def time():
+            return datetime.datetime.fromtimestamp(metadata['time_float'])
+        metadata = LazyMetadata({'gamut': self.metadata['gamut']},
+                                {'time_float': lambda: self._get_time(i)[0],
+                                 'time': time})
+        return metadata
+
+    def get_frames(self, indices=None, out=None):
+        """Read several frames into a single array, reading each run of
+        consecutive frames with one read. See FramesSequence.get_frames."""
+        indices = _normalize_indices(indices, len(self))
+        if self._records is not None:
+            return self._process_block(self._records['image'][indices], out)
+        block = self._raw_buffer((len(indices), self._height, self._width),
+                                 self._dtype_native, out)
+        # bound the size of a single read (and of the read buffer)
+        per_read = max(1, int(RUN_READ_SIZE // self._image_block_size))
+        buf = None
+        for start, stop in _index_runs(indices):
+            for n in range(start, stop, per_read):
+                count = min(per_read, stop - n)
+                if buf is None:
+                    buf = np.empty(self._image_block_size *
+                                   min(per_read, len(indices)), np.uint8)
+                self._reader.readinto(
+                    buf[:self._image_block_size * count],
+                    self._image_offset + self._image_block_size * indices[n])
+                # Skip the timestamp and padding that follow every image.
+                block[n:n + count] = np.ndarray(
+                    (count, self._height, self._width), self._dtype_native,
+                    buf, strides=(self._image_block_size,
+                                  self._width * self._dtype_native.itemsize,
+                                  self._dtype_native.itemsize))
+        return self._process_block(block, out)
+
+    def _read_timestamp(self, offset):
+        """Read a timestamp at the given offset in the file.
 
         Returns a floating-point representation in seconds, and a datetime instance.
         """
-        if self._timestamp_micro:
-            tsecs, tms, tus = self._timestamp_struct.unpack(self._file.read(8))
-            tfloat = tsecs + float(tms) / 1000. + float(tus) / 1.0e6
-        else:
-            tsecs, tms = self._timestamp_struct.unpack(self._file.read(6))
-            tfloat = tsecs + float(tms) / 1000.
+        tfloat = self._read_time_float(offset)
         return tfloat, datetime.datetime.fromtimestamp(tfloat)
 
+    def _read_time_float(self, offset):
+        """Read a timestamp at the given offset in the file, in seconds."""
+        data = self._reader.read(self._timestamp_struct.size, offset)
+        if self._timestamp_micro:
+            tsecs, tms, tus = self._timestamp_struct.unpack(data)
+            return tsecs + float(tms) / 1000. + float(tus) / 1.0e6
+        tsecs, tms = self._timestamp_struct.unpack(data)
+        return tsecs + float(tms) / 1000.
+
     def _get_time(self, i):
         """Call _read_timestamp() for a given frame."""
         self._verify_frame_no(i)
-        with FileLocker(self._file_lock):
-            self._file.seek(self._image_offset + self._image_block_size * i
-                            + self._image_bytes)
-            return self._read_timestamp()
+        if self._records is not None:
+            tfloat = float(self._times_float(self._records[i]))
+            return tfloat, datetime.datetime.fromtimestamp(tfloat)
+        return self._read_timestamp(self._image_offset +
+                                    self._image_block_size * i +
+                                    self._image_bytes)
 
     @index_attr
     def get_time(self, i):
@@ -201,7 +281,23 @@ class NorpixSeq(FramesSequence):
 
     def dump_times_float(self):
         """Return all frame times in file, as an array of floating-point numbers."""
-        return np.array([self._get_time(i)[0] for i in range(len(self))])
+        records = self._records
+        if records is None:
+            records = self._map_records()
+        return self._times_float(records)
+
+    def frame_metadata_table(self):
+        """Return the metadata of all frames at once, as a dict of arrays
+        with keys 'frame_no' and 'time_float'."""
+        return {'frame_no': np.arange(len(self)),
+                'time_float': self.dump_times_float()}
+
+    def _times_float(self, records):
+        """Compute floating-point times from one or more mapped records."""
+        times = records['sec'] + records['ms'] / 1000.
+        if self._timestamp_micro:
+            times = times + records['us'] / 1.0e6
+        return np.asarray(times)
 
     @property
     def filename(self):
@@ -232,6 +328,7 @@ class NorpixSeq(FramesSequence):
 
     def close(self):
         self._file.close()
+        self._records = None
 
     def __repr__(self):
         return """<Frames>
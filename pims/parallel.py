@@ -0,0 +1,203 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+import multiprocessing
+import uuid
+
+import numpy as np
+from slicerator import Slicerator
+
+from pims.base_frames import FramesSequenceND
+from pims.cache import CachedFrames
+from pims.frame import Frame
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None  # Python < 3.8: results are pickled instead
+
+
+def map_frames(func, frames, processes=None, ordered=True,
+               return_frames=False, chunksize=1):
+    """Apply a function to every frame, using a pool of processes.
+
+    Each worker process opens its own copy of the reader and reads its
+    frames locally, so frames are never sent to the workers. Arrays that are
+    sent back are passed through shared memory instead of being pickled.
+
+    Parameters
+    ----------
+    func : callable
+        Called as `func(frame)` for every frame, in a worker process.
+    frames : FramesSequence or sliced view
+        The frames to process. The reader is reopened in every worker with
+        the arguments it was created with, so it must be backed by a file.
+    processes : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    ordered : boolean, optional
+        If True (default), results are yielded in the order of the frames.
+        If False, `(i, result)` pairs are yielded as soon as they are ready,
+        where `i` is the position of the frame in `frames`.
+    return_frames : boolean, optional
+        If True, yield `(frame, result)` instead of `result`. False by
+        default.
+    chunksize : int, optional
+        Number of frames handed to a worker at once. Default 1.
+
+    Returns
+    -------
+    generator of results
+
+    Notes
+    -----
+    On platforms that do not fork (Windows, and macOS on Python 3.8+), `func`
+    and the reader arguments must be picklable. When iteration stops early,
+    or a worker raises, the workers are terminated and results that were
+    still underway are discarded, along with their shared memory.
+
+    Examples
+    --------
+    >>> def mean_intensity(frame):
+    ...     return frame.mean()
+    >>> video = pims.open('video.cine')
+    >>> means = list(pims.map_frames(mean_intensity, video[::10]))
+    """
+    spec, indices = _reader_spec(frames)
+    if shared_memory is not None:
+        # Shared memory blocks are created by the workers and freed here.
+        # Start the tracker first, so that all processes share it and it
+        # does not report the blocks as leaked.
+        resource_tracker.ensure_running()
+    # Blocks are named after this call and the position of their frame, so
+    # that the blocks of results that are never received can be freed.
+    prefix = 'pims' + uuid.uuid4().hex[:12]
+    received = set()
+    pool = multiprocessing.Pool(processes, _init_worker,
+                                (spec, func, return_frames, prefix))
+    try:
+        imap = pool.imap if ordered else pool.imap_unordered
+        results = imap(_map_task, enumerate(indices), chunksize)
+        for i, frame, result in results:
+            result = _unpack(result)
+            if return_frames:
+                result = (_unpack(frame), result)
+            received.add(i)
+            if ordered:
+                yield result
+            else:
+                yield i, result
+    finally:
+        pool.terminate()
+        pool.join()
+        if shared_memory is not None:
+            for i in range(len(indices)):
+                if i not in received:
+                    _free(_block_name(prefix, i, 'f'))
+                    _free(_block_name(prefix, i, 'r'))
+
+
+def _reader_spec(frames):
+    """Describe how to reopen `frames` in another process.
+
+    Returns the spec and the list of frame numbers in the reader."""
+    if isinstance(frames, Slicerator):
+        reader = frames._ancestor
+        indices = list(frames.indices)
+    else:
+        reader = frames
+        indices = list(range(len(frames)))
+    if isinstance(reader, CachedFrames):
+        reader = reader._reader
+    try:
+        args, kwargs = reader._init_args
+    except AttributeError:
+        raise ValueError("Only pims readers can be used with map_frames.")
+    if isinstance(reader, FramesSequenceND):
+        nd_state = dict(iter_axes=reader.iter_axes,
+                        bundle_axes=reader.bundle_axes,
+                        default_coords=dict(reader.default_coords))
+    else:
+        nd_state = None
+    return (type(reader), args, kwargs, nd_state), indices
+
+
+_worker_state = {}
+
+
+def _init_worker(spec, func, return_frames, prefix):
+    cls, args, kwargs, nd_state = spec
+    reader = cls(*args, **kwargs)
+    if nd_state is not None:
+        reader.bundle_axes = nd_state['bundle_axes']
+        reader.iter_axes = nd_state['iter_axes']
+        reader.default_coords.update(nd_state['default_coords'])
+    _worker_state.update(reader=reader, func=func,
+                         return_frames=return_frames, prefix=prefix)
+
+
+def _map_task(task):
+    i, frame_no = task
+    frame = _worker_state['reader'][frame_no]
+    result = _worker_state['func'](frame)
+    if not _worker_state['return_frames']:
+        frame = None
+    prefix = _worker_state['prefix']
+    return (i, _pack(frame, _block_name(prefix, i, 'f')),
+            _pack(result, _block_name(prefix, i, 'r')))
+
+
+def _block_name(prefix, i, kind):
+    """Name of the shared memory block of the frame ('f') or result ('r')
+    at position i."""
+    return '{0}_{1}{2}'.format(prefix, i, kind)
+
+
+_SharedArray = namedtuple('_SharedArray',
+                          'name shape dtype is_frame frame_no metadata')
+
+
+def _pack(value, name):
+    """Move an array into a new shared memory block with the given name,
+    if possible."""
+    if (shared_memory is None or not isinstance(value, np.ndarray) or
+            value.nbytes == 0 or value.dtype.hasobject):
+        return value
+    shm = shared_memory.SharedMemory(name, create=True, size=value.nbytes)
+    try:
+        view = np.ndarray(value.shape, value.dtype, buffer=shm.buf)
+        view[...] = value
+        del view
+    finally:
+        shm.close()
+    is_frame = isinstance(value, Frame)
+    return _SharedArray(shm.name, value.shape, value.dtype, is_frame,
+                        getattr(value, 'frame_no', None),
+                        getattr(value, 'metadata', None))
+
+
+def _unpack(value):
+    """Copy an array out of its shared memory block and free the block."""
+    if not isinstance(value, _SharedArray):
+        return value
+    shm = shared_memory.SharedMemory(name=value.name)
+    try:
+        view = np.ndarray(value.shape, value.dtype, buffer=shm.buf)
+        arr = view.copy()
+        del view
+    finally:
+        shm.close()
+        shm.unlink()
+    if value.is_frame:
+        arr = Frame(arr, frame_no=value.frame_no, metadata=value.metadata)
+    return arr
+
+
+def _free(name):
+    """Free a shared memory block by name, if it exists."""
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,135 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import sys
+import threading
+
+import six
+from six.moves import range
+from slicerator import Slicerator
+
+
+def prefetch(frames, depth=8, workers=2):
+    """Iterate over frames while reading the next ones in the background.
+
+    Frames are read ahead by a pool of threads and yielded in order, so that
+    reading and decoding overlap with the work done on each frame. At most
+    `depth` frames are held in memory at any time.
+
+    Parameters
+    ----------
+    frames : FramesSequence or sliced view
+        Anything that supports `len` and integer indexing, such as a reader,
+        a slice of a reader or an ND reader.
+    depth : int, optional
+        Maximum number of frames that are read ahead. Default 8.
+    workers : int, optional
+        Number of reading threads. Default 2. Readers that do not declare
+        themselves `thread_safe` (e.g. video readers, which keep a decoder
+        state) are always read by a single thread.
+
+    Notes
+    -----
+    Errors raised while reading a frame are raised by the iterator when that
+    frame is due. When iteration stops early, the background threads are
+    stopped as soon as the iterator is closed or garbage collected.
+
+    Examples
+    --------
+    >>> video = pims.open('video.avi')
+    >>> for frame in pims.prefetch(video[100:200]):
+    ...     # Do something with every frame.
+    """
+    if depth < 1:
+        raise ValueError("depth must be at least 1")
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if not _thread_safe(frames):
+        workers = 1
+    return _prefetched(_Prefetcher(frames, depth, min(workers, depth)))
+
+
+def _prefetched(prefetcher):
+    """Start the prefetcher and yield its frames, stopping its threads when
+    the iteration ends."""
+    prefetcher.start()
+    try:
+        for frame in prefetcher:
+            yield frame
+    finally:
+        prefetcher.stop()
+
+
+def _thread_safe(frames):
+    """Whether get_frame of the reader behind `frames` may be called from
+    several threads at once."""
+    while isinstance(frames, Slicerator):
+        frames = frames._ancestor
+    return getattr(frames, 'thread_safe', False)
+
+
+class _Prefetcher(object):
+    """Read frames ahead on worker threads and hand them out in order."""
+    def __init__(self, frames, depth, workers):
+        self._frames = frames
+        self._len = len(frames)
+        self._depth = depth
+        self._cond = threading.Condition()
+        self._results = {}
+        self._next_task = 0
+        self._next_out = 0
+        self._stopped = False
+        self._workers = workers
+        self._threads = []
+
+    def start(self):
+        for _ in range(self._workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _claim(self):
+        """Return the next frame number to read, or None to quit."""
+        with self._cond:
+            while (not self._stopped and self._next_task < self._len and
+                   self._next_task >= self._next_out + self._depth):
+                self._cond.wait()
+            if self._stopped or self._next_task >= self._len:
+                return None
+            i = self._next_task
+            self._next_task += 1
+            return i
+
+    def _work(self):
+        while True:
+            i = self._claim()
+            if i is None:
+                return
+            try:
+                result = (True, self._frames[i])
+            except Exception:
+                result = (False, sys.exc_info())
+            with self._cond:
+                self._results[i] = result
+                self._cond.notify_all()
+
+    def __iter__(self):
+        while self._next_out < self._len:
+            with self._cond:
+                while self._next_out not in self._results:
+                    self._cond.wait()
+                success, value = self._results.pop(self._next_out)
+                self._next_out += 1
+                self._cond.notify_all()
+            if not success:
+                six.reraise(*value)
+            yield value
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._results.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
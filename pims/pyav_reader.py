@@ -2,12 +2,19 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import six
+from six.moves import range, zip
+import os
 import re
 
 import numpy as np
 
-from pims.base_frames import FramesSequence
+from pims.base_frames import FramesSequence, ProbeInfo
 from pims.frame import Frame
+from pims.utils.index_cache import load_index, save_index
+from pims.utils.misc import reduced_size
+
+# Increment when the format of the index (see _initialize) changes.
+_INDEX_VERSION = 1
 
 
 try:
@@ -17,13 +24,7 @@ except ImportError:
 
 
 def available():
-    try:
-        import av
-        from PIL import Image
-    except ImportError:
-        return False
-    else:
-        return True
+    return av is not None
 
 
 class PyAVVideoReader(FramesSequence):
@@ -40,7 +41,18 @@ class PyAVVideoReader(FramesSequence):
         Image arrays will be converted to this datatype.
     as_grey : boolean, optional
         Convert color images to greyscale. False by default.
-        May not be used in conjection with process_func.
+        May not be used in conjection with process_func. The conversion is
+        done by the decoder's pixel format conversion.
+    crop : tuple of int, optional
+        (x, y, width, height) of a rectangle, in pixels, to crop the frames
+        to.
+    downscale : int, optional
+        Reduce the (cropped) frames by this factor, averaging blocks of
+        pixels. Default 1.
+    threads : int, optional
+        Number of threads used by the codec to decode a frame (slice
+        threading) or several frames at once (frame threading). By default,
+        the codec chooses.
 
     Examples
     --------
@@ -66,8 +78,38 @@ class PyAVVideoReader(FramesSequence):
         return {'mov', 'avi',
                 'mp4'} | super(PyAVVideoReader, cls).class_exts()
 
+    @classmethod
+    def probe(cls, filename):
+        """Read the length, frame shape and frame rate from the container
+        headers, without demuxing the packets. The length is exact if the
+        table of contents is cached, and may otherwise be an estimate from
+        the duration. See FramesSequence.probe."""
+        filename = str(filename)
+        container = av.open(filename)
+        try:
+            stream = cls._video_stream(container)
+            frame_rate = stream.average_rate
+            frame_rate = float(frame_rate) if frame_rate else None
+            index = load_index(filename, 'PyAVVideoReader', _INDEX_VERSION)
+            if index is not None:
+                length = len(index['toc'])
+            elif stream.frames:
+                length = stream.frames
+            elif stream.duration is not None and frame_rate:
+                length = int(round(float(stream.duration * stream.time_base)
+                                   * frame_rate))
+            else:
+                raise IOError("The container of {0} does not report the "
+                              "number of frames".format(filename))
+            shape = (stream.height, stream.width, 3)
+        finally:
+            container.close()
+        return ProbeInfo(filename, cls.__name__, length, shape,
+                         np.dtype(np.uint8), frame_rate,
+                         os.path.getsize(filename))
+
     def __init__(self, filename, process_func=None, dtype=None,
-                 as_grey=False):
+                 as_grey=False, crop=None, downscale=1, threads=None):
 
         if dtype is not None:
             self._dtype = dtype
@@ -76,34 +118,101 @@ class PyAVVideoReader(FramesSequence):
             self._dtype = np.uint8
 
         self.filename = str(filename)
-        self._initialize()
+        self._grey = as_grey
+        self._threads = threads
+        self._initialize(crop, downscale)
 
         self._validate_process_func(process_func)
         self._as_grey(as_grey, process_func)
 
-    def _initialize(self):
+    def _initialize(self, crop, downscale):
         "Scan through and tabulate contents to enable random access."
         container = av.open(self.filename)
- 
-        # Build a toc 
-        self._toc = np.cumsum([len(packet.decode())
-                               for packet in container.demux()])
-        self._len = self._toc[-1]
-
-        video_stream = [s for s in container.streams
-                        if isinstance(s, av.video.VideoStream)][0]
-        # PyAV always returns frames in color, and we make that
-        # assumption in get_frame() later below, so 3 is hardcoded here:
-        self._im_sz = video_stream.width, video_stream.height, 3
-
-        del container  # The generator is empty. Reload the file.
+        video_stream = self._video_stream(container)
+
+        index = load_index(self.filename, 'PyAVVideoReader', _INDEX_VERSION)
+        if index is None:
+            index = self._build_index(container, video_stream)
+            save_index(self.filename, 'PyAVVideoReader', _INDEX_VERSION,
+                       index)
+        self._toc = index['toc']
+        self._keyframes = index['keyframes']
+        self._len = len(self._toc)
+
+        # The frames are cropped, downscaled and converted to RGB or grey by
+        # a filter graph, with the same filters as FFmpegVideoReader.
+        crop, size = reduced_size(video_stream.width, video_stream.height,
+                                  crop, downscale)
+        self._format = 'gray' if self._grey else 'rgb24'
+        self._graph = self._filter_graph(video_stream, crop, size,
+                                         self._format)
+        if self._grey:
+            self._im_sz = size
+        else:
+            self._im_sz = size + (3, )
+
+        container.close()
         self._load_fresh_file()
 
+    @staticmethod
+    def _build_index(container, video_stream):
+        """Build a toc from the packets only, without decoding them."""
+        # Every packet holds one frame, and frames are shown in the order of
+        # their presentation time stamps (pts).
+        timestamps = []
+        keyframes = []
+        for packet in container.demux(video_stream):
+            pts = packet.pts if packet.pts is not None else packet.dts
+            if pts is None:
+                continue  # an empty packet that flushes the decoder
+            timestamps.append(pts)
+            if packet.is_keyframe:
+                keyframes.append(pts)
+        return dict(toc=np.sort(np.array(timestamps, dtype=np.int64)),
+                    keyframes=np.unique(np.array(keyframes, dtype=np.int64)))
+
+    @staticmethod
+    def _filter_graph(video_stream, crop, size, pix_fmt):
+        """Return an av.filter.Graph that crops the frames of the stream
+        to `crop`, scales them to `size` and converts them to `pix_fmt`, or
+        None if the frames need no cropping or scaling."""
+        filters = []
+        if crop != (0, 0, video_stream.width, video_stream.height):
+            filters.append(('crop',
+                            'w={2}:h={3}:x={0}:y={1}:exact=1'.format(*crop)))
+        if size != tuple(crop[2:]):
+            filters.append(('scale', '{0}:{1}:flags=area'.format(*size)))
+        if not filters:
+            return None
+        filters.append(('format', pix_fmt))
+        graph = av.filter.Graph()
+        nodes = [graph.add_buffer(template=video_stream)]
+        nodes += [graph.add(name, args) for name, args in filters]
+        nodes.append(graph.add('buffersink'))
+        for node, next_node in zip(nodes[:-1], nodes[1:]):
+            node.link_to(next_node)
+        graph.configure()
+        return graph
+
+    @staticmethod
+    def _video_stream(container):
+        return [s for s in container.streams
+                if isinstance(s, av.video.VideoStream)][0]
+
+    def _open(self):
+        """Open the file for decoding and return the container and the
+        video stream."""
+        container = av.open(self.filename)
+        stream = self._video_stream(container)
+        stream.thread_type = 'AUTO'
+        if self._threads is not None:
+            stream.thread_count = self._threads
+        return container, stream
+
     def _load_fresh_file(self):
-        self._demuxed_container = av.open(self.filename).demux()
-        self._current_packet = next(self._demuxed_container).decode()
-        self._packet_cursor = 0
-        self._frame_cursor = 0
+        self._container, self._stream = self._open()
+        self._decoder = None  # generator of decoded frames
+        self._last_pts = None  # pts of the last frame taken from _decoder
 
     def __len__(self):
         return self._len
@@ -113,34 +222,62 @@ class PyAVVideoReader(FramesSequence):
         return self._im_sz
 
     def get_frame(self, j):
-        # Find the packet this frame is in.
-        packet_no = self._toc.searchsorted(j, side='right')
-        self._seek_packet(packet_no)
-        # Find the location of the frame within the packet.
-        if packet_no == 0:
-            loc = j
+        pts = self._toc[j]
+        if (self._last_pts is None or pts <= self._last_pts or
+                self._keyframe_before(pts) > self._last_pts):
+            # Going backwards, or there is a keyframe between the current
+            # position and the frame: seek instead of decoding forward.
+            self._seek(pts)
+        for frame in self._decoder:  # av.VideoFrame
+            self._last_pts = frame.pts
+            if frame.pts >= pts:
+                break
         else:
-            loc = j - self._toc[packet_no - 1]
-        frame = self._current_packet[loc]  # av.VideoFrame
-        if frame.index != j:
+            frame = None
+        if frame is None or frame.pts != pts:
             raise AssertionError("Seeking failed to obtain the correct frame.")
-        result = np.asarray(frame.to_rgb().to_image())
-        return Frame(self.process_func(result).astype(self._dtype), frame_no=j)
-
-    def _seek_packet(self, packet_no):
-        """Advance through the container generator until we get the packet
-        we want. Store that packet in self._current_packet."""
-        if packet_no == self._packet_cursor:
-            # We have the right packet and it is already decoded.
-            return 
-        if packet_no < self._packet_cursor:
-            # "Rewind." This is not really possible, so we load a fresh
-            # instance of the file object and then fast-forward.
-            self._load_fresh_file()
-        # Fast-forward if needed.
-        while self._packet_cursor < packet_no:
-            self._current_packet = next(self._demuxed_container).decode()
-            self._packet_cursor += 1
+        return self._to_frame(frame, j)
+
+    def __iter__(self):
+        """Decode all frames in order. This does not use the table of
+        contents and never seeks, so it is the fastest way to read a
+        video from start to end."""
+        container, stream = self._open()
+        try:
+            frames = container.decode(stream)
+            for j, frame in zip(range(self._len), frames):
+                yield self._to_frame(frame, j)
+        finally:
+            container.close()
+
+    def _to_frame(self, frame, j):
+        """Convert an av.VideoFrame straight to a numpy array."""
+        if self._graph is not None:
+            self._graph.push(frame)
+            frame = self._graph.pull()
+        result = frame.to_ndarray(format=self._format)
+        result = self.process_func(result)
+        if result.dtype != self._dtype:
+            result = result.astype(self._dtype)
+        return Frame(result, frame_no=j)
+
+    def _keyframe_before(self, pts):
+        """Return the pts of the last keyframe at or before pts."""
+        i = self._keyframes.searchsorted(pts, side='right') - 1
+        if i < 0:
+            return self._toc[0]
+        return self._keyframes[i]
+
+    def _seek(self, pts):
+        """Seek to the keyframe that precedes the frame with the given pts,
+        so that decoding forward from there produces that frame."""
+        self._container.seek(int(self._keyframe_before(pts)), backward=True,
+                             any_frame=False, stream=self._stream)
+        self._decoder = self._container.decode(self._stream)
+        self._last_pts = None
+
+    def close(self):
+        self._container.close()
 
     @property
     def pixel_type(self):
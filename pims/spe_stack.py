@@ -4,7 +4,11 @@ from __future__ import absolute_import
 import numpy as np
 
 from .frame import Frame
-from .base_frames import FramesSequence
+import os
+
+from .base_frames import (FramesSequence, ProbeInfo, _normalize_indices,
+                          _index_runs)
+from .utils.misc import PositionalFile
 
 
 class Spec(object):
@@ -110,6 +114,16 @@ class Spec(object):
     #as byte arrays
     no_decode = ["spare4"]
 
+    @classmethod
+    def read_essential(cls, header):
+        """Read the datatype, xdim, ydim and NumFrames values from the
+        bytes of a header into a dict."""
+        values = {}
+        for name in ("datatype", "xdim", "ydim", "NumFrames"):
+            offset, dtype = cls.metadata[name][:2]
+            values[name] = np.frombuffer(header, dtype, 1, offset).item()
+        return values
+
 
 class SpeStack(FramesSequence):
     """Read image data from SPE files
@@ -126,13 +140,28 @@ class SpeStack(FramesSequence):
         Contains additional metadata.
     """
     default_char_encoding = "latin1"
+    thread_safe = True
 
     @classmethod
     def class_exts(cls):
         return {"spe"} | super(SpeStack, cls).class_exts()
 
+    @classmethod
+    def probe(cls, filename):
+        """Read the length, frame shape and dtype from the header of the
+        file only. See FramesSequence.probe."""
+        with open(filename, "rb") as f:
+            header = f.read(Spec.data_start)
+        if len(header) < Spec.data_start:
+            raise IOError("{} is too short for an SPE file".format(filename))
+        values = Spec.read_essential(header)
+        return ProbeInfo(filename, cls.__name__, values["NumFrames"],
+                         (values["ydim"], values["xdim"]),
+                         Spec.dtypes[values["datatype"]], None,
+                         os.path.getsize(filename))
+
     def __init__(self, filename, process_func=None, dtype=None,
-                 as_grey=False, char_encoding=None):
+                 as_grey=False, char_encoding=None, mmap=False):
         """Create an iterable object that returns image data as numpy arrays
 
         Arguments
@@ -152,9 +181,16 @@ class SpeStack(FramesSequence):
             Specifies what character encoding is used to decode metatdata
             strings. If None, use the `default_char_encoding` class attribute.
             Defaults to None.
+        mmap : bool, optional
+            Memory-map the image data. Frames and slices of consecutive
+            frames are then read-only views into the file, unless a dtype
+            conversion or process_func is requested. Defaults to False.
         """
         self._filename = filename
         self._file = open(filename, "rb")
+        #Frames are read at absolute offsets, so that several threads can
+        #read at once
+        self._reader = PositionalFile(self._file)
         self._char_encoding = (char_encoding if char_encoding is not None
                                else self.default_char_encoding)
 
@@ -176,7 +212,7 @@ class SpeStack(FramesSequence):
             if cnt == 1:
                 #for convenience, if the array contains only one single entry,
                 #return this entry itself.
-                v = np.asscalar(v)
+                v = v.item()
             self.metadata[name] = v
 
         ### Some metadata is "special", deal with it
@@ -231,6 +267,14 @@ class SpeStack(FramesSequence):
         self._validate_process_func(process_func)
         self._as_grey(as_grey, process_func)
 
+        #The image data is one contiguous block at the end of the file
+        self._data = None
+        if mmap:
+            self._data = np.memmap(filename, dtype=self._file_dtype, mode="r",
+                                   offset=Spec.data_start,
+                                   shape=(self._len, self._height,
+                                          self._width))
+
     @property
     def frame_shape(self):
         return self._width, self._height
@@ -238,23 +282,39 @@ class SpeStack(FramesSequence):
     def __len__(self):
         return self._len
 
-    def get_frame(self, j):
+    def get_frame(self, j, out=None):
         if j >= self._len:
             raise ValueError("Frame number {} out of range.".format(j))
-        self._file.seek(Spec.data_start
-                        + j*self._width*self._height*self._file_dtype.itemsize)
-        data = np.fromfile(self._file, dtype=self._file_dtype,
-                           count=self._width*self._height)
-        if self._dtype != self._file_dtype:
-            data = data.astype(self._dtype)
-        return Frame(
-            self.process_func(data.reshape(self._height, self._width)),
-            frame_no=j, metadata=self.metadata)
+        if self._data is not None:
+            return Frame(self._process_frame(np.asarray(self._data[j]), out),
+                         frame_no=j, metadata=self.metadata)
+        data = self._raw_buffer((self._height, self._width),
+                                self._file_dtype, out)
+        self._reader.readinto(data, Spec.data_start + j*self._width
+                              * self._height*self._file_dtype.itemsize)
+        return Frame(self._process_frame(data, out), frame_no=j,
+                     metadata=self.metadata)
+
+    def get_frames(self, indices=None, out=None):
+        """Read several frames into a single array, reading each run of
+        consecutive frames with one read. See FramesSequence.get_frames."""
+        indices = _normalize_indices(indices, len(self))
+        if self._data is not None:
+            return self._get_mapped_frames(self._data, indices, out)
+        pixel_count = self._width*self._height
+        block = self._raw_buffer((len(indices), self._height, self._width),
+                                 self._file_dtype, out)
+        for start, stop in _index_runs(indices):
+            self._reader.readinto(block[start:stop],
+                                  Spec.data_start + indices[start]
+                                  * pixel_count*self._file_dtype.itemsize)
+        return self._process_block(block, out)
 
     def close(self):
         """Clean up and close file"""
         super(SpeStack, self).close()
         self._file.close()
+        self._data = None
 
     @property
     def pixel_type(self):
@@ -0,0 +1,23 @@
+import os
+import shutil
+import tempfile
+
+_index_caches = []
+
+
+def use_temporary_index_cache():
+    """Point the index cache (see pims.utils.index_cache) at a temporary
+    directory, so that tests do not write to the cache of the user."""
+    tempdir = tempfile.mkdtemp()
+    _index_caches.append((os.environ.get('PIMS_CACHE_DIR'), tempdir))
+    os.environ['PIMS_CACHE_DIR'] = tempdir
+
+
+def restore_index_cache():
+    """Undo use_temporary_index_cache and remove the temporary directory."""
+    old, tempdir = _index_caches.pop()
+    if old is None:
+        del os.environ['PIMS_CACHE_DIR']
+    else:
+        os.environ['PIMS_CACHE_DIR'] = old
+    shutil.rmtree(tempdir, ignore_errors=True)
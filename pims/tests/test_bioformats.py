@@ -98,6 +98,15 @@ class _image_series(_image_single):
         self.v[-1]
         list(self.v[[0, -1]])
 
+    def test_frame_metadata_table(self):
+        self.check_skip()
+        v = self.klass(self.filename, meta=True)
+        table = v.frame_metadata_table()
+        for key in ['frame', 'z', 'c', 't'] + list(v.frame_metadata):
+            assert_equal(len(table[key]), len(table['frame']))
+        assert_equal(len(np.unique(table['frame'])), len(table['frame']))
+        v.close()
+
 
 class _image_stack(unittest.TestCase):
     def check_skip(self):
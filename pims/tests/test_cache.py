@@ -0,0 +1,114 @@
+import os
+import unittest
+import numpy as np
+from numpy.testing import assert_equal
+import pims
+from pims.base_frames import FramesSequence
+from pims.frame import Frame
+
+
+class CountingReader(FramesSequence):
+    """A reader of random frames that counts how often get_frame is called."""
+    propagate_attrs = ['frame_shape', 'pixel_type', 'greeting']
+
+    def __init__(self, count=10, shape=(4, 5)):
+        self._data = np.random.randint(0, 255, (count,) + shape)
+        self._data = self._data.astype(np.uint8)
+        self.calls = 0
+        self.greeting = 'hello'
+
+    def get_frame(self, i):
+        self.calls += 1
+        return Frame(self._data[i].copy(), frame_no=i)
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def frame_shape(self):
+        return self._data.shape[1:]
+
+    @property
+    def pixel_type(self):
+        return self._data.dtype
+
+
+class TestCachedFrames(unittest.TestCase):
+    def setUp(self):
+        self.reader = CountingReader()
+        self.frame_bytes = self.reader._data[0].nbytes
+        self.v = pims.CachedFrames(self.reader,
+                                   max_bytes=3 * self.frame_bytes)
+
+    def test_hits_misses(self):
+        assert_equal(self.v[0], self.reader._data[0])
+        assert_equal(self.v[0], self.reader._data[0])
+        assert_equal(self.v[1], self.reader._data[1])
+        assert_equal((self.v.hits, self.v.misses), (1, 2))
+        assert_equal(self.reader.calls, 2)
+        assert_equal(self.v.nbytes, 2 * self.frame_bytes)
+
+    def test_eviction_by_bytes(self):
+        for i in range(4):
+            self.v[i]
+        assert_equal(self.v.nbytes, 3 * self.frame_bytes)
+        self.v[1]  # still cached
+        self.v[0]  # was evicted
+        assert_equal((self.v.hits, self.v.misses), (1, 5))
+
+    def test_lru_order(self):
+        for i in [0, 1, 2, 0, 3]:
+            self.v[i]
+        # frame 1 was least recently used, so it got evicted instead of 0
+        self.v[0]
+        assert_equal(self.reader.calls, 4)
+        self.v[1]
+        assert_equal(self.reader.calls, 5)
+
+    def test_large_frames_not_cached(self):
+        v = pims.CachedFrames(self.reader, max_bytes=self.frame_bytes - 1)
+        v[0]
+        v[0]
+        assert_equal((v.hits, v.misses), (0, 2))
+        assert_equal(v.nbytes, 0)
+
+    def test_read_only(self):
+        frame = self.v[0]
+        self.assertRaises(ValueError, frame.__setitem__, (0, 0), 1)
+
+    def test_slicing(self):
+        sliced = self.v[2:8:2]
+        assert_equal(len(sliced), 3)
+        assert_equal(sliced[1], self.reader._data[4])
+        assert_equal(sliced.frame_shape, self.reader.frame_shape)
+        assert_equal(sliced.greeting, 'hello')
+        sliced[1]
+        assert_equal(self.v.hits, 1)
+        assert_equal(sliced.get_frames(), self.reader._data[2:8:2])
+
+    def test_attributes(self):
+        assert_equal(len(self.v), len(self.reader))
+        assert_equal(self.v.frame_shape, self.reader.frame_shape)
+        assert_equal(self.v.pixel_type, self.reader.pixel_type)
+        assert_equal(self.v.greeting, 'hello')
+
+    def test_clear_cache(self):
+        self.v[0]
+        self.v[0]
+        self.v.clear_cache()
+        assert_equal((self.v.hits, self.v.misses, self.v.nbytes), (0, 0, 0))
+        self.v[0]
+        assert_equal(self.reader.calls, 2)
+
+
+class TestOpenCache(unittest.TestCase):
+    def setUp(self):
+        path, _ = os.path.split(os.path.abspath(__file__))
+        self.filename = os.path.join(path, 'data', 'stuck.tif')
+
+    def test_open_cache(self):
+        v = pims.open(self.filename, cache=2**20)
+        assert isinstance(v, pims.CachedFrames)
+        assert_equal(v[1], v[1])
+        assert_equal((v.hits, v.misses), (1, 1))
+        v.close()
@@ -0,0 +1,346 @@
+# Tests for cine.py, using small synthetic files.
+
+import os
+import tempfile
+import threading
+import unittest
+import numpy as np
+from numpy.testing import assert_equal
+import pims
+from pims.cine import (MAX_INT, CFA_BAYER, _bilinear_demosaic, _ten2sixteen,
+                       _sixteen2ten, _twelve2sixteen, _sixteen2twelve)
+from pims.utils.synthetic import write_cine
+
+
+class _cine_sample_tests(object):
+    dtype = np.uint16
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.cine')
+        rs = np.random.RandomState(0)
+        self.frames = rs.randint(0, np.iinfo(self.dtype).max,
+                                 (7, 12, 10)).astype(self.dtype)
+        self.times, self.exposures = write_cine(self.filename, self.frames)
+        self.v = pims.Cine(self.filename)
+
+    def tearDown(self):
+        self.v.close()
+        os.remove(self.filename)
+        os.rmdir(self.tempdir)
+
+    def test_open(self):
+        v = pims.open(self.filename)
+        assert isinstance(v, pims.Cine)
+        v.close()
+
+    def test_len(self):
+        assert_equal(len(self.v), len(self.frames))
+
+    def test_get_frame(self):
+        for i in range(len(self.frames)):
+            fr = self.v[i]
+            assert_equal(fr, self.frames[i])
+            assert_equal(fr.dtype, self.dtype)
+            assert_equal(fr.frame_no, i)
+
+    def test_get_frame_out(self):
+        out = np.empty(self.frames.shape[1:], self.dtype)
+        for i in range(len(self.frames)):
+            fr = self.v.get_frame(i, out=out)
+            assert np.may_share_memory(fr, out)
+            assert_equal(out, self.frames[i])
+
+    def test_get_frames_out(self):
+        out = np.empty(self.frames.shape, np.float64)
+        result = self.v.get_frames(out=out)
+        assert result is out
+        assert_equal(out, self.frames)
+
+    def test_get_frames(self):
+        indices = [3, 4, 5, 0, 6, 6, 1]
+        assert_equal(self.v.get_frames(indices), self.frames[indices])
+        assert_equal(self.v.get_frames(), self.frames)
+        assert_equal(self.v[2:5].get_frames(), self.frames[2:5])
+
+    def test_threads(self):
+        # frames are read without a lock on a shared file position
+        results = {}
+
+        def read(i):
+            for _ in range(20):
+                results[i] = self.v.get_frame(i)
+
+        threads = [threading.Thread(target=read, args=(i, ))
+                   for i in range(len(self.frames))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i in range(len(self.frames)):
+            assert_equal(results[i], self.frames[i])
+
+    def test_metadata(self):
+        md = self.v[2].metadata
+        assert_equal(md['exposure'], self.v.all_exposures[2])
+        assert_equal(md['frame_time']['datetime'],
+                     self.v.frame_time_stamps[2][0])
+        v = pims.Cine(self.filename, metadata=False)
+        assert_equal(v[2].metadata, {})
+        v.close()
+
+    def test_lazy_tags(self):
+        v = pims.Cine(self.filename)
+        assert v._tags is None  # not read at open
+        assert_equal(v.image_locations.dtype, np.uint64)
+        v[1]
+        assert v._tags is None
+        assert_equal(v[1].metadata['exposure'], self.exposures[1] / MAX_INT)
+        assert v._tags is not None
+        # the lists are built once
+        assert v.tagged_blocks is v.tagged_blocks
+        assert v.frame_time_stamps is v.frame_time_stamps
+        v.close()
+
+    def test_missing_exposures(self):
+        write_cine(self.filename, self.frames, exposures=False)
+        v = pims.Cine(self.filename)
+        md = v[2].metadata
+        assert 'exposure' not in md
+        assert_equal(md['frame_time']['datetime'], v.frame_time_stamps[2][0])
+        assert v.all_exposures is None
+        v.close()
+
+    def test_frame_times(self):
+        times = self.v.frame_times
+        assert_equal(times.dtype, np.dtype('datetime64[ns]'))
+        expected = [np.datetime64(t >> 32, 's') +
+                    np.timedelta64((t & (MAX_INT - 1)) * 10**9 >> 32, 'ns')
+                    for t in self.times]
+        assert_equal(times, expected)
+        assert_equal(self.v.all_exposures.dtype, np.float64)
+        assert_equal([ts for ts, _ in self.v.frame_time_stamps],
+                     [ts for ts, _ in self.v.tagged_blocks['image_time_only']])
+
+    def test_frame_metadata_table(self):
+        table = self.v.frame_metadata_table()
+        assert_equal(table['frame_no'], np.arange(len(self.frames)))
+        times = [(t >> 32) + (t & (MAX_INT - 1)) / MAX_INT
+                 for t in self.times]
+        assert_equal(table['time_float'], times)
+        assert_equal(table['exposure'], np.array(self.exposures) / MAX_INT)
+        assert_equal(table['exposure'], self.v.all_exposures)
+
+    def test_mmap(self):
+        v = pims.Cine(self.filename, mmap=True)
+        for i in range(len(self.frames)):
+            fr = v[i]
+            assert_equal(fr, self.frames[i])
+            assert_equal(fr.frame_no, i)
+            assert not fr.flags.writeable
+            assert np.may_share_memory(fr, v._mmap)
+        assert_equal(v.get_frames([4, 2]), self.frames[[4, 2]])
+        out = np.empty(self.frames.shape[1:], self.dtype)
+        v.get_frame(3, out=out)
+        assert_equal(out, self.frames[3])
+        v.close()
+
+    def test_mmap_dtype(self):
+        v = pims.Cine(self.filename, dtype=np.float32, mmap=True)
+        fr = v[1]
+        assert_equal(fr.dtype, np.float32)
+        assert_equal(fr, self.frames[1])
+        v.close()
+
+
+class TestCine8bit(_cine_sample_tests, unittest.TestCase):
+    dtype = np.uint8
+
+
+class TestCine16bit(_cine_sample_tests, unittest.TestCase):
+    dtype = np.uint16
+
+
+def _pack_bits(frame, bits):
+    """Pack pixels big-endian, bit by bit."""
+    bitstring = ''.join(format(int(p), '0%db' % bits) for p in frame.ravel())
+    return bytes(bytearray(int(bitstring[i:i + 8], 2)
+                           for i in range(0, len(bitstring), 8)))
+
+
+class _cine_packed_tests(_cine_sample_tests):
+    bits = 12
+    shape = (7, 12, 10)
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.cine')
+        rs = np.random.RandomState(0)
+        self.frames = rs.randint(0, 2 ** self.bits,
+                                 self.shape).astype(np.uint16)
+        # packed images are stored top-down
+        image_data = [_pack_bits(f, self.bits) for f in self.frames]
+        self.times, self.exposures = write_cine(self.filename, self.frames,
+                                                image_data=image_data)
+        self.v = pims.Cine(self.filename)
+
+    def test_mmap(self):
+        self.assertRaises(ValueError, pims.Cine, self.filename, mmap=True)
+
+    def test_mmap_dtype(self):
+        self.assertRaises(ValueError, pims.Cine, self.filename,
+                          dtype=np.float32, mmap=True)
+
+    def test_pack(self):
+        pack = {10: _sixteen2ten, 12: _sixteen2twelve}[self.bits]
+        for frame in self.frames:
+            assert_equal(pack(frame).tobytes(), _pack_bits(frame, self.bits))
+
+
+class TestCine10bitPacked(_cine_packed_tests, unittest.TestCase):
+    bits = 10
+    shape = (7, 12, 10)  # rows do not start at whole groups of pixels
+
+
+class TestCine10bitPackedRows(_cine_packed_tests, unittest.TestCase):
+    bits = 10
+    shape = (7, 6, 8)
+
+
+class TestCine12bitPacked(_cine_packed_tests, unittest.TestCase):
+    bits = 12
+
+
+def test_unpack():
+    rs = np.random.RandomState(0)
+    for bits, unpack in [(10, _ten2sixteen), (12, _twelve2sixteen)]:
+        pixels = rs.randint(0, 2 ** bits, (3, 40)).astype(np.uint16)
+        packed = np.frombuffer(b''.join(_pack_bits(p, bits) for p in pixels),
+                               np.uint8).reshape(3, -1)
+        assert_equal(unpack(packed), pixels)
+        assert_equal(unpack(packed[1]), pixels[1])
+        # a strided batch, into a strided output
+        out = np.zeros((3, 80), np.uint16)
+        result = unpack(packed[::2], out[::2, ::2])
+        assert np.may_share_memory(result, out)
+        assert_equal(out[::2, ::2], pixels[::2])
+        assert_equal(out[1], 0)
+
+
+def _mosaic(rgb, pattern):
+    """Sample an RGB image with a Bayer pattern."""
+    mosaic = np.empty(rgb.shape[:-1], rgb.dtype)
+    for i, color in enumerate(pattern):
+        y, x = divmod(i, 2)
+        mosaic[..., y::2, x::2] = rgb[..., y::2, x::2, 'rgb'.index(color)]
+    return mosaic
+
+
+def _bilinear_reference(mosaic, pattern):
+    """Bilinear demosaic with the usual 3x3 kernels, in floating point."""
+    height, width = mosaic.shape
+    padded = np.pad(mosaic.astype(float), 1, mode='reflect')
+    result = np.zeros((height, width, 3))
+    kernels = {'g': [[0, 1, 0], [1, 4, 1], [0, 1, 0]],
+               'r': [[1, 2, 1], [2, 4, 2], [1, 2, 1]]}
+    for c, color in enumerate('rgb'):
+        mask = np.zeros((height + 2, width + 2))
+        for i, site in enumerate(pattern):
+            if site == color:
+                y, x = divmod(i, 2)
+                mask[1 + y::2, 1 + x::2] = 1
+        mask[0], mask[-1] = mask[2], mask[-3]
+        mask[:, 0], mask[:, -1] = mask[:, 2], mask[:, -3]
+        kernel = kernels.get(color, kernels['r'])
+        for dy in range(3):
+            for dx in range(3):
+                result[..., c] += kernel[dy][dx] / 4 * (
+                    padded * mask)[dy:dy + height, dx:dx + width]
+    return result
+
+
+class TestCineBayer(unittest.TestCase):
+    pattern = 'gbrg'  # CFA_BAYER
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.cine')
+        rs = np.random.RandomState(0)
+        self.rgb = rs.randint(0, 4096, (3, 8, 10, 3)).astype(np.uint16)
+        self.mosaic = _mosaic(self.rgb, self.pattern)
+        write_cine(self.filename, self.mosaic, compression=2, cfa=CFA_BAYER)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        os.rmdir(self.tempdir)
+
+    def test_raw(self):
+        v = pims.Cine(self.filename, demosaic='raw')
+        assert_equal(v.cfa_pattern, self.pattern)
+        assert_equal(v[1], self.mosaic[1])
+        assert_equal(v.get_frames(), self.mosaic)
+        v.close()
+
+    def test_raw_mmap(self):
+        v = pims.Cine(self.filename, demosaic='raw', mmap=True)
+        assert_equal(v.get_frames(), self.mosaic)
+        v.close()
+        self.assertRaises(ValueError, pims.Cine, self.filename, mmap=True)
+
+    def test_bilinear(self):
+        v = pims.Cine(self.filename)
+        fr = v[1]
+        assert_equal(fr.shape, (8, 10, 3))
+        assert_equal(fr.dtype, np.uint16)
+        expected = _bilinear_reference(self.mosaic[1], self.pattern)
+        assert np.all(np.abs(fr - expected) <= 0.5)
+        # the measured colors are kept
+        assert_equal(_mosaic(fr, self.pattern), self.mosaic[1])
+        assert_equal(v.get_frames([2, 0, 1]), [v[2], v[0], v[1]])
+        out = np.empty((3, 8, 10, 3), np.float32)
+        v.get_frames(out=out)
+        assert_equal(out[1], fr)
+        v.close()
+
+    def test_superpixel(self):
+        v = pims.Cine(self.filename, demosaic='superpixel')
+        fr = v[1]
+        assert_equal(fr.shape, (4, 5, 3))
+        assert_equal(v.frame_shape, (5, 4))
+        mosaic = self.mosaic[1].astype(int)
+        assert_equal(fr[..., 0], mosaic[1::2, ::2])
+        assert_equal(fr[..., 1], (mosaic[::2, ::2] + mosaic[1::2, 1::2] + 1)
+                     // 2)
+        assert_equal(fr[..., 2], mosaic[::2, 1::2])
+        assert_equal(v.get_frames()[1], fr)
+        v.close()
+
+    def test_cfa_pattern(self):
+        v = pims.Cine(self.filename, demosaic='superpixel', cfa_pattern='GRBG')
+        assert_equal(v.cfa_pattern, 'grbg')
+        assert_equal(v[1][..., 0], self.mosaic[1][::2, 1::2])
+        v.close()
+        self.assertRaises(ValueError, pims.Cine, self.filename,
+                          cfa_pattern='rgbg')
+        self.assertRaises(ValueError, pims.Cine, self.filename,
+                          demosaic='nearest')
+
+    def test_constant_color(self):
+        rgb = np.empty((1, 8, 10, 3), np.uint16)
+        rgb[:] = [100, 2000, 4000]
+        write_cine(self.filename, _mosaic(rgb, self.pattern), compression=2,
+                   cfa=CFA_BAYER)
+        for demosaic in ['bilinear', 'superpixel']:
+            v = pims.Cine(self.filename, demosaic=demosaic)
+            assert np.all(v[0] == [100, 2000, 4000])
+            v.close()
+
+
+def test_bilinear_demosaic_odd_shape():
+    rs = np.random.RandomState(0)
+    for pattern in ['rggb', 'bggr', 'grbg', 'gbrg']:
+        mosaic = rs.randint(0, 256, (7, 9)).astype(np.uint8)
+        out = np.empty((7, 9, 3), np.uint8)
+        _bilinear_demosaic(mosaic, pattern, out)
+        expected = _bilinear_reference(mosaic, pattern)
+        assert np.all(np.abs(out - expected) <= 0.5)
@@ -8,8 +8,10 @@ import tempfile
 import zipfile
 import sys
 import random
+import shutil
 import types
 import unittest
+import warnings
 import pickle
 from io import BytesIO
 import nose
@@ -17,17 +19,32 @@ import numpy as np
 from numpy.testing import (assert_equal, assert_allclose)
 from nose.tools import assert_true
 import pims
+from pims.tests import use_temporary_index_cache, restore_index_cache
 
 path, _ = os.path.split(os.path.abspath(__file__))
 path = os.path.join(path, 'data')
 
 
+def setup_module():
+    use_temporary_index_cache()
+
+
+def teardown_module():
+    restore_index_cache()
+
+
 def _skip_if_no_PyAV():
     import pims.pyav_reader
     if not pims.pyav_reader.available():
         raise nose.SkipTest('PyAV not found. Skipping.')
 
 
+def _skip_if_no_ffmpeg():
+    import pims.ffmpeg_reader
+    if not pims.ffmpeg_reader.available():
+        raise nose.SkipTest('ffmpeg not found. Skipping.')
+
+
 def _skip_if_no_libtiff():
     try:
         import libtiff
@@ -489,6 +506,23 @@ class _image_series(_image_single):
         self.v[-1]
         list(self.v[[0, -1]])
 
+    def test_get_frames(self):
+        self.check_skip()
+        frames = self.v.get_frames([1, 0, 1])
+        assert_equal(len(frames), 3)
+        assert_image_equal(frames[0], self.frame1)
+        assert_image_equal(frames[1], self.frame0)
+        assert_image_equal(frames[2], self.frame1)
+
+    def test_get_frames_of_slice(self):
+        self.check_skip()
+        frames = self.v[1::-1].get_frames()
+        assert_equal(len(frames), 2)
+        assert_image_equal(frames[0], self.frame1)
+        assert_image_equal(frames[1], self.frame0)
+        frames = self.v[:2][1:].get_frames([0])
+        assert_image_equal(frames[0], self.frame1)
+
 
 class _image_rgb(_image_single):
     # Only include these tests for 2D RGB files.
@@ -511,6 +545,26 @@ class _image_rgb(_image_single):
         self.assertEqual(ndim, 2)
 
 
+class _image_out(_image_single):
+    # Only include these tests for readers that can read into a buffer.
+    def test_get_frame_out(self):
+        self.check_skip()
+        out = np.empty_like(self.frame0, dtype=self.v.pixel_type)
+        frame = self.v.get_frame(1, out=out)
+        assert_image_equal(out, self.frame1)
+        self.assertTrue(np.may_share_memory(frame, out))
+        self.v.get_frame(0, out=out)
+        assert_image_equal(out, self.frame0)
+
+    def test_get_frames_out(self):
+        self.check_skip()
+        out = np.empty((2,) + self.frame0.shape, dtype=self.v.pixel_type)
+        result = self.v.get_frames([1, 0], out=out)
+        self.assertTrue(result is out)
+        assert_image_equal(out[0], self.frame1)
+        assert_image_equal(out[1], self.frame0)
+
+
 class TestVideo(_image_series, _image_rgb, unittest.TestCase):
     def check_skip(self):
         _skip_if_no_PyAV()
@@ -526,6 +580,113 @@ class TestVideo(_image_series, _image_rgb, unittest.TestCase):
         self.expected_shape = (640, 424, 3)
         self.expected_len = 480
 
+    def test_random_access(self):
+        # frames around keyframes, backwards and forwards
+        indices = [241, 236, 0, 479, 240, 3, 239, 242]
+        expected = dict((i, self.v[i]) for i in sorted(indices))
+        for i in indices:
+            assert_image_equal(self.v[i], expected[i])
+        assert_image_equal(self.v[1], self.frame1)
+
+    def test_grey(self):
+        v = self.klass(self.filename, as_grey=True)
+        assert_equal(v.frame_shape, (640, 424))
+        grey = v[0]
+        assert_equal(grey.shape, (424, 640))
+        self.assertEqual(grey.dtype, np.uint8)
+        expected = (self.frame0 * [0.2125, 0.7154, 0.0721]).sum(2)
+        self.assertTrue(np.abs(grey - expected).mean() < 5)
+
+    def test_crop(self):
+        v = self.klass(self.filename, crop=(10, 20, 100, 50))
+        assert_equal(v.frame_shape, (100, 50, 3))
+        assert_equal(v[1], self.frame1[20:70, 10:110])
+
+    def test_downscale(self):
+        v = self.klass(self.filename, downscale=2)
+        assert_equal(v.frame_shape, (320, 212, 3))
+        assert_equal(v[0].shape, (212, 320, 3))
+        v = self.klass(self.filename, crop=(10, 20, 100, 50), downscale=4)
+        assert_equal(v[0].shape, (12, 25, 3))
+        self.assertRaises(ValueError, self.klass, self.filename,
+                          crop=(600, 0, 100, 10))
+
+    def test_iter(self):
+        v = self.klass(self.filename, threads=2)
+        frames = list(v)
+        assert_equal(len(frames), self.expected_len)
+        for i in [0, 1, 240, 479]:
+            assert_equal(frames[i].frame_no, i)
+            assert_equal(frames[i], self.v[i])
+
+
+class TestFFmpegVideo(unittest.TestCase):
+    def setUp(self):
+        _skip_if_no_ffmpeg()
+        from pims.ffmpeg_reader import FFmpegVideoReader
+        self.klass = FFmpegVideoReader
+        # the buffer file is written next to the video
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'bulk-water.mov')
+        shutil.copy(os.path.join(path, 'bulk-water.mov'), self.filename)
+        self.frame0 = np.load(os.path.join(path, 'bulk-water_frame0.npy'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_buffer(self):
+        v = self.klass(self.filename)
+        assert_equal(len(v), 480)
+        assert_equal(v.frame_shape, (640, 424))
+        self.assertTrue(np.abs(v[0] - self.frame0.astype(float)).mean() < 2)
+        last = v[479]
+        v.close()
+        # the complete buffer is reused
+        v = self.klass(self.filename)
+        self.assertTrue(v._decode_thread is None)
+        assert_equal(v[479], last)
+        v.close()
+
+    def test_seek(self):
+        v = self.klass(self.filename)
+        v_seek = self.klass(self.filename, mode='seek')
+        for i in [0, 100, 479, 241]:
+            assert_equal(v_seek[i], v[i])
+        indices = [5, 6, 7, 300, 3]
+        assert_equal(v_seek.get_frames(indices), v.get_frames(indices))
+        v.close()
+
+    def test_reduced(self):
+        v = self.klass(self.filename, as_grey=True, mode='seek')
+        assert_equal(v[0].shape, (424, 640))
+        expected = (self.frame0 * [0.2125, 0.7154, 0.0721]).sum(2)
+        self.assertTrue(np.abs(v[0] - expected).mean() < 5)
+        v = self.klass(self.filename, mode='seek', crop=(10, 20, 100, 50))
+        assert_equal(v.frame_shape, (100, 50))
+        full = self.klass(self.filename, mode='seek')[0]
+        assert_equal(v[0], full[20:70, 10:110])
+        v = self.klass(self.filename, pix_fmt='gray16le', downscale=2)
+        frame = v[479]
+        assert_equal(frame.shape, (212, 320))
+        self.assertEqual(frame.dtype, np.uint16)
+        v.close()
+
+    def test_reduced_same_as_pyav(self):
+        # both readers crop first and then downscale
+        _skip_if_no_PyAV()
+        from pims.pyav_reader import PyAVVideoReader
+        for kwargs in [dict(crop=(11, 21, 100, 50)), dict(downscale=2),
+                       dict(crop=(11, 21, 100, 50), downscale=3)]:
+            v = self.klass(self.filename, mode='seek', **kwargs)
+            v_pyav = PyAVVideoReader(self.filename, **kwargs)
+            for i in [0, 241]:
+                assert_equal(v_pyav[i].shape, v[i].shape)
+                # allow for different versions of the ffmpeg libraries
+                self.assertTrue(np.abs(v_pyav[i] - v[i].astype(float))
+                                .mean() < 1)
+            v_pyav.close()
+            v.close()
+
 
 class _tiff_image_series(_image_series):
     def test_metadata(self):
@@ -685,7 +846,8 @@ class TestTiffStack_pil(_tiff_image_series, unittest.TestCase):
         self.expected_len = 5
 
 
-class TestTiffStack_tifffile(_tiff_image_series, unittest.TestCase):
+class TestTiffStack_tifffile(_tiff_image_series, _image_out,
+                             unittest.TestCase):
     def check_skip(self):
         pass
 
@@ -700,8 +862,96 @@ class TestTiffStack_tifffile(_tiff_image_series, unittest.TestCase):
         self.expected_shape = (512, 512)
         self.expected_len = 5
 
+    def test_frame_metadata_table(self):
+        table = self.v.frame_metadata_table()
+        assert_equal(table['frame_no'], np.arange(5))
+        # only the first page is tagged
+        assert_equal(table['ImageDescription'][0],
+                     self.v[0].metadata['ImageDescription'])
+        assert_equal(table['DateTime'][0],
+                     np.datetime64(self.v[0].metadata['DateTime']))
+        assert table['ImageDescription'][4] is None
+        assert np.isnat(table['DateTime'][4])
 
-class TestSpeStack(_image_series, unittest.TestCase):
+
+class TestTiffStack_tifffile_compressed(unittest.TestCase):
+    def setUp(self):
+        _skip_if_no_tifffile()
+        import tifffile
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'compressed.tif')
+        ramp = np.arange(128, dtype=np.uint16)
+        self.data = ramp[None, None, :] + ramp[None, :, None] + \
+            np.arange(12, dtype=np.uint16)[:, None, None]
+        tifffile.imwrite(self.filename, self.data, compression='zlib',
+                         tile=(32, 32))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_get_frames(self):
+        v = pims.TiffStack_tifffile(self.filename, maxworkers=4)
+        assert_equal(v.get_frames(), self.data)
+        out = np.empty((3, 128, 128), np.uint16)
+        result = v.get_frames([7, 2, 3], out=out)
+        self.assertTrue(result is out)
+        assert_equal(out, self.data[[7, 2, 3]])
+        assert_equal(v.get_frames([4, 5], out=np.empty((2, 128, 128))),
+                     self.data[4:6])
+
+    def test_get_frame(self):
+        for maxworkers in [1, 4]:
+            v = pims.TiffStack_tifffile(self.filename, maxworkers=maxworkers)
+            assert_equal(v[5], self.data[5])
+
+    def test_no_mmap(self):
+        self.assertRaises(ValueError, pims.TiffStack_tifffile, self.filename,
+                          mmap=True)
+
+
+class TestTiffStack_tifffile_mmap(unittest.TestCase):
+    def setUp(self):
+        _skip_if_no_tifffile()
+        import tifffile
+        self.tempdir = tempfile.mkdtemp()
+        self.data = np.random.randint(0, 2**16, (3, 4, 32, 24)).astype('u2')
+        self.imagej = os.path.join(self.tempdir, 'hyperstack.tif')
+        tifffile.imwrite(self.imagej, self.data, imagej=True,
+                         metadata=dict(axes='TZYX'))
+        self.bigtiff = os.path.join(self.tempdir, 'big.tif')
+        tifffile.imwrite(self.bigtiff, self.data.reshape(12, 32, 24)
+                         .astype('>u2'), bigtiff=True, byteorder='>')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_frames(self):
+        expected = self.data.reshape(12, 32, 24)
+        for filename in [self.imagej, self.bigtiff]:
+            v = pims.TiffStack_tifffile(filename, mmap=True)
+            assert_equal(len(v), 12)
+            assert_equal(v.frame_shape, (32, 24))
+            assert_equal(v[7], expected[7])
+            assert_equal(v[[9, 2]], expected[[9, 2]])
+            assert_equal(v.get_frames(), expected)
+            v.close()
+
+    def test_views(self):
+        v = pims.TiffStack_tifffile(self.imagej, mmap=True)
+        frame = v[1]
+        self.assertFalse(frame.flags.writeable)
+        stack = v.get_frames(slice(1, 3))
+        self.assertTrue(np.may_share_memory(stack, frame))
+        v.close()
+
+    def test_dtype_conversion(self):
+        v = pims.TiffStack_tifffile(self.imagej, dtype=np.float64, mmap=True)
+        assert_equal(v[3].dtype, np.float64)
+        assert_equal(v.get_frames([3])[0], self.data[0, 3])
+        v.close()
+
+
+class TestSpeStack(_image_series, _image_out, unittest.TestCase):
     def check_skip(self):
         pass
 
@@ -731,6 +981,39 @@ class TestSpeStack(_image_series, unittest.TestCase):
         assert_equal(m, d)
 
 
+class TestSpeStack_mmap(TestSpeStack):
+    def setUp(self):
+        super(TestSpeStack_mmap, self).setUp()
+        self.kwargs = dict(mmap=True)
+        self.v = self.klass(self.filename, **self.kwargs)
+
+    def test_views(self):
+        frame = self.v[1]
+        assert not frame.flags.writeable
+        stack = np.asarray(self.v[1:3])
+        assert np.may_share_memory(stack, frame)
+        assert_image_equal(stack[0], self.frame1)
+
+    def test_array_copy(self):
+        frames = self.v[1:3]
+        assert np.may_share_memory(frames.__array__(copy=False), self.v[1])
+        copied = frames.__array__(copy=True)
+        assert not np.may_share_memory(copied, self.v[1])
+        assert_image_equal(copied[0], self.frame1)
+        # a dtype conversion or reading from the file needs a copy
+        self.assertRaises(ValueError, frames.__array__, np.float64, False)
+        v = self.klass(self.filename)
+        self.assertRaises(ValueError, v.__array__, copy=False)
+        assert_image_equal(v.__array__(copy=True)[1], self.frame1)
+        v.close()
+
+    def test_dtype_conversion(self):
+        v = self.klass(self.filename, dtype=np.float64, mmap=True)
+        stack = v.get_frames()
+        assert_equal(stack.dtype, np.float64)
+        assert_equal(stack[0], self.frame0)
+        v.close()
+
 
 class TestOpenFiles(unittest.TestCase):
     def setUp(self):
@@ -755,7 +1038,7 @@ class TestOpenFiles(unittest.TestCase):
         pims.open(os.path.join(path, 'stuck.tif'))
 
 
-class ImageSequenceND(_image_series, unittest.TestCase):
+class ImageSequenceND(_image_series, _image_out, unittest.TestCase):
     def setUp(self):
         _skip_if_no_imread()
         self.filepath = os.path.join(path, 'image_sequence3d')
@@ -854,6 +1137,58 @@ class ImageSequenceND_RGB(_image_series, unittest.TestCase):
         clean_dummy_png(self.filepath, self.filenames)
 
 
+class ImageSequenceND_Layout(unittest.TestCase):
+    def setUp(self):
+        _skip_if_no_imread()
+        self.filepath = os.path.join(path, 'image_sequence3d')
+        self.filenames = []
+
+    def open(self, filenames, **kwargs):
+        self.filenames = filenames
+        frames = save_dummy_png(self.filepath, filenames, (10, 11))
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            v = pims.ImageSequenceND(os.path.join(self.filepath, '*.png'),
+                                     **kwargs)
+        # only the warnings of pims, not deprecations of the imread backend
+        return v, frames, [str(warning.message) for warning in w
+                           if issubclass(warning.category, UserWarning)]
+
+    def test_missing_axis(self):
+        # there is no z index in the filenames
+        v, frames, messages = self.open(['file_t001_c1.png',
+                                         'file_t001_c2.png',
+                                         'file_t002_c1.png',
+                                         'file_t002_c2.png'])
+        assert_equal(v.sizes, dict(t=2, c=2, y=10, x=11))
+        assert_equal(v.get_frame_2D(t=1, c=0), frames[2])
+        assert messages == []
+
+    def test_missing_plane(self):
+        v, frames, messages = self.open(['file_t001_z001.png',
+                                         'file_t001_z002.png',
+                                         'file_t002_z001.png'],
+                                        axes_identifiers='tz')
+        assert len(messages) == 1
+        assert '1 of 4 planes' in messages[0]
+        assert '(t=1, z=1)' in messages[0]
+        assert_equal(v.get_frame_2D(t=1, z=0), frames[2])
+        self.assertRaises(IndexError, v.get_frame_2D, t=1, z=1)
+
+    def test_sparse(self):
+        v, frames, messages = self.open(['file_t0001_z0001.png',
+                                         'file_t3001_z2001.png'],
+                                        axes_identifiers='tz')
+        assert v._lookup_dict is not None
+        assert_equal(v.sizes['t'], 3001)
+        assert_equal(v.get_frame_2D(t=3000, z=2000), frames[1])
+        self.assertRaises(IndexError, v.get_frame_2D, t=1, z=0)
+        assert len(messages) == 1
+
+    def tearDown(self):
+        clean_dummy_png(self.filepath, self.filenames)
+
+
 if __name__ == '__main__':
     nose.runmodule(argv=[__file__, '-vvs', '-x', '--pdb', '--pdb-failure'],
                    exit=False)
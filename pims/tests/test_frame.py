@@ -2,9 +2,10 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import six
+import pickle
 import nose
 import numpy as np
-from pims.frame import Frame
+from pims.frame import Frame, LazyMetadata
 from nose.tools import assert_true, assert_equal
 
 
@@ -72,3 +73,42 @@ def test_copy_update_md():
 
     tt2 = Frame(tt_base, frame_no=frame_no, metadata=md_dict3)
     assert_equal(tt2.metadata, md_dict3)
+
+
+def test_lazy_metadata():
+    calls = []
+    def field():
+        calls.append('field')
+        return 2
+    def loader():
+        calls.append('loader')
+        return {'b': 3, 'a': 4}
+    md = LazyMetadata({'a': 1}, {'lazy': field}, loader)
+    tt = Frame(np.ones((5, 3)), metadata=md)
+    assert_true(isinstance(tt.metadata, LazyMetadata))
+    assert_equal(tt.metadata['a'], 1)
+    assert_equal(calls, [])
+    assert_equal(tt.metadata['lazy'], 2)
+    assert_equal(tt.metadata['lazy'], 2)
+    assert_equal(calls, ['field'])
+    # the loader does not override known values
+    assert_equal(tt.metadata, {'a': 1, 'b': 3, 'lazy': 2})
+    assert_equal(calls, ['field', 'loader'])
+
+
+def test_lazy_metadata_update():
+    md = LazyMetadata({'a': 1}, {'b': lambda: 2})
+    tt_base = Frame(np.ones((5, 3)), metadata=md)
+    tt = Frame(tt_base, metadata={'b': 3, 'c': 4})
+    assert_equal(tt.metadata, {'a': 1, 'b': 3, 'c': 4})
+    assert_equal(tt_base.metadata, {'a': 1, 'b': 2})
+    tt = Frame(np.ones((5, 3)), metadata={'a': 0, 'b': 0})
+    tt = Frame(tt, metadata=md)
+    assert_equal(tt.metadata, {'a': 1, 'b': 2})
+
+
+def test_lazy_metadata_pickle():
+    md = LazyMetadata({'a': 1}, {'b': lambda: 2})
+    tt = pickle.loads(pickle.dumps(Frame(np.ones((5, 3)), metadata=md)))
+    assert_equal(type(tt.metadata), dict)
+    assert_equal(tt.metadata, {'a': 1, 'b': 2})
@@ -0,0 +1,73 @@
+# Regression tests for the time it takes to `import pims`: slow optional
+# dependencies must only be imported when they are used.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import nose
+from numpy.testing import assert_equal
+import pims
+
+SLOW_MODULES = ['matplotlib', 'skimage', 'scipy', 'tifffile', 'libtiff',
+                'av', 'jpype', 'IPython', 'pims_nd2']
+
+
+def _run(code):
+    """Run code in a fresh interpreter and return what it prints."""
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return output.decode('ascii').strip()
+
+
+class TestLazyImports(unittest.TestCase):
+    def loaded_modules(self, code):
+        code += ('\nimport sys\n'
+                 'print(",".join(m for m in {0!r} if m in sys.modules))'
+                 ).format(SLOW_MODULES)
+        loaded = _run(code)
+        return loaded.split(',') if loaded else []
+
+    def test_import_pims(self):
+        assert_equal(self.loaded_modules('import pims'), [])
+
+    def test_lazy_reader(self):
+        loaded = self.loaded_modules('import pims\npims.TiffStack_tifffile')
+        assert 'av' not in loaded
+        assert 'jpype' not in loaded
+
+    def test_submodule_errors(self):
+        if sys.version_info < (3, 7):
+            raise nose.SkipTest('Submodules are imported by `import pims`.')
+        self.assertRaises(AttributeError, getattr, pims, 'no_such_module')
+        # an ImportError in a submodule is not hidden
+        tempdir = tempfile.mkdtemp()
+        with open(os.path.join(tempdir, 'broken_module.py'), 'w') as f:
+            f.write('import no_such_dependency\n')
+        pims.__path__.append(tempdir)
+        try:
+            self.assertRaises(ImportError, getattr, pims, 'broken_module')
+        finally:
+            pims.__path__.remove(tempdir)
+            shutil.rmtree(tempdir)
+
+    def test_ffmpeg_not_probed(self):
+        # finding the ffmpeg binary spawns processes
+        code = ('import pims.ffmpeg_reader as f\n'
+                'print(f._ffmpeg_searched)')
+        assert_equal(_run(code), 'False')
+
+    def test_import_time(self):
+        code = ('import time\n'
+                'start = time.time()\n'
+                'import pims\n'
+                'print(time.time() - start)')
+        reference = ('import time\n'
+                     'start = time.time()\n'
+                     'import numpy\n'
+                     'print(time.time() - start)')
+        duration = min(float(_run(code)) for _ in range(3))
+        numpy_duration = min(float(_run(reference)) for _ in range(3))
+        # importing pims should not cost much more than importing numpy
+        assert duration < numpy_duration + 0.5, duration
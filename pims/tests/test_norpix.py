@@ -1,6 +1,8 @@
 # Tests for norpix_reader.py
 
 import os
+import struct
+import tempfile
 from datetime import datetime
 import unittest
 import nose
@@ -24,7 +26,7 @@ class _common_norpix_sample_tests(object):
     def test_metadata(self):
         s = self.seq
         assert isinstance(len(s), int)
-        assert np.issubdtype(s.pixel_type, np.dtype)
+        assert isinstance(s.pixel_type, np.dtype)
         assert s.width > 0
         assert s.height > 0
         assert len(s.filename)
@@ -49,6 +51,64 @@ class _common_norpix_sample_tests(object):
             assert fr.shape[1] == s.width
             assert fr.shape[0] == s.height
 
+    def test_frame_metadata(self):
+        s = self.seq
+        md = s[1].metadata
+        assert md['time_float'] == s.get_time_float(1)
+        assert md['time'] == s.get_time(1)
+        s = pims.open(self.sample_filename, metadata=False, **self.options)
+        assert s[1].metadata == {}
+        s.close()
+
+    def test_lazy_time(self):
+        # the timestamp is read when it is used, not with the image
+        s = self.seq
+        old = s._read_time_float
+        s._read_time_float = None
+        try:
+            md = s[2].metadata
+        finally:
+            s._read_time_float = old
+        assert md['time_float'] == s.get_time_float(2)
+
+    def test_frame_metadata_table(self):
+        s = self.seq
+        table = s.frame_metadata_table()
+        assert np.all(table['frame_no'] == np.arange(len(s)))
+        assert np.all(table['time_float'] == s.dump_times_float())
+
+    def test_get_frames(self):
+        s = self.seq
+        frames = s.get_frames()
+        assert frames.shape == (len(s), s.height, s.width)
+        for i in range(len(s)):
+            assert np.all(frames[i] == s[i])
+        indices = [3, 1, 2, 2, 0]
+        frames = s.get_frames(indices)
+        for i, j in enumerate(indices):
+            assert np.all(frames[i] == s[j])
+
+    def test_get_frames_bounded_reads(self):
+        # long runs are read in pieces of at most RUN_READ_SIZE bytes
+        s = self.seq
+        expected = s.get_frames()
+        old = pims.norpix_reader.RUN_READ_SIZE
+        pims.norpix_reader.RUN_READ_SIZE = 1
+        try:
+            out = np.empty_like(expected)
+            frames = s.get_frames(out=out)
+        finally:
+            pims.norpix_reader.RUN_READ_SIZE = old
+        assert np.all(frames == expected)
+
+    def test_get_frame_out(self):
+        s = self.seq
+        out = np.empty((s.height, s.width), s.pixel_type)
+        for i in range(len(s)):
+            fr = s.get_frame(i, out=out)
+            assert np.may_share_memory(fr, out)
+            assert np.all(out == s[i])
+
     def test_get_time(self):
         """Check all 3 ways to get time of a frame."""
         s = self.seq
@@ -73,7 +133,11 @@ class _common_norpix_sample_tests(object):
         assert s.get_time_float(4) == list(sli.get_time_float[:])[0]
 
     def test_dump_times(self):
-        assert isinstance(self.seq.dump_times_float(), np.ndarray)
+        times = self.seq.dump_times_float()
+        assert isinstance(times, np.ndarray)
+        assert len(times) == len(self.seq)
+        for i in range(len(self.seq)):
+            assert times[i] == self.seq.get_time_float(i)
 
     def test_repr(self):
         assert len(repr(self.seq))
@@ -139,3 +203,38 @@ class test_process_func(_norpix6_sample_tests, unittest.TestCase):
         assert np.all(fr <= 0)
 
 
+class test_mmap(_norpix6_sample_tests, unittest.TestCase):
+    def setUp(self):
+        self.options = {'mmap': True}
+        super(test_mmap, self).setUp()
+
+    def test_read_only_views(self):
+        fr = self.seq[1]
+        assert not fr.flags.writeable
+        reference = pims.NorpixSeq(self.sample_filename)
+        for i in range(len(self.seq)):
+            assert np.all(self.seq[i] == reference[i])
+            assert self.seq.get_time(i) == reference.get_time(i)
+        reference.close()
+
+
+class test_unsupported_format(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(tests_path, 'data', 'sample_norpix6.seq'),
+                  'rb') as f:
+            data = bytearray(f.read())
+        # mark the images as compressed
+        offset = struct.calcsize('<' + ''.join(
+            fmt for name, fmt in pims.norpix_reader.HEADER_FIELDS[:10]))
+        data[offset:offset + 4] = struct.pack('<L', 200)
+        fd, self.filename = tempfile.mkstemp(suffix='.seq')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bytes(data))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_probe(self):
+        # probe refuses the files that the reader refuses
+        self.assertRaises(IOError, pims.NorpixSeq.probe, self.filename)
+        self.assertRaises(IOError, pims.NorpixSeq, self.filename)
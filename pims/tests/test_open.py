@@ -0,0 +1,222 @@
+# Tests for how pims.open picks a reader.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import numpy as np
+from numpy.testing import assert_equal
+import pims
+from pims.base_frames import FramesSequence
+from pims.tests import use_temporary_index_cache, restore_index_cache
+
+path, _ = os.path.split(os.path.abspath(__file__))
+path = os.path.join(path, 'data')
+
+
+def setup_module():
+    use_temporary_index_cache()
+
+
+def teardown_module():
+    restore_index_cache()
+
+
+class _DummyReader(FramesSequence):
+    def __init__(self, filename, process_func=None, dtype=None,
+                 as_grey=False):
+        self.filename = filename
+
+    def get_frame(self, i):
+        return np.zeros((2, 2))
+
+    def __len__(self):
+        return 1
+
+    @property
+    def frame_shape(self):
+        return (2, 2)
+
+    @property
+    def pixel_type(self):
+        return np.float64
+
+
+class BrokenReader(_DummyReader):
+    class_priority = 20
+
+    @classmethod
+    def class_exts(cls):
+        return {'pimstest'}
+
+    def __init__(self, filename, **kwargs):
+        raise IOError("cannot read this")
+
+
+class WorkingReader(_DummyReader):
+    @classmethod
+    def class_exts(cls):
+        return {'pimstest'}
+
+
+class TestOpen(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def copy(self, filename, new_name):
+        new_path = os.path.join(self.tempdir, new_name)
+        shutil.copy(os.path.join(path, filename), new_path)
+        return new_path
+
+    def test_magic_bytes(self):
+        for filename, klass in [('sample_norpix6.seq', pims.NorpixSeq),
+                                ('stuck.tif', pims.TiffStack_tifffile),
+                                ('spestack_test.spe', pims.SpeStack)]:
+            for new_name in ['misnamed.mov', 'no_extension']:
+                v = pims.open(self.copy(filename, new_name))
+                assert isinstance(v, klass), (filename, new_name)
+                v.close()
+
+    def test_magic_bytes_cine(self):
+        from pims.utils.synthetic import write_cine
+        filename = os.path.join(self.tempdir, 'movie.dat')
+        write_cine(filename, np.zeros((2, 3, 4), np.uint8))
+        v = pims.open(filename)
+        assert isinstance(v, pims.Cine)
+        v.close()
+        # other files starting with "CI" are not taken for cine files
+        filename = os.path.join(self.tempdir, 'notes')
+        with open(filename, 'wb') as f:
+            f.write(b'CI notes, not a cine file' * 10)
+        self.assertRaises(pims.api.UnknownFormatError, pims.open, filename)
+
+    def test_unknown(self):
+        filename = os.path.join(self.tempdir, 'unknown')
+        with open(filename, 'wb') as f:
+            f.write(b'\0' * 100)
+        self.assertRaises(pims.api.UnknownFormatError, pims.open, filename)
+
+    def test_fallback(self):
+        filename = os.path.join(self.tempdir, 'test.pimstest')
+        v = pims.open(filename)
+        assert isinstance(v, WorkingReader)
+
+    def test_all_fail(self):
+        class FirstBroken(_DummyReader):
+            class_priority = 20
+
+            @classmethod
+            def class_exts(cls):
+                return {'pimstest3'}
+
+            def __init__(self, filename, **kwargs):
+                raise IOError("first")
+
+        class SecondBroken(FirstBroken):
+            class_priority = 1
+
+            def __init__(self, filename, **kwargs):
+                raise ValueError("second")
+
+        filename = os.path.join(self.tempdir, 'test.pimstest3')
+        # the error of the reader with the highest priority is raised
+        self.assertRaises(IOError, pims.open, filename)
+
+    def test_registry_invalidation(self):
+        filename = os.path.join(self.tempdir, 'test.pimstest2')
+        self.assertRaises(pims.api.UnknownFormatError, pims.open, filename)
+
+        class NewReader(_DummyReader):
+            @classmethod
+            def class_exts(cls):
+                return {'pimstest2'}
+
+        assert isinstance(pims.open(filename), NewReader)
+
+    def test_lazy_reader_module(self):
+        # readers in modules that are not imported yet are found by open
+        assert 'nd2' in pims.api._reader_modules['pims_nd2']
+        assert 'lif' in pims.api._reader_modules['pims.bioformats']
+        with open(os.path.join(self.tempdir, 'pims_lazy_reader.py'),
+                  'w') as f:
+            f.write('from pims.tests.test_open import _DummyReader\n\n\n'
+                    'class LazyReader(_DummyReader):\n'
+                    '    @classmethod\n'
+                    '    def class_exts(cls):\n'
+                    '        return {"pimslazy"}\n')
+        sys.path.insert(0, self.tempdir)
+        pims.api._reader_modules['pims_lazy_reader'] = {'pimslazy'}
+        try:
+            assert 'pims_lazy_reader' not in sys.modules
+            v = pims.open(os.path.join(self.tempdir, 'test.pimslazy'))
+            assert_equal(type(v).__name__, 'LazyReader')
+            assert 'pims_lazy_reader' in sys.modules
+        finally:
+            del pims.api._reader_modules['pims_lazy_reader']
+            sys.path.remove(self.tempdir)
+            sys.modules.pop('pims_lazy_reader', None)
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def check(self, filename):
+        info = pims.probe(filename)
+        with pims.open(filename) as v:
+            assert info.reader == type(v).__name__
+            assert info.length == len(v)
+            assert info.shape == v[0].shape
+            assert info.dtype == v[0].dtype
+        assert info.file_size == os.path.getsize(filename)
+        return info
+
+    def test_headers(self):
+        for filename in ['sample_norpix6.seq', 'stuck.tif',
+                         'spestack_test.spe']:
+            self.check(os.path.join(path, filename))
+
+    def test_cine(self):
+        from pims.utils.synthetic import write_cine
+        filename = os.path.join(self.tempdir, 'movie.cine')
+        write_cine(filename, np.zeros((4, 3, 5), np.uint16), frame_rate=25)
+        info = self.check(filename)
+        assert info.frame_rate == 25
+
+    def test_image_sequence(self):
+        from pims.tests.test_common import (save_dummy_png,
+                                            _skip_if_no_skimage)
+        _skip_if_no_skimage()
+        filenames = ['img%d.png' % i for i in range(3)]
+        save_dummy_png(self.tempdir, filenames, (10, 11))
+        info = pims.probe(os.path.join(self.tempdir, '*.png'))
+        assert info.reader == 'ImageSequence'
+        assert info.length == 3
+        assert info.shape == (10, 11)
+        assert info.dtype == np.uint8
+        assert info.file_size == sum(
+            os.path.getsize(os.path.join(self.tempdir, fn))
+            for fn in filenames)
+
+    def test_default(self):
+        filename = os.path.join(self.tempdir, 'test.pimstest')
+        open(filename, 'wb').close()
+        info = pims.probe(filename)
+        assert info == pims.ProbeInfo(filename, 'WorkingReader', 1, (2, 2),
+                                      np.float64, None, 0)
+
+    def test_probe_many(self):
+        filenames = [os.path.join(path, 'stuck.tif'),
+                     os.path.join(self.tempdir, 'missing.tif'),
+                     os.path.join(path, 'sample_norpix6.seq')]
+        infos = pims.probe_many(filenames, workers=3, skip_errors=True)
+        assert [info is None for info in infos] == [False, True, False]
+        assert infos[2].length == 6
+        self.assertRaises(Exception, pims.probe_many, filenames)
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from numpy.testing import assert_equal
+import pims
+from pims.utils.synthetic import write_cine
+
+
+def column_sums(frame):
+    return frame.sum(axis=0)
+
+
+def frame_number(frame):
+    return frame.frame_no
+
+
+def fail_on_three(frame):
+    if frame.frame_no == 3:
+        raise ValueError("frame 3")
+    return frame.frame_no
+
+
+class TestMapFrames(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.cine')
+        rs = np.random.RandomState(0)
+        self.frames = rs.randint(0, 4096, (9, 12, 10)).astype(np.uint16)
+        write_cine(self.filename, self.frames)
+        self.v = pims.Cine(self.filename)
+
+    def tearDown(self):
+        self.v.close()
+        os.remove(self.filename)
+        os.rmdir(self.tempdir)
+
+    def test_ordered(self):
+        results = list(pims.map_frames(column_sums, self.v, processes=2))
+        assert_equal(np.array(results), self.frames.sum(axis=1))
+
+    def test_slice(self):
+        results = list(pims.map_frames(frame_number, self.v[7:1:-2],
+                                       processes=2))
+        assert_equal(results, [7, 5, 3])
+
+    def test_unordered(self):
+        results = pims.map_frames(column_sums, self.v[::2], processes=3,
+                                  ordered=False)
+        results = dict(results)
+        assert_equal(sorted(results), list(range(5)))
+        for i, result in results.items():
+            assert_equal(result, self.frames[2 * i].sum(axis=0))
+
+    def test_return_frames(self):
+        results = pims.map_frames(frame_number, self.v, processes=2,
+                                  return_frames=True)
+        for i, (frame, result) in enumerate(results):
+            assert isinstance(frame, pims.Frame)
+            assert_equal(frame, self.frames[i])
+            assert_equal(frame.frame_no, i)
+            assert_equal(result, i)
+
+    def test_exception(self):
+        results = pims.map_frames(fail_on_three, self.v, processes=2)
+        self.assertRaises(ValueError, list, results)
+
+    def test_not_a_reader(self):
+        self.assertRaises(ValueError, next,
+                          pims.map_frames(frame_number, [np.zeros(3)]))
+
+    def test_shared_memory_freed(self):
+        from pims import parallel
+        if parallel.shared_memory is None or not os.path.isdir('/dev/shm'):
+            raise unittest.SkipTest('No POSIX shared memory. Skipping.')
+        before = set(os.listdir('/dev/shm'))
+        # stop early, while results are underway
+        results = pims.map_frames(column_sums, self.v, processes=2)
+        next(results)
+        results.close()
+        # a worker raises, while results are underway
+        results = pims.map_frames(fail_on_three, self.v, processes=2)
+        self.assertRaises(ValueError, list, results)
+        leaked = [name for name in set(os.listdir('/dev/shm')) - before
+                  if name.startswith('pims')]
+        assert_equal(leaked, [])
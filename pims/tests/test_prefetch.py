@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+import unittest
+import numpy as np
+from numpy.testing import assert_equal
+import pims
+from pims.base_frames import FramesSequence, FramesSequenceND
+from pims.frame import Frame
+from pims.tests import use_temporary_index_cache, restore_index_cache
+
+
+def setup_module():
+    use_temporary_index_cache()
+
+
+def teardown_module():
+    restore_index_cache()
+
+
+class SlowReader(FramesSequence):
+    """Returns frames filled with their frame number, with a random delay."""
+    thread_safe = True
+
+    def __init__(self, count=20, fail_at=None):
+        self._count = count
+        self.fail_at = fail_at
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_frame(self, i):
+        with self._lock:
+            self.calls += 1
+        time.sleep(np.random.uniform(0, 0.005))
+        if i == self.fail_at:
+            raise IOError("cannot read frame {0}".format(i))
+        return Frame(np.full((3, 4), i, dtype=np.int64), frame_no=i)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def frame_shape(self):
+        return (3, 4)
+
+    @property
+    def pixel_type(self):
+        return np.int64
+
+
+class DummyND(FramesSequenceND):
+    @property
+    def pixel_type(self):
+        return np.int64
+
+    def __init__(self, shape, **axes):
+        self._init_axis('y', shape[0])
+        self._init_axis('x', shape[1])
+        for name in axes:
+            self._init_axis(name, axes[name])
+
+    def get_frame_2D(self, **ind):
+        return np.full((self.sizes['y'], self.sizes['x']),
+                       10 * ind['t'] + ind['c'], dtype=self.pixel_type)
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.v = SlowReader()
+
+    def test_order(self):
+        numbers = [int(f[0, 0]) for f in pims.prefetch(self.v, workers=4)]
+        assert_equal(numbers, list(range(len(self.v))))
+
+    def test_method(self):
+        numbers = [f.frame_no for f in self.v.iter_prefetch(depth=3)]
+        assert_equal(numbers, list(range(len(self.v))))
+
+    def test_slice(self):
+        numbers = [int(f[0, 0]) for f in self.v[15:2:-3].iter_prefetch()]
+        assert_equal(numbers, list(range(15, 2, -3)))
+        numbers = [int(f[0, 0]) for f in pims.prefetch(self.v[[4, 1, 1]])]
+        assert_equal(numbers, [4, 1, 1])
+
+    def test_nd(self):
+        v = DummyND((3, 4), t=5, c=2)
+        v.iter_axes = 't'
+        v.bundle_axes = 'cyx'
+        frames = list(v.iter_prefetch())
+        assert_equal(len(frames), 5)
+        for t, frame in enumerate(frames):
+            assert_equal(frame.shape, (2, 3, 4))
+            assert_equal(frame[:, 0, 0], [10 * t, 10 * t + 1])
+
+    def test_bounded(self):
+        it = pims.prefetch(self.v, depth=4, workers=2)
+        next(it)
+        time.sleep(0.1)
+        # one frame was consumed, at most `depth` more may be read ahead
+        assert self.v.calls <= 5
+        it.close()
+
+    def test_early_stop(self):
+        before = threading.active_count()
+        for frame in pims.prefetch(self.v, depth=4, workers=3):
+            if frame.frame_no == 2:
+                break
+        assert_equal(threading.active_count(), before)
+        assert self.v.calls < len(self.v)
+
+    def test_exception(self):
+        v = SlowReader(fail_at=5)
+        before = threading.active_count()
+        it = pims.prefetch(v, workers=3)
+        for i in range(5):
+            assert_equal(next(it).frame_no, i)
+        self.assertRaises(IOError, next, it)
+        assert_equal(threading.active_count(), before)
+
+    def test_invalid_arguments(self):
+        # raised by the call, not when iteration starts
+        self.assertRaises(ValueError, pims.prefetch, self.v, depth=0)
+        self.assertRaises(ValueError, pims.prefetch, self.v, workers=0)
+
+    def test_no_threads_before_iteration(self):
+        before = threading.active_count()
+        it = pims.prefetch(self.v, workers=3)
+        assert_equal(threading.active_count(), before)
+        assert_equal(self.v.calls, 0)
+        assert_equal(next(it).frame_no, 0)
+        it.close()
+        assert_equal(threading.active_count(), before)
+
+    def test_not_thread_safe(self):
+        # readers that are not thread safe are read by a single thread
+        v = SlowReader()
+        v.thread_safe = False
+        threads = set()
+        get_frame = v.get_frame
+        def record_thread(i):
+            threads.add(threading.current_thread())
+            return get_frame(i)
+        v.get_frame = record_thread
+        numbers = [f.frame_no for f in pims.prefetch(v[::2], workers=4)]
+        assert_equal(numbers, list(range(0, len(v), 2)))
+        assert_equal(len(threads), 1)
+
+
+class TestPrefetchVideo(unittest.TestCase):
+    def setUp(self):
+        import pims.pyav_reader
+        if not pims.pyav_reader.available():
+            raise unittest.SkipTest('PyAV not found. Skipping.')
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'data', 'bulk-water.mov')
+        self.v = pims.Video(path)
+
+    def test_pyav(self):
+        frames = list(self.v[230:250].iter_prefetch(workers=4))
+        assert_equal(len(frames), 20)
+        expected = pims.Video(self.v.filename)
+        for i, frame in zip(range(230, 250), frames):
+            assert_equal(frame, expected[i])
@@ -7,7 +7,7 @@ import os
 from datetime import datetime
 import itertools
 import numpy as np
-from pims.frame import Frame
+from pims.frame import Frame, LazyMetadata
 
 try:
     from PIL import Image  # should work with PIL or PILLOW
@@ -37,12 +37,21 @@ def tifffile_available():
     return tifffile is not None
 
 
-from pims.base_frames import FramesSequence
+from pims.base_frames import (FramesSequence, ProbeInfo, _normalize_indices,
+                              _identity)
 
 _dtype_map = {4: np.uint8,
               8: np.uint8,
               16: np.uint16}
 
+# Tags that are read into the metadata of every frame, with the names that
+# older versions of tifffile use for them.
+_metadata_tags = [('ImageDescription', 'image_description'),
+                  ('DateTime', 'datetime'),
+                  ('Software', 'software'),
+                  ('DocumentName', 'document_name')]
+
+
 def _tiff_datetime(dt_str):
     """Convert the DateTime string of TIFF files to a datetime object"""
     return datetime(year=int(dt_str[0:4]), month=int(dt_str[5:7]),
@@ -68,6 +77,21 @@ class TiffStack_tifffile(FramesSequence):
     as_grey : boolean, optional
         Convert color images to greyscale. False by default.
         May not be used in conjection with process_func.
+    maxworkers : int, optional
+        Number of threads that decode compressed data. get_frames decodes
+        pages concurrently, and get_frame decodes the tiles or strips of a
+        page concurrently. By default, tifffile chooses; 1 disables
+        threading.
+    mmap : boolean, optional
+        Memory-map the whole stack. This requires uncompressed pages that
+        are stored one after the other, as in ImageJ hyperstacks and most
+        files written by camera software. Frames and slices of consecutive
+        frames are then read-only views into the file, unless a dtype
+        conversion or process_func is requested, and the pages are not
+        parsed up front. False by default.
+    metadata : boolean, optional
+        Attach the tags of the page to every frame as metadata. The tags
+        are only read when the metadata is used. True by default.
 
     Examples
     --------
@@ -108,16 +132,40 @@ class TiffStack_tifffile(FramesSequence):
         return {'tif', 'tiff', 'lsm',
                 'stk'} | super(TiffStack_tifffile, cls).class_exts()
 
+    @classmethod
+    def probe(cls, filename):
+        """Read the length, frame shape and dtype from the page headers,
+        without decoding any page. See FramesSequence.probe."""
+        with tifffile.TiffFile(filename) as tiff_file:
+            record = tiff_file.series[0]
+            if hasattr(record, 'pages'):
+                pages = record.pages
+            else:
+                pages = record['pages']
+            page = pages[0]
+            return ProbeInfo(filename, cls.__name__, len(pages),
+                             tuple(page.shape), np.dtype(page.dtype), None,
+                             os.path.getsize(filename))
+
     def __init__(self, filename, process_func=None, dtype=None,
-                 as_grey=False):
+                 as_grey=False, maxworkers=None, mmap=False, metadata=True):
         self._filename = filename
-        record = tifffile.TiffFile(filename).series[0]
-        if hasattr(record, 'pages'):
-            self._tiff = record.pages
+        self._with_metadata = metadata
+        self._maxworkers = maxworkers
+        self._tiff_file = tifffile.TiffFile(filename)
+        record = self._tiff_file.series[0]
+        self._data = None
+        if mmap:
+            self._data = self._map_series(record)
+            tmp = record.keyframe
+            self._tiff = self._tiff_file.pages
         else:
-            self._tiff = record['pages']
+            if hasattr(record, 'pages'):
+                self._tiff = record.pages
+            else:
+                self._tiff = record['pages']
+            tmp = self._tiff[0]
 
-        tmp = self._tiff[0]
         if dtype is None:
             self._dtype = tmp.dtype
         else:
@@ -128,33 +176,120 @@ class TiffStack_tifffile(FramesSequence):
         self._validate_process_func(process_func)
         self._as_grey(as_grey, process_func)
 
-    def get_frame(self, j):
+    def _map_series(self, series):
+        """Memory-map all pages of a series."""
+        # tifffile only reports the offset of the data of a series if it is
+        # stored uncompressed, in one contiguous block.
+        offset = getattr(series, 'dataoffset', None)
+        if offset is None:
+            raise ValueError("Only uncompressed TIFF files with contiguous "
+                             "pages can be memory-mapped.")
+        page = series.keyframe
+        dtype = np.dtype(series.dtype).newbyteorder(self._tiff_file.byteorder)
+        count = int(np.prod(series.shape)) // int(np.prod(page.shape))
+        return np.memmap(self._filename, dtype=dtype, mode='r', offset=offset,
+                         shape=(count,) + tuple(page.shape))
+
+    def get_frame(self, j, out=None):
+        if self._data is not None:
+            return Frame(self._process_frame(np.asarray(self._data[j]), out),
+                         frame_no=j, metadata=self._frame_metadata(j))
         t = self._tiff[j]
-        data = t.asarray()
-        return Frame(self.process_func(data).astype(self._dtype),
-                      frame_no=j, metadata=self._read_metadata(t))
+        if (out is not None and self.process_func is _identity and
+                out.dtype == t.dtype):
+            data = t.asarray(out=out, maxworkers=self._maxworkers)
+        else:
+            data = self.process_func(t.asarray(maxworkers=self._maxworkers))
+            if data.dtype != self._dtype:
+                data = data.astype(self._dtype)
+            if out is not None:
+                out[...] = data
+                data = out
+        return Frame(data, frame_no=j, metadata=self._frame_metadata(j))
+
+    def get_frames(self, indices=None, out=None):
+        """Read several frames into a single array, letting tifffile read
+        the pages in one pass and decode them on a pool of threads.
+        See FramesSequence.get_frames."""
+        indices = _normalize_indices(indices, len(self))
+        if self._data is not None:
+            return self._get_mapped_frames(self._data, indices, out)
+        if len(indices) == 0:
+            return super(TiffStack_tifffile, self).get_frames(indices, out)
+        page = self._tiff[0]
+        shape = (len(indices),) + tuple(page.shape)
+        if (self.process_func is _identity and out is not None and
+                out.dtype == page.dtype and out.shape == shape and
+                out.flags.c_contiguous):
+            # Decode straight into the output array.
+            block = out
+        else:
+            block = np.empty(shape, page.dtype)
+        # tifffile reshapes `out` in place to the shape of a single page
+        self._tiff_file.asarray(key=indices.tolist(), series=0,
+                                out=block[0] if len(indices) == 1 else block,
+                                maxworkers=self._maxworkers)
+        if self.process_func is _identity:
+            return self._process_block(block, out)
+        for n, frame in enumerate(block):
+            result = self.process_func(frame).astype(self._dtype)
+            if out is None:
+                out = np.empty((len(block),) + result.shape, result.dtype)
+            out[n] = result
+        return out
+
+    def _frame_metadata(self, j):
+        """Return the metadata of frame j, which is read when it is used."""
+        if not self._with_metadata:
+            return None
+        return LazyMetadata(loader=lambda: self._read_metadata(self._page(j)))
+
+    def frame_metadata_table(self):
+        """Return the metadata of all frames at once, as a dict of arrays.
+
+        The keys are 'frame_no' and the tags that are in the metadata of
+        any frame. Tags are object arrays, with None for pages without the
+        tag, except for 'DateTime', which is a datetime64 array with NaT for
+        pages without it.
+        """
+        rows = [self._read_metadata(self._page(j)) for j in range(len(self))]
+        table = {'frame_no': np.arange(len(self))}
+        for name, _ in _metadata_tags:
+            if not any(name in row for row in rows):
+                continue
+            if name == 'DateTime':
+                table[name] = np.array([row.get(name, 'NaT') for row in rows],
+                                       dtype='datetime64[s]')
+            else:
+                column = np.empty(len(rows), dtype=object)
+                column[:] = [row.get(name) for row in rows]
+                table[name] = column
+        return table
+
+    def _page(self, j):
+        """Return page j with its tags. Once the file has been read as a
+        series, tifffile hands out TiffFrames, which lack most tags."""
+        page = self._tiff[j]
+        if hasattr(page, 'aspage'):
+            page = page.aspage()
+        return page
 
     def _read_metadata(self, tiff):
         """Read metadata for current frame and return as dict"""
         md = {}
-        try:
-            md["ImageDescription"] = (
-                tiff.tags["image_description"].value.decode())
-        except:
-            pass
-        try:
-            dt = tiff.tags["datetime"].value.decode()
-            md["DateTime"] = _tiff_datetime(dt)
-        except:
-            pass
-        try:
-            md["Software"] = tiff.tags["software"].value.decode()
-        except:
-            pass
-        try:
-            md["DocumentName"] = tiff.tags["document_name"].value.decode()
-        except:
-            pass
+        for name, old_name in _metadata_tags:
+            tag = tiff.tags.get(name) or tiff.tags.get(old_name)
+            if tag is None:
+                continue
+            value = tag.value
+            if isinstance(value, bytes):
+                value = value.decode()
+            if name == 'DateTime':
+                try:
+                    value = _tiff_datetime(value)
+                except ValueError:
+                    continue
+            md[name] = value
         return md
 
     @property
@@ -166,8 +301,15 @@ class TiffStack_tifffile(FramesSequence):
         return self._im_sz
 
     def __len__(self):
+        if self._data is not None:
+            return len(self._data)
         return len(self._tiff)
 
+    def close(self):
+        super(TiffStack_tifffile, self).close()
+        self._tiff_file.close()
+        self._data = None
+
     def __repr__(self):
         # May be overwritten by subclasses
         return """<Frames>
@@ -0,0 +1,152 @@
+"""Persistent cache for indices that are expensive to build when a file is
+opened, such as the table of contents of a video.
+
+Indices are stored as .npz files in a cache directory. They are keyed on
+the path, size and modification time of the file they describe, the name of
+the reader and a version number that the reader increments when the format
+of its index changes. Reopening a known file costs a stat and loading the
+arrays. For a directory, the modification time changes when files are added,
+removed or renamed, but not when a file is rewritten in place; only index
+what depends on the names of its files.
+
+The cache directory is taken from the PIMS_CACHE_DIR environment variable.
+It defaults to ~/.cache/pims/index (or %LOCALAPPDATA%/pims/index on
+Windows). Set PIMS_INDEX_CACHE=0 or `pims.utils.index_cache.enabled = False`
+to disable the cache.
+
+The cache holds at most `max_bytes` of indices (PIMS_INDEX_CACHE_SIZE,
+default 64 MiB). When an index is saved, the least recently used indices
+are removed until the cache fits.
+"""
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+enabled = os.environ.get('PIMS_INDEX_CACHE', '1') != '0'
+max_bytes = int(os.environ.get('PIMS_INDEX_CACHE_SIZE', 2**26))
+
+
+def cache_directory():
+    """Return the directory in which indices are stored."""
+    if os.environ.get('PIMS_CACHE_DIR'):
+        return os.environ['PIMS_CACHE_DIR']
+    if os.name == 'nt' and 'LOCALAPPDATA' in os.environ:
+        base = os.environ['LOCALAPPDATA']
+    else:
+        base = os.environ.get('XDG_CACHE_HOME',
+                              os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pims', 'index')
+
+
+def _key(path, name, version, extra):
+    st = os.stat(path)
+    mtime = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1e9))
+    return '\n'.join([os.path.abspath(path), str(st.st_size), str(mtime),
+                      name, str(version), extra])
+
+
+def _index_path(key):
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_directory(), digest + '.npz')
+
+
+def load_index(path, name, version, extra=''):
+    """Load the index that was saved for a file.
+
+    Parameters
+    ----------
+    path : string
+        The file (or directory) that the index describes.
+    name : string
+        Name of the reader that built the index.
+    version : int
+        Version of the index format.
+    extra : string, optional
+        Anything else that the index depends on, e.g. a glob pattern.
+
+    Returns
+    -------
+    dict of arrays, or None if there is no valid index for this file.
+    """
+    if not enabled:
+        return None
+    try:
+        key = _key(path, name, version, extra)
+        filename = _index_path(key)
+        with np.load(filename, allow_pickle=False) as data:
+            if data['_key'][()] != key:
+                return None
+            index = dict((k, data[k]) for k in data.files if k != '_key')
+        # mark the index as recently used, see _prune
+        os.utime(filename, None)
+        return index
+    except Exception:
+        # missing, unreadable or corrupt: build the index again
+        return None
+
+
+def save_index(path, name, version, arrays, extra=''):
+    """Store the index of a file. See load_index.
+
+    `arrays` is a dict of numpy arrays. Failures are silently ignored, as the
+    index can always be rebuilt.
+    """
+    if not enabled:
+        return
+    try:
+        key = _key(path, name, version, extra)
+        filename = _index_path(key)
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Write to a temporary file first, so that readers never see a
+        # partially written index.
+        fd, tmp_filename = tempfile.mkstemp(suffix='.npz', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, _key=np.array(key), **arrays)
+            _replace(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+        _prune(directory)
+    except Exception:
+        pass
+
+
+def _prune(directory):
+    """Remove the least recently used indices until the cache holds at
+    most max_bytes."""
+    entries = []
+    for filename in os.listdir(directory):
+        if not filename.endswith('.npz'):
+            continue
+        filename = os.path.join(directory, filename)
+        try:
+            st = os.stat(filename)
+        except OSError:  # removed by another process
+            continue
+        entries.append((st.st_mtime, st.st_size, filename))
+    total = sum(size for _, size, _ in entries)
+    for _, size, filename in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+        total -= size
+
+
+def _replace(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # Python 2
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
@@ -1,3 +1,13 @@
+import os
+import struct
+from threading import Lock
+
+import numpy as np
+
+# Maximum number of bytes read at once when readers read runs of frames
+RUN_READ_SIZE = 2 ** 24
+
+
 class FileLocker(object):
     """
     A context manager to lock and unlock a file
@@ -14,4 +24,92 @@ class FileLocker(object):
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.lock.release()
-        return False
\ No newline at end of file
+        return False
+
+
+def read_fields(f, fields, offset=0):
+    """Read a header of little-endian (name, struct format) fields at
+    `offset` in file `f` into a dict."""
+    f.seek(offset)
+    tmp = dict()
+    for name, format in fields:
+        s = struct.Struct('<' + format)
+        vals = s.unpack(f.read(s.size))
+        tmp[name] = vals[0] if len(vals) == 1 else vals
+
+    return tmp
+
+
+class PositionalFile(object):
+    """
+    Read from a file at absolute offsets, without using its position.
+
+    Threads can read from the same file at once: on Unix, reads are done
+    with os.preadv or os.pread and take no lock. Elsewhere (e.g. on
+    Windows), they fall back to a seek and a read while holding `lock`,
+    which should then guard every other use of the file object `f`.
+    """
+    def __init__(self, f, lock=None):
+        self._file = f
+        self._lock = lock if lock is not None else Lock()
+        self._fd = f.fileno()
+
+    def readinto(self, arr, offset):
+        """
+        Fill a C-contiguous numpy array with data read at `offset`, without
+        allocating a new array.
+        """
+        if not arr.flags.c_contiguous:
+            # reshape would read into a copy and leave arr untouched
+            raise ValueError("Can only read into a C-contiguous array")
+        buf = arr.reshape(-1).view(np.uint8)
+        if hasattr(os, 'preadv'):
+            count = 0
+            while count < buf.size:
+                n = os.preadv(self._fd, [memoryview(buf[count:])],
+                              offset + count)
+                if n == 0:
+                    break
+                count += n
+        elif hasattr(os, 'pread'):
+            count = 0
+            while count < buf.size:
+                data = os.pread(self._fd, buf.size - count, offset + count)
+                if not data:
+                    break
+                buf[count:count + len(data)] = np.frombuffer(data, np.uint8)
+                count += len(data)
+        else:
+            with FileLocker(self._lock):
+                self._file.seek(offset)
+                count = self._file.readinto(buf)
+        if count != buf.size:
+            raise IOError("Unexpected end of file: read {0} of {1} "
+                          "bytes".format(count, buf.size))
+        return arr
+
+    def read(self, size, offset):
+        """Read `size` bytes at `offset`."""
+        return self.readinto(np.empty(size, np.uint8), offset).tobytes()
+
+
+def reduced_size(width, height, crop=None, downscale=1):
+    """
+    Validate a crop rectangle and a downscale factor for frames of the
+    given size.
+
+    `crop` is (x, y, width, height) in pixels of the full frame, or None.
+    Returns the crop rectangle (the full frame if `crop` is None) and the
+    (width, height) of the frames after cropping and downscaling.
+    """
+    if crop is None:
+        crop = (0, 0, width, height)
+    x, y, w, h = [int(v) for v in crop]
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > width or y + h > height:
+        raise ValueError("crop {0} does not fit in frames of {1}x{2} "
+                         "pixels".format(tuple(crop), width, height))
+    downscale = int(downscale)
+    if downscale < 1 or downscale > min(w, h):
+        raise ValueError("downscale must be an integer between 1 and the "
+                         "size of the (cropped) frames")
+    return (x, y, w, h), (w // downscale, h // downscale)
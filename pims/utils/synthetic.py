@@ -0,0 +1,90 @@
+"""Write small synthetic files, for the tests and the benchmarks."""
+import struct
+
+import numpy as np
+
+from pims.cine import HEADER_FIELDS, BITMAP_INFO_FIELDS, SETUP_FIELDS, MAX_INT
+
+
+def _pack_fields(fields, values):
+    """Pack a list of (name, format) fields, filling missing values with
+    zeros."""
+    result = b''
+    for name, fmt in fields:
+        s = struct.Struct('<' + fmt)
+        if name in values:
+            vals = values[name]
+            if not isinstance(vals, tuple):
+                vals = (vals, )
+        else:
+            vals = s.unpack(b'\0' * s.size)
+        result += s.pack(*vals)
+    return result
+
+
+def write_cine(filename, frames, frame_rate=1000, annotation=b'test',
+               image_data=None, compression=0, cfa=0, exposures=True):
+    """Write a minimal uncompressed monochrome cine file.
+
+    `frames` is an array of shape (N, height, width) of uint8 or uint16.
+    Optionally, `image_data` gives the raw bytes of every image instead.
+    For raw color files, pass compression=2 and a cfa value, and the mosaics
+    as `frames`. With exposures=False, no exposure times are stored.
+    """
+    frames = np.asarray(frames)
+    count, height, width = frames.shape
+    if image_data is None:
+        # cine files store images bottom-up
+        image_data = [f[::-1].astype(f.dtype.newbyteorder('<')).tobytes()
+                      for f in frames]
+
+    header_size = struct.calcsize('<' + ''.join(f for _, f in HEADER_FIELDS))
+    bitmap_size = struct.calcsize('<' +
+                                  ''.join(f for _, f in BITMAP_INFO_FIELDS))
+    setup_size = struct.calcsize('<' + ''.join(f for _, f in SETUP_FIELDS))
+
+    off_image_header = header_size
+    off_setup = off_image_header + bitmap_size
+    off_tags = off_setup + setup_size
+
+    seconds = 1400000000 + np.arange(count) // 10
+    fractions = (np.arange(count) % 10) * (MAX_INT // 10)
+    times = [(int(s) << 32) | int(f) for s, f in zip(seconds, fractions)]
+    tags = struct.pack('<IHH', 8 + 8 * count, 1002, int(exposures))
+    tags += struct.pack('<%dQ' % count, *times)
+    if exposures:
+        exposures = [MAX_INT // 2000] * count
+        tags += struct.pack('<IHH', 8 + 4 * count, 1003, 0)
+        tags += struct.pack('<%dI' % count, *exposures)
+    else:
+        exposures = None
+
+    off_image_offsets = off_tags + len(tags)
+    image_start = off_image_offsets + 8 * count
+    locations = []
+    images = b''
+    for data in image_data:
+        locations.append(image_start + len(images))
+        images += struct.pack('<I', len(annotation) + 8) + annotation
+        images += struct.pack('<I', len(data)) + data
+
+    bit_count = 8 * frames.dtype.itemsize
+    header = _pack_fields(HEADER_FIELDS, dict(
+        type=b'CI', header_size=header_size, compression=compression,
+        version=1,
+        total_image_count=count, image_count=count,
+        off_image_header=off_image_header, off_setup=off_setup,
+        off_image_offsets=off_image_offsets,
+        trigger_time=(1400000000 << 32)))
+    bitmap = _pack_fields(BITMAP_INFO_FIELDS, dict(
+        bi_size=bitmap_size, bi_width=width, bi_height=height, bi_planes=1,
+        bi_bit_count=bit_count, bi_image_size=len(image_data[0])))
+    setup = _pack_fields(SETUP_FIELDS, dict(
+        length=setup_size, frame_rate=frame_rate, cfa=cfa,
+        real_bpp=bit_count))
+
+    with open(filename, 'wb') as f:
+        f.write(header + bitmap + setup + tags)
+        f.write(struct.pack('<%dQ' % count, *locations))
+        f.write(images)
+    return times, exposures
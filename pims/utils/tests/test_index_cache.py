@@ -0,0 +1,116 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from numpy.testing import assert_equal
+
+from pims.utils import index_cache
+from pims.utils.index_cache import load_index, save_index
+
+
+class _CacheDirectory(object):
+    """Point the index cache at a fresh directory, next to a data file."""
+    def __enter__(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.old = os.environ.get('PIMS_CACHE_DIR')
+        os.environ['PIMS_CACHE_DIR'] = os.path.join(self.tempdir, 'cache')
+        self.filename = os.path.join(self.tempdir, 'data.bin')
+        with open(self.filename, 'wb') as f:
+            f.write(b'\x00' * 16)
+        return self.filename
+
+    def __exit__(self, *exc):
+        if self.old is None:
+            del os.environ['PIMS_CACHE_DIR']
+        else:
+            os.environ['PIMS_CACHE_DIR'] = self.old
+        shutil.rmtree(self.tempdir)
+
+
+def test_roundtrip():
+    with _CacheDirectory() as filename:
+        assert load_index(filename, 'Reader', 1) is None
+        toc = np.arange(10, dtype=np.int64)
+        save_index(filename, 'Reader', 1, dict(toc=toc))
+        index = load_index(filename, 'Reader', 1)
+        assert_equal(index['toc'], toc)
+        assert list(index.keys()) == ['toc']
+
+
+def test_key():
+    with _CacheDirectory() as filename:
+        save_index(filename, 'Reader', 1, dict(toc=np.arange(3)), extra='a')
+        assert load_index(filename, 'Reader', 1, extra='a') is not None
+        assert load_index(filename, 'Reader', 2, extra='a') is None
+        assert load_index(filename, 'Other', 1, extra='a') is None
+        assert load_index(filename, 'Reader', 1, extra='b') is None
+
+
+def test_invalidated_by_change():
+    with _CacheDirectory() as filename:
+        save_index(filename, 'Reader', 1, dict(toc=np.arange(3)))
+        with open(filename, 'ab') as f:
+            f.write(b'\x01')
+        assert load_index(filename, 'Reader', 1) is None
+
+        save_index(filename, 'Reader', 1, dict(toc=np.arange(3)))
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 10))
+        assert load_index(filename, 'Reader', 1) is None
+
+
+def test_corrupt_index():
+    with _CacheDirectory() as filename:
+        save_index(filename, 'Reader', 1, dict(toc=np.arange(3)))
+        key = index_cache._key(filename, 'Reader', 1, '')
+        with open(index_cache._index_path(key), 'wb') as f:
+            f.write(b'garbage')
+        assert load_index(filename, 'Reader', 1) is None
+
+
+def test_disabled():
+    with _CacheDirectory() as filename:
+        index_cache.enabled = False
+        try:
+            save_index(filename, 'Reader', 1, dict(toc=np.arange(3)))
+            assert load_index(filename, 'Reader', 1) is None
+        finally:
+            index_cache.enabled = True
+        assert not os.path.exists(os.environ['PIMS_CACHE_DIR'])
+
+
+def test_directory():
+    with _CacheDirectory() as filename:
+        directory = os.path.join(os.path.dirname(filename), 'images')
+        os.mkdir(directory)
+        with open(os.path.join(directory, 'img_0.png'), 'wb') as f:
+            f.write(b'\x00' * 4)
+        save_index(directory, 'Reader', 1, dict(toc=np.arange(3)))
+        assert load_index(directory, 'Reader', 1) is not None
+        # adding a file changes the mtime of the directory
+        st = os.stat(directory)
+        with open(os.path.join(directory, 'img_1.png'), 'wb') as f:
+            f.write(b'\x00' * 4)
+        os.utime(directory, (st.st_atime, st.st_mtime + 10))
+        assert load_index(directory, 'Reader', 1) is None
+
+
+def test_size_limit():
+    with _CacheDirectory() as filename:
+        old_max_bytes = index_cache.max_bytes
+        index_cache.max_bytes = 3000
+        try:
+            for version in range(5):
+                save_index(filename, 'Reader', version,
+                           dict(toc=np.arange(100, dtype=np.int64)))
+            # each index takes about 1 kB; the oldest ones were removed
+            cache_files = os.listdir(os.environ['PIMS_CACHE_DIR'])
+            assert 0 < len(cache_files) < 5
+            assert load_index(filename, 'Reader', 4) is not None
+            assert load_index(filename, 'Reader', 0) is None
+        finally:
+            index_cache.max_bytes = old_max_bytes
@@ -0,0 +1,83 @@
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+from numpy.testing import assert_equal, assert_raises
+
+from pims.utils.misc import PositionalFile
+
+
+class _DataFile(object):
+    """A temporary file with 1000 bytes of known data, opened for reading."""
+    def __enter__(self):
+        fd, self.filename = tempfile.mkstemp()
+        self.data = np.arange(1000).astype(np.uint8)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.data.tobytes())
+        self.f = open(self.filename, 'rb')
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+        os.remove(self.filename)
+
+
+def test_positional_file():
+    with _DataFile() as df:
+        reader = PositionalFile(df.f)
+        arr = np.empty((2, 5), np.uint8)
+        assert reader.readinto(arr, 100) is arr
+        assert_equal(arr.ravel(), df.data[100:110])
+        # the position of the file is not used
+        df.f.seek(500)
+        assert_equal(reader.read(2, 0), df.data[:2].tobytes())
+        assert df.f.tell() == 500
+        assert_raises(IOError, reader.readinto, np.empty(10, np.uint8), 995)
+
+
+def test_positional_file_not_contiguous():
+    with _DataFile() as df:
+        reader = PositionalFile(df.f)
+        arr = np.zeros((4, 6), np.uint8)
+        assert_raises(ValueError, reader.readinto, arr[:, :3], 0)
+        assert_raises(ValueError, reader.readinto, arr.T, 0)
+        assert_equal(arr, 0)
+
+
+def test_positional_file_fallback():
+    # Platforms without positional reads seek and read under the lock.
+    saved = dict((name, getattr(os, name)) for name in ['preadv', 'pread']
+                 if hasattr(os, name))
+    try:
+        for name in saved:
+            delattr(os, name)
+        with _DataFile() as df:
+            reader = PositionalFile(df.f)
+            assert_equal(reader.read(4, 10), df.data[10:14].tobytes())
+    finally:
+        for name, func in saved.items():
+            setattr(os, name, func)
+
+
+def test_positional_file_threads():
+    with _DataFile() as df:
+        reader = PositionalFile(df.f)
+        errors = []
+
+        def read(offset):
+            for _ in range(200):
+                expected = df.data[offset:offset + 10].tobytes()
+                if reader.read(10, offset) != expected:
+                    errors.append(offset)
+
+        threads = [threading.Thread(target=read, args=(offset, ))
+                   for offset in range(0, 800, 100)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors